@@ -0,0 +1,118 @@
+import re
+
+# Champs du dossier patient -> placeholder utilisé dans les prompts
+PLACEHOLDERS = {
+    "name": "<PATIENT_NAME>",
+    "first_name": "<PATIENT_FIRST_NAME>",
+    "last_name": "<PATIENT_LAST_NAME>",
+    "age": "<AGE>",
+    "phone": "<PATIENT_PHONE>",
+    "address": "<PATIENT_ADDRESS>",
+    "city": "<PATIENT_CITY>",
+    "doctor": "<DOCTOR_NAME>",
+}
+
+
+class Anonymizer:
+    """
+    Anonymiseur par session, construit à partir du dossier patient.
+
+    Toutes les valeurs sensibles sont recherchées en une seule passe par une
+    expression régulière combinée (alternatives triées de la plus longue à la
+    plus courte), et la table placeholder -> valeur sert à la restauration.
+    """
+
+    def __init__(self, forward: dict, reverse: dict):
+        # forward : texte sensible -> texte anonymisé ; reverse : placeholder -> valeur réelle
+        self._forward = {value.lower(): replacement for value, replacement in forward.items() if value}
+        self._reverse = dict(reverse)
+        alternatives = sorted(self._forward, key=len, reverse=True)
+        self._forward_re = (
+            re.compile(r"(?<!\w)(?:" + "|".join(re.escape(a) for a in alternatives) + r")(?!\w)", re.IGNORECASE)
+            if alternatives else None
+        )
+        self._reverse_re = (
+            re.compile("|".join(re.escape(p) for p in sorted(self._reverse, key=len, reverse=True)))
+            if self._reverse else None
+        )
+        self.max_placeholder_len = max((len(p) for p in self._reverse), default=0)
+        self._cache = {}
+
+    @classmethod
+    def from_patient(cls, patient: dict) -> "Anonymizer":
+        forward, reverse = {}, {}
+        for field, placeholder in PLACEHOLDERS.items():
+            value = patient.get(field)
+            if value in (None, ""):
+                continue
+            value = str(value)
+            reverse[placeholder] = value
+            if field == "age":
+                # L'âge seul est trop ambigu ("75 mg"), on ne remplace que "75 ans"
+                forward[f"{value} ans"] = f"{placeholder} ans"
+            else:
+                forward[value] = placeholder
+        return cls(forward, reverse)
+
+    def maps(self) -> tuple:
+        """(forward, reverse), sérialisables : `Anonymizer(*anonymizer.maps())` le reconstruit."""
+        return dict(self._forward), dict(self._reverse)
+
+    def sanitize(self, text: str) -> str:
+        if not text:
+            return ""
+        if self._forward_re is None:
+            return text
+        return self._forward_re.sub(lambda m: self._forward[m.group(0).lower()], text)
+
+    def sanitize_cached(self, text: str) -> str:
+        """Pour les textes qui reviennent à chaque tour (étapes du plan)."""
+        if text not in self._cache:
+            self._cache[text] = self.sanitize(text)
+        return self._cache[text]
+
+    def restore(self, text: str) -> str:
+        if not text:
+            return ""
+        if self._reverse_re is None:
+            return text
+        return self._reverse_re.sub(lambda m: self._reverse[m.group(0)], text)
+
+    def stream_restorer(self) -> "StreamRestorer":
+        return StreamRestorer(self)
+
+    async def restore_stream(self, deltas):
+        """Restaure un flux de deltas au fil de l'eau (générateur asynchrone)."""
+        restorer = self.stream_restorer()
+        async for delta in deltas:
+            text = restorer.feed(delta)
+            if text:
+                yield text
+        rest = restorer.flush()
+        if rest:
+            yield rest
+
+
+class StreamRestorer:
+    """
+    Restauration incrémentale : seul un éventuel début de placeholder en fin de
+    chunk ("<PATIE") est retenu jusqu'au chunk suivant, le reste est émis aussitôt.
+    """
+
+    def __init__(self, anonymizer: Anonymizer):
+        self.anonymizer = anonymizer
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + chunk
+        cut = text.rfind("<")
+        if cut != -1 and ">" not in text[cut:] and len(text) - cut < self.anonymizer.max_placeholder_len:
+            self._pending = text[cut:]
+            text = text[:cut]
+        else:
+            self._pending = ""
+        return self.anonymizer.restore(text)
+
+    def flush(self) -> str:
+        text, self._pending = self._pending, ""
+        return self.anonymizer.restore(text)
@@ -0,0 +1,152 @@
+from collections import deque
+
+
+class Turn:
+    """Un échange patient / assistante, sans dictionnaire par instance."""
+
+    __slots__ = ("patient", "ai")
+
+    def __init__(self, patient: str, ai: str):
+        self.patient = patient
+        self.ai = ai
+
+    def __repr__(self) -> str:
+        return f"Turn(patient={self.patient!r}, ai={self.ai!r})"
+
+
+def approx_tokens(text: str) -> int:
+    """Estimation grossière (≈ 4 caractères par token), suffisante pour un budget."""
+    return len(text) // 4 + 1
+
+
+# Libellés des champs du résumé structuré (LLM/summary.py) dans le prompt
+SUMMARY_LABELS = {
+    "next_appointment_datetime": "Prochain rendez-vous",
+    "conditions": "Santé",
+    "food": "Alimentation",
+    "sleep": "Sommeil",
+    "interests": "Centres d'intérêt",
+    "key_points": "Points clés",
+}
+
+
+class ConversationContext:
+    """
+    Historique de conversation borné, stocké sous forme de messages de chat.
+
+    Les `max_turns` derniers tours sont gardés mot pour mot ; au-delà (ou si le
+    budget `token_budget` est dépassé) les plus anciens sont repliés par lots.
+    Un tour replié est condensé par le résumé structuré de l'appel
+    (`summary_source`, cf. IncrementalSummarizer : champs anonymisés et nombre
+    de tours déjà extraits) : le prompt reprend ces champs (santé, alimentation,
+    rendez-vous, points clés...) au lieu du texte des tours. Seuls les tours
+    repliés que l'extraction n'a pas encore couverts restent en extraits mot
+    pour mot, bornés à `summary_token_budget` : les plus anciens sont tronqués
+    si l'extraction prend du retard ou échoue, et tous le sont sans
+    `summary_source` (résumé incrémental désactivé). Le résumé n'est recalculé
+    qu'à un repli ou quand l'extraction couvre des extraits en attente : le
+    préfixe du prompt change rarement. Le coût du prompt reste donc constant
+    sur les appels longs.
+
+    Chaque tour passe une seule fois par `sanitize` à l'ajout : l'historique
+    renvoyé par `history_messages` est déjà anonymisé.
+    """
+
+    def __init__(self, max_turns: int = 6, token_budget: int = 1500, summary_token_budget: int = 300,
+                 sanitize=None, summary_source=None):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+        self.sanitize = sanitize or (lambda text: text)
+        self.summary_source = summary_source  # () -> (champs, tours extraits), ou None
+        self._turns = deque()  # (Turn anonymisé, tokens)
+        self._excerpts = deque()  # (index du tour, ligne, tokens) des tours repliés non encore résumés
+        self._excerpt_tokens = 0
+        self._turn_tokens = 0
+        self.folded_turns = 0
+        self.truncated_turns = 0  # tours repliés perdus faute de résumé
+        self._summary = ""
+        self._stale = False
+
+    def add_turn(self, patient_text: str, ai_text: str):
+        turn = Turn(self.sanitize(patient_text), self.sanitize(ai_text))
+        tokens = approx_tokens(turn.patient) + approx_tokens(turn.ai)
+        self._turns.append((turn, tokens))
+        self._turn_tokens += tokens
+        if len(self._turns) > self.max_turns or self._turn_tokens > self.token_budget:
+            self._fold()
+
+    def _fold(self):
+        # Repli par lots : le résumé (et donc le préfixe du prompt) change rarement
+        batch = max(1, len(self._turns) // 2)
+        for _ in range(batch):
+            turn, tokens = self._turns.popleft()
+            self._turn_tokens -= tokens
+            line = f"- Patient : {turn.patient} / Assistante : {turn.ai}"
+            # Un tour trop long pour le budget est coupé plutôt que de le dépasser à lui seul
+            max_chars = max(1, self.summary_token_budget - 1) * 4
+            if len(line) > max_chars:
+                line = line[:max_chars - 1] + "…"
+            self._excerpts.append((self.folded_turns, line, approx_tokens(line)))
+            self._excerpt_tokens += approx_tokens(line)
+            self.folded_turns += 1
+        self._prune()
+        self._stale = True
+
+    def _summary_state(self) -> tuple:
+        if self.summary_source is None:
+            return {}, 0
+        return self.summary_source() or ({}, 0)
+
+    def _prune(self, extracted: int = 0):
+        # Tours déjà couverts par le résumé structuré, puis extraits au-delà du budget
+        while self._excerpts and self._excerpts[0][0] < extracted:
+            self._excerpt_tokens -= self._excerpts.popleft()[2]
+        while self._excerpt_tokens > self.summary_token_budget and self._excerpts:
+            self._excerpt_tokens -= self._excerpts.popleft()[2]
+            self.truncated_turns += 1
+
+    @property
+    def summary(self) -> str:
+        fields, extracted = self._summary_state()
+        if not self._stale and not (self._excerpts and self._excerpts[0][0] < extracted):
+            return self._summary
+        self._stale = False
+        self._prune(extracted)
+        lines = []
+        if self.folded_turns and extracted:
+            for field, label in SUMMARY_LABELS.items():
+                value = fields.get(field)
+                if value:
+                    lines.append(f"- {label} : {'; '.join(value) if isinstance(value, list) else value}")
+        if self._excerpts:
+            lines.append("Extraits des échanges suivants :" if lines else "Extraits des échanges précédents :")
+            lines += [line for _, line, _ in self._excerpts]
+        self._summary = "Résumé des échanges précédents :\n" + "\n".join(lines) if lines else ""
+        return self._summary
+
+    def history_messages(self) -> list:
+        """Messages (anonymisés) à placer entre le préfixe statique et le tour courant."""
+        messages = []
+        summary = self.summary
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        for turn, _ in self._turns:
+            messages.append({"role": "user", "content": turn.patient})
+            messages.append({"role": "assistant", "content": turn.ai})
+        return messages
+
+    def memory_usage(self) -> int:
+        """Taille approximative en octets des textes conservés."""
+        size = sum(len(line) for _, line, _ in self._excerpts)
+        return size + sum(len(turn.patient) + len(turn.ai) for turn, _ in self._turns)
+
+    def __len__(self) -> int:
+        return self.folded_turns + len(self._turns)
+
+    def __str__(self) -> str:
+        summary = self.summary
+        lines = [summary] if summary else []
+        for turn, _ in self._turns:
+            lines.append(f"Question: {turn.patient}\nRéponse: {turn.ai}")
+        return "\n".join(lines)
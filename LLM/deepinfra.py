@@ -1,15 +1,29 @@
 import time
 import json
-from openai import OpenAI
+import logging
+import asyncio
+import threading
+import httpx
 import datetime
 import locale
+from LLM.http_pool import get_shared_http_client, warm_connections, keep_connections_warm
+from LLM.json_stream import parse_json_object
+from LLM.summary import SUMMARY_UPDATE_SCHEMA
 
 class DeepInfraLLM:
-    def __init__(self, api_key, base_url, model="meta-llama/Meta-Llama-3-8B-Instruct", temperature=0.1):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+    def __init__(self, api_key, base_url, model="meta-llama/Meta-Llama-3-8B-Instruct", temperature=0.1,
+                 structured_output="json_schema"):
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client = None
+        self._client_lock = threading.Lock()
         self.model = model
         self.temperature = temperature
-        self.system_prompt_template = """
+        # Sorties JSON : "json_schema" (schéma imposé), "json_object" (JSON libre) ou "none"
+        self.structured_output = structured_output
+        # Préfixe statique (persona, règles, profil anonymisé) : identique à chaque tour,
+        # il peut donc profiter du cache de préfixe du fournisseur
+        self.static_prompt = """
 Langue: francaise
 Vous êtes un assistant médical amical, empathique et professionnel. Vous effectuez des appels téléphoniques de suivi auprès de personnes âgées. Vous parlez un excellent français sans fautes d’orthographe, en utilisant le vouvoiement. 
 - Réponses courtes et concises
@@ -23,42 +37,130 @@ Votre style doit être naturel et fluide, comme lors d'une vraie conversation t
 - Ne pas répéter les réponses déjà données
 
 Suivez précisément le plan de conversation et adaptez-vous à la réponse de l'utilisateur. Parfois, la réponse peut être erronée (vu que c'est par téléphone), il faut s'adapter.
-
-Historique de la conversation : {context}
-Sujet à aborder : {step}
-Ce que dit l'utilisateur : {question}
 """
+        # Partie variable, placée en fin de prompt
+        self.turn_prompt_template = """Sujet à aborder : {step}
+Ce que dit l'utilisateur : {question}"""
+        self.system_prompt_template = (
+            self.static_prompt + "\nHistorique de la conversation : {context}\n" + self.turn_prompt_template + "\n"
+        )
 
-    def get_response(self, context, step, question):
+    @property
+    def client(self):
+        # SDK openai (~0,5 s d'import) chargé à la première requête ou au préchauffage, pas à l'import
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        # Client substitué (benchmarks : transport ASGI vers le faux serveur)
+        self._client = client
+
+    def _create_client(self):
+        from openai import OpenAI
+
+        return OpenAI(api_key=self.api_key, base_url=self.base_url)
+
+    def _chat_messages(self, context, step, question) -> list:
+        if isinstance(context, list):
+            # Historique structuré : préfixe statique, historique, puis le tour courant
+            return (
+                [{"role": "system", "content": self.static_prompt}]
+                + context
+                + [{"role": "user", "content": self.turn_prompt_template.format(step=step, question=question)}]
+            )
         system_message = {
             "role": "system",
             "content": self.system_prompt_template.format(context=context, step=step, question=question)
         }
         user_message = {"role": "user", "content": question}
+        return [system_message, user_message]
+
+    def get_response(self, context, step, question):
+        messages = self._chat_messages(context, step, question)
     
         start_time = time.time()
         chat_completion = self.client.chat.completions.create(
             model=self.model,
-            messages=[system_message, user_message],
+            messages=messages,
             stream=False,
             temperature=self.temperature,
         )
-        end_time = time.time()
-        print(f"Réponse IA ({end_time - start_time:.2f}s):")
-        response = chat_completion.choices[0].message.content
-        print(response)
-        return response
+        logging.debug("Réponse IA (%.2fs)", time.time() - start_time)
+        return chat_completion.choices[0].message.content
 
-    def generate_summary_json(self, conversation_history: str) -> dict:
+    async def stream_response(self, context, step, question):
+        """
+        Variante streaming de get_response : générateur asynchrone des deltas de texte.
+        Le client OpenAI étant synchrone, le flux est consommé dans un thread et
+        les deltas sont remis à la boucle d'événements au fil de l'eau.
+        """
+        messages = self._chat_messages(context, step, question)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                stream = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=True,
+                    temperature=self.temperature,
+                )
+                for chunk in stream:
+                    if stop.is_set():
+                        # Le consommateur a abandonné le flux : on libère la connexion
+                        stream.close()
+                        break
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        loop.call_soon_threadsafe(queue.put_nowait, delta)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        start_time = time.time()
+        first_token_time = None
+        loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    logging.debug("Premier token IA (%.2fs)", first_token_time - start_time)
+                yield item
+        finally:
+            stop.set()
+        logging.debug("Réponse IA streamée (%.2fs)", time.time() - start_time)
+
+    @staticmethod
+    def _current_date() -> tuple:
         # Tenter de définir la locale en français pour obtenir le jour en français
         try:
             locale.setlocale(locale.LC_TIME, "fr_FR.UTF-8")
         except Exception as e:
-            print("Erreur lors du réglage de la locale:", e)
+            logging.debug("Erreur lors du réglage de la locale: %s", e)
         
         now_datetime = datetime.datetime.now()
         now = now_datetime.strftime("%Y-%m-%dT%H:%M:%S")
         day_of_week = now_datetime.strftime("%A").lower()  # Exemple : "lundi", "mardi", etc.
+        return now, day_of_week
+
+    def _summary_messages(self, conversation_history: str) -> list:
+        now, day_of_week = self._current_date()
         
         summary_prompt = f"""
     Veuillez analyser l'historique de conversation ci-dessous, qui correspond à un suivi téléphonique d'un patient âgé nommé Paul.
@@ -83,23 +185,172 @@ Ce que dit l'utilisateur : {question}
             "content": "Vous êtes un assistant médical expérimenté, chargé d'extraire les informations clés d'une conversation téléphonique de suivi."
         }
         user_message = {"role": "user", "content": summary_prompt}
+        return [system_message, user_message]
 
+    def _summary_update_messages(self, state: dict, turns: list) -> list:
+        """Extraction incrémentale : état courant (anonymisé) et nouveaux échanges (patient, IA)."""
+        now, day_of_week = self._current_date()
+        exchanges = "\n".join(f"Patient: {patient}\nIA: {ai}" for patient, ai in turns)
+        prompt = f"""
+Aujourd'hui, la date et l'heure actuelles sont {now} et nous sommes {day_of_week}.
+Informations déjà relevées pendant cet appel de suivi :
+{json.dumps(state, ensure_ascii=False)}
+
+Nouveaux échanges :
+{exchanges}
+
+Renvoyez uniquement un objet JSON avec les informations apprises dans les nouveaux échanges :
+- "next_appointment_datetime": date et heure du prochain rendez-vous convenu, au format ISO 8601 (YYYY-MM-DDTHH:MM:SS), sinon null.
+- "food", "sleep", "conditions": alimentation, sommeil, santé et remarques importantes (texte court, valeur mise à jour), sinon null.
+- "interests": centres d'intérêt nouvellement évoqués.
+- "key_points": un ou deux points clés des nouveaux échanges, en phrases courtes.
+N'incluez pas les informations inchangées.
+        """.strip()
+        system_message = {
+            "role": "system",
+            "content": "Vous extrayez des informations structurées d'une conversation téléphonique de suivi médical."
+        }
+        return [system_message, {"role": "user", "content": prompt}]
+
+    def _response_format(self, name: str, schema: dict) -> dict:
+        """Paramètres de sortie structurée de la requête, selon `structured_output`."""
+        if self.structured_output == "json_schema":
+            return {"response_format": {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}}
+        if self.structured_output == "json_object":
+            return {"response_format": {"type": "json_object"}}
+        return {}
+
+    @staticmethod
+    def _parse_summary(response_text: str) -> dict:
+        # Tolère le texte autour du JSON (```json, explications) et une réponse tronquée
+        summary_json = parse_json_object(response_text)
+        if summary_json is None:
+            logging.warning("Erreur lors de la conversion du texte en JSON (%d caractères)", len(response_text))
+            summary_json = {}
+
+        return summary_json
+
+    def generate_summary_json(self, conversation_history: str) -> dict:
         start_time = time.time()
         chat_completion = self.client.chat.completions.create(
             model=self.model,
-            messages=[system_message, user_message],
+            messages=self._summary_messages(conversation_history),
             stream=False,
             temperature=self.temperature,
         )
-        end_time = time.time()
-        print(f"Temps d'appel LLM (summary): {end_time - start_time:.2f} sec")
+        logging.debug("Temps d'appel LLM (summary): %.2f sec", time.time() - start_time)
+        return self._parse_summary(chat_completion.choices[0].message.content.strip())
 
-        response_text = chat_completion.choices[0].message.content.strip()
-        try:
-            summary_json = json.loads(response_text)
-        except Exception as e:
-            print("Erreur lors de la conversion du texte en JSON:", e)
-            print("Réponse brute du LLM :", response_text)
-            summary_json = {}
 
-        return summary_json
\ No newline at end of file
+class AsyncDeepInfraLLM(DeepInfraLLM):
+    """
+    Variante asynchrone native de DeepInfraLLM : mêmes prompts, mais les requêtes
+    passent par AsyncOpenAI sur le pool de connexions keep-alive partagé du processus.
+    Un sémaphore limite le nombre de requêtes simultanées (les appels en attente sont
+    servis dans l'ordre d'arrivée) et chaque requête a un délai configurable.
+    """
+
+    def __init__(self, api_key, base_url, model="meta-llama/Meta-Llama-3-8B-Instruct", temperature=0.1,
+                 max_concurrency=32, request_timeout=30.0, connect_timeout=5.0, max_retries=1,
+                 structured_output="json_schema"):
+        super().__init__(api_key, base_url, model=model, temperature=temperature, structured_output=structured_output)
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self._limiter = asyncio.Semaphore(max_concurrency)
+
+    def _create_client(self):
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=get_shared_http_client(),
+            timeout=httpx.Timeout(self.request_timeout, connect=self.connect_timeout),
+            max_retries=self.max_retries,
+        )
+
+    async def warmup(self):
+        """Crée le client (import du SDK hors de la boucle) et ouvre des connexions TLS avant le premier tour."""
+        await asyncio.to_thread(getattr, self, "client")
+        await warm_connections(self.base_url, self._auth_headers())
+
+    async def keep_warm(self, interval: float = 60.0, delay: float = 0.0):
+        """Boucle de fond qui garde les connexions chaudes (à lancer en tâche), après `delay` secondes."""
+        await asyncio.sleep(delay)
+        await keep_connections_warm(self.base_url, self._auth_headers(), interval=interval)
+
+    def _auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    async def get_response(self, context, step, question, timeout=None):
+        messages = self._chat_messages(context, step, question)
+        async with self._limiter:
+            start_time = time.time()
+            chat_completion = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=False,
+                temperature=self.temperature,
+                timeout=timeout or self.request_timeout,
+            )
+        logging.debug("Réponse IA (%.2fs)", time.time() - start_time)
+        return chat_completion.choices[0].message.content
+
+    async def stream_response(self, context, step, question, timeout=None):
+        messages = self._chat_messages(context, step, question)
+        async with self._limiter:
+            start_time = time.time()
+            first_token_time = None
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                temperature=self.temperature,
+                timeout=timeout or self.request_timeout,
+            )
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                        logging.debug("Premier token IA (%.2fs)", first_token_time - start_time)
+                    yield delta
+            finally:
+                await stream.close()
+        logging.debug("Réponse IA streamée (%.2fs)", time.time() - start_time)
+
+    async def generate_summary_json(self, conversation_history: str, timeout=None) -> dict:
+        async with self._limiter:
+            start_time = time.time()
+            chat_completion = await self.client.chat.completions.create(
+                model=self.model,
+                messages=self._summary_messages(conversation_history),
+                stream=False,
+                temperature=self.temperature,
+                timeout=timeout or self.request_timeout,
+            )
+        logging.debug("Temps d'appel LLM (summary): %.2f sec", time.time() - start_time)
+        return self._parse_summary(chat_completion.choices[0].message.content.strip())
+
+    async def stream_summary_update(self, state: dict, turns: list, timeout=None):
+        """Extraction incrémentale du résumé, en streaming (deltas du JSON)."""
+        async with self._limiter:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=self._summary_update_messages(state, turns),
+                stream=True,
+                temperature=0,
+                timeout=timeout or self.request_timeout,
+                **self._response_format("summary_update", SUMMARY_UPDATE_SCHEMA),
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
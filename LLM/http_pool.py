@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+import httpx
+
+# Un seul pool de connexions keep-alive par processus, partagé par tous les clients LLM
+_shared_client = None
+
+
+def get_shared_http_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 120.0,
+) -> httpx.AsyncClient:
+    """Retourne le client HTTP asynchrone partagé (créé au premier appel)."""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+    return _shared_client
+
+
+async def close_shared_http_client():
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+
+
+async def warm_connections(base_url: str, headers: dict, connections: int = 2):
+    """
+    Ouvre `connections` connexions TLS vers `base_url` via une requête légère
+    (GET /models) ; elles restent ensuite disponibles dans le pool keep-alive.
+    """
+    client = get_shared_http_client()
+    url = base_url.rstrip("/") + "/models"
+    try:
+        await asyncio.gather(*(client.get(url, headers=headers, timeout=10.0) for _ in range(connections)))
+    except Exception as e:
+        logging.warning("Préchauffage des connexions LLM échoué: %s", e)
+
+
+async def keep_connections_warm(base_url: str, headers: dict, interval: float = 60.0, connections: int = 2):
+    """
+    Rafraîchit périodiquement les connexions, avant leur expiration keep-alive,
+    pour que le premier tour d'un appel n'ait pas à payer la poignée de main TLS.
+    """
+    while True:
+        await warm_connections(base_url, headers, connections)
+        await asyncio.sleep(interval)
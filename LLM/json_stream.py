@@ -0,0 +1,119 @@
+import json
+import re
+
+# Virgule finale avant une fermeture ("[1, 2,]"), fréquente dans les sorties de LLM
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+class JSONStreamParser:
+    """
+    Lecture tolérante d'un objet JSON produit par un LLM, delta par delta.
+
+    Le texte avant la première accolade (« Voici le JSON : », ```json) et après
+    l'accolade fermante est ignoré. Tant que l'objet n'est pas fermé, `value()`
+    revient au dernier membre complet (valeur terminée, élément de tableau
+    suivi d'une virgule ou refermé) et referme les tableaux et objets ouverts :
+    un membre en cours (chaîne, nombre ou littéral tronqué) n'est jamais
+    retourné, une valeur coupée ("2026-10-2") pouvant être fausse. Le texte
+    n'est parcouru qu'une fois au fil des deltas.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._start = None
+        self._end = None
+        self._stack = []  # fermetures attendues
+        self._in_string = False
+        self._escape = False
+        self._after_colon = False  # chaîne en cours : valeur d'un membre (et non clé)
+        self._cut = None  # (position, fermetures) du dernier point où l'objet peut être refermé
+
+    @property
+    def complete(self) -> bool:
+        """L'objet de premier niveau a été refermé."""
+        return self._end is not None
+
+    @property
+    def clean(self) -> bool:
+        """Le texte reçu est exactement un objet JSON valide (aucune réparation nécessaire)."""
+        if self._end is None or self._text.strip() != self._text[self._start:self._end]:
+            return False
+        try:
+            json.loads(self._text)
+        except ValueError:
+            return False
+        return True
+
+    def feed(self, delta: str):
+        self._text += delta
+        if self._end is not None:
+            return
+        text = self._text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._start is None:
+                if c == "{":
+                    self._start = i
+                    self._stack = ["}"]
+                    self._cut = (i + 1, ("}",))
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    # Chaîne terminée : élément de tableau ou valeur d'un membre
+                    if self._stack[-1] == "]" or self._after_colon:
+                        self._cut = (i + 1, tuple(self._stack))
+                        self._after_colon = False
+                continue
+            if c == '"':
+                self._in_string = True
+            elif c == ":":
+                self._after_colon = True
+            elif c == "{" or c == "[":
+                self._stack.append("}" if c == "{" else "]")
+                self._after_colon = False
+                self._cut = (i + 1, tuple(self._stack))
+            elif c == "}" or c == "]":
+                self._stack.pop()
+                if not self._stack:
+                    self._end = i + 1
+                    break
+                self._cut = (i + 1, tuple(self._stack))
+            elif c == ",":
+                self._after_colon = False
+                self._cut = (i, tuple(self._stack))
+        self._pos = len(text) if self._end is None else self._end
+
+    def value(self):
+        """Objet lu jusqu'ici (dict), ou None si rien d'exploitable n'a été reçu."""
+        if self._start is None:
+            return None
+        if self._end is not None:
+            return _loads(self._text[self._start:self._end])
+        position, closers = self._cut
+        return _loads(self._text[self._start:position] + "".join(reversed(closers)))
+
+
+def _loads(text: str):
+    for candidate in (text, TRAILING_COMMA.sub(r"\1", text)):
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        return value if isinstance(value, dict) else None
+    return None
+
+
+def parse_json_object(text: str):
+    """
+    Objet JSON contenu dans une réponse de LLM, même entouré de texte ou
+    tronqué ; None si aucun objet n'est exploitable.
+    """
+    parser = JSONStreamParser()
+    parser.feed(text or "")
+    return parser.value()
@@ -1,13 +1,20 @@
 import time
 import json
-from openai import OpenAI
+import logging
+import asyncio
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from LLM.http_pool import get_shared_http_client, warm_connections, keep_connections_warm
+from LLM.json_stream import parse_json_object
 
 class DeepInfraLLM:
     def __init__(self, api_key, base_url, model="meta-llama/Llama-3.3-70B-Instruct-Turbo", temperature=0.1):
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.model = model
         self.temperature = temperature
-        self.system_prompt_template = """
+        # Préfixe statique (persona, règles, profil anonymisé) : identique à chaque tour,
+        # il peut donc profiter du cache de préfixe du fournisseur
+        self.static_prompt = """
 Langue: francaise
 Vous êtes un assistant médical amical, empathique et professionnel. Vous effectuez des appels téléphoniques de suivi auprès de personnes âgées. Vous parlez un excellent français sans fautes d’orthographe, en utilisant le vouvoiement. 
 - Réponses courtes et concises
@@ -20,37 +27,63 @@ Votre style doit être naturel et fluide, comme lors d'une vraie conversation t
 - Ne pas répéter les réponses déjà données
 
 Suivez précisément le plan de conversation et adaptez-vous à la réponse de l'utilisateur. Parfois, la réponse peut être erronée (vu que c'est par téléphone), il faut s'adapter.
-
-Historique de la conversation : {context}
-Sujet à aborder : {step}
-Ce que dit l'utilisateur : {question}
 """
+        # Partie variable, placée en fin de prompt
+        self.turn_prompt_template = """Sujet à aborder : {step}
+Ce que dit l'utilisateur : {question}"""
+        self.system_prompt_template = (
+            self.static_prompt + "\nHistorique de la conversation : {context}\n" + self.turn_prompt_template + "\n"
+        )
 
-    def get_response(self, context, step, question):
+    def _chat_messages(self, context, step, question) -> list:
+        if isinstance(context, list):
+            # Historique structuré : préfixe statique, historique, puis le tour courant
+            return (
+                [{"role": "system", "content": self.static_prompt}]
+                + context
+                + [{"role": "user", "content": self.turn_prompt_template.format(step=step, question=question)}]
+            )
         system_message = {
             "role": "system",
             "content": self.system_prompt_template.format(context=context, step=step, question=question)
         }
         user_message = {"role": "user", "content": question}
+        return [system_message, user_message]
+
+    @staticmethod
+    def _consume_stream(stream_response, start_time: float, label: str) -> str:
+        """
+        Accumule les deltas d'une réponse streamée. Les durées sont mesurées sur la
+        consommation du flux (create() rend la main dès les en-têtes reçus).
+        """
+        response = ""
+        first_token_time = None
+        for chunk in stream_response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                response += delta
+        end_time = time.time()
+        ttft = f"{first_token_time - start_time:.2f}s" if first_token_time else "-"
+        logging.debug("%s: %.2f sec (premier token %s)", label, end_time - start_time, ttft)
+        return response
+
+    def get_response(self, context, step, question):
+        messages = self._chat_messages(context, step, question)
     
         start_time = time.time()
-        # Enable streaming by setting stream=True
         stream_response = self.client.chat.completions.create(
             model=self.model,
-            messages=[system_message, user_message],
+            messages=messages,
             stream=True,
             temperature=self.temperature,
         )
-        end_time = time.time()
-        print(f"Réponse IA ({end_time - start_time:.2f}s):")
-        response = ""
-        # Accumulate the streaming chunks
-        for chunk in stream_response:
-            # Each chunk's structure: chunk.choices[0].message.content
-            response += chunk.choices[0].message.content
-        return response
+        return self._consume_stream(stream_response, start_time, "Réponse IA")
 
-    def generate_summary_json(self, conversation_history: str) -> dict:
+    def _summary_messages(self, conversation_history: str) -> list:
         summary_prompt = f"""
 Veuillez analyser l'historique de conversation ci-dessous, qui correspond à un suivi téléphonique d'un patient âgé nommé Paul.
 À partir de ces échanges, créez un résumé structuré au format JSON contenant les informations suivantes :
@@ -73,31 +106,30 @@ Veuillez produire uniquement le JSON sans explications supplémentaires.
             "content": "Vous êtes un assistant médical expérimenté, chargé d'extraire les informations clés d'une conversation téléphonique de suivi."
         }
         user_message = {"role": "user", "content": summary_prompt}
+        return [system_message, user_message]
+
+    @staticmethod
+    def _parse_summary(response_text: str) -> dict:
+        # Tolère le texte autour du JSON (```json, explications) et une réponse tronquée
+        summary_json = parse_json_object(response_text)
+        if summary_json is None:
+            logging.warning("Erreur lors de la conversion du texte en JSON (%d caractères)", len(response_text))
+            summary_json = {}
     
+        return summary_json
+
+    def generate_summary_json(self, conversation_history: str) -> dict:
         start_time = time.time()
         stream_response = self.client.chat.completions.create(
             model=self.model,
-            messages=[system_message, user_message],
+            messages=self._summary_messages(conversation_history),
             stream=True,
             temperature=self.temperature,
         )
-        end_time = time.time()
-        print(f"Temps d'appel LLM (summary): {end_time - start_time:.2f} sec")
-    
-        response_text = ""
-        for chunk in stream_response:
-            response_text += chunk.choices[0].message.content.strip()
-    
-        try:
-            summary_json = json.loads(response_text)
-        except Exception as e:
-            print("Erreur lors de la conversion du texte en JSON:", e)
-            print("Réponse brute du LLM :", response_text)
-            summary_json = {}
-    
-        return summary_json
+        response_text = self._consume_stream(stream_response, start_time, "Temps d'appel LLM (summary)")
+        return self._parse_summary(response_text.strip())
 
-    def generate_conversation_plan(self, patient_info: dict) -> list:
+    def _plan_messages(self, patient_info: dict) -> list:
         patient_info_str = json.dumps(patient_info, ensure_ascii=False, indent=2)
         prompt = f"""
 Veuillez utiliser les informations suivantes du patient pour créer un plan de conversation détaillé pour un appel de suivi téléphonique.
@@ -119,27 +151,97 @@ Veuillez fournir uniquement le JSON sans explications supplémentaires.
             "content": "Vous êtes un assistant médical expérimenté spécialisé dans la conduite d'appels de suivi."
         }
         user_message = {"role": "user", "content": prompt}
+        return [system_message, user_message]
+
+    @staticmethod
+    def _parse_plan(response_text: str) -> list:
+        plan_json = parse_json_object(response_text)
+        if plan_json is None:
+            logging.warning("Erreur lors de la conversion du texte en JSON pour le plan (%d caractères)",
+                            len(response_text))
+        steps = plan_json.get("steps", []) if plan_json else []
     
+        return steps
+
+    def generate_conversation_plan(self, patient_info: dict) -> list:
         start_time = time.time()
         stream_response = self.client.chat.completions.create(
             model=self.model,
-            messages=[system_message, user_message],
+            messages=self._plan_messages(patient_info),
             stream=True,
             temperature=self.temperature,
         )
-        end_time = time.time()
-        print(f"Temps d'appel LLM (conversation plan): {end_time - start_time:.2f} sec")
-    
-        response_text = ""
-        for chunk in stream_response:
-            response_text += chunk.choices[0].message.content.strip()
-    
-        try:
-            plan_json = json.loads(response_text)
-            steps = plan_json.get("steps", [])
-        except Exception as e:
-            print("Erreur lors de la conversion du texte en JSON pour le plan:", e)
-            print("Réponse brute du LLM :", response_text)
-            steps = []
-    
-        return steps
+        response_text = self._consume_stream(stream_response, start_time, "Temps d'appel LLM (conversation plan)")
+        return self._parse_plan(response_text.strip())
+
+
+class AsyncDeepInfraLLM(DeepInfraLLM):
+    """
+    Variante asynchrone native : requêtes AsyncOpenAI sur le pool keep-alive partagé,
+    sémaphore de concurrence et délai par requête.
+    """
+
+    def __init__(self, api_key, base_url, model="meta-llama/Llama-3.3-70B-Instruct-Turbo", temperature=0.1,
+                 max_concurrency=32, request_timeout=30.0, connect_timeout=5.0, max_retries=1):
+        super().__init__(api_key, base_url, model=model, temperature=temperature)
+        self.api_key = api_key
+        self.base_url = base_url
+        self.request_timeout = request_timeout
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=get_shared_http_client(),
+            timeout=httpx.Timeout(request_timeout, connect=connect_timeout),
+            max_retries=max_retries,
+        )
+        self._limiter = asyncio.Semaphore(max_concurrency)
+
+    async def warmup(self):
+        """Ouvre des connexions TLS vers le fournisseur avant le premier tour."""
+        await warm_connections(self.base_url, self._auth_headers())
+
+    async def keep_warm(self, interval: float = 60.0):
+        """Boucle de fond qui garde les connexions chaudes (à lancer en tâche)."""
+        await keep_connections_warm(self.base_url, self._auth_headers(), interval=interval)
+
+    def _auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    async def stream_response(self, context, step, question, timeout=None):
+        async for delta in self._stream(self._chat_messages(context, step, question), timeout):
+            yield delta
+
+    async def _stream(self, messages, timeout=None):
+        async with self._limiter:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                temperature=self.temperature,
+                timeout=timeout or self.request_timeout,
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+
+    async def _complete(self, messages, timeout=None) -> str:
+        start_time = time.time()
+        response = ""
+        async for delta in self._stream(messages, timeout):
+            response += delta
+        logging.debug("Réponse IA (%.2fs)", time.time() - start_time)
+        return response
+
+    async def get_response(self, context, step, question, timeout=None):
+        return await self._complete(self._chat_messages(context, step, question), timeout)
+
+    async def generate_summary_json(self, conversation_history: str, timeout=None) -> dict:
+        response_text = await self._complete(self._summary_messages(conversation_history), timeout)
+        return self._parse_summary(response_text.strip())
+
+    async def generate_conversation_plan(self, patient_info: dict, timeout=None) -> list:
+        response_text = await self._complete(self._plan_messages(patient_info), timeout)
+        return self._parse_plan(response_text.strip())
@@ -0,0 +1,280 @@
+import json
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from LLM.anonymizer import PLACEHOLDERS
+from LLM.router import CONCERN_PATTERN
+from LLM.speculative import normalize_transcript
+
+# Réponses fixes par étape du plan : pas d'appel au LLM. Les textes sont sous
+# forme anonymisée (placeholders), restaurés comme une réponse du LLM. `match`
+# (regex sur l'énoncé normalisé, obligatoire) doit couvrir l'énoncé entier :
+# seuls des mots de remplissage peuvent entourer la réponse attendue, tout
+# autre propos ("oui mais je suis tombé") passe par le LLM.
+FILLER = r"(?:euh|ben|bah|alors|ah|oh|hein|bon|bien|voilà|allô|allo|madame|bonjour|merci|oui)"
+
+
+def whole_utterance(answer: str) -> str:
+    return rf"^(?:{FILLER} )*(?:{answer})(?: (?:{FILLER}|{answer}))*$"
+
+
+YES = whole_utterance(r"oui|ouais|ouai|exactement|c est bien moi|c est moi|tout à fait|bien sûr|absolument")
+GOODBYE = whole_utterance(r"au revoir|merci beaucoup|merci à vous|bonne journée|bonne soirée|à bientôt|salut")
+DEFAULT_TEMPLATES = {
+    "Salutation et Verifier l'identité du patient nom": [
+        {"match": YES, "reply": "Ravie de vous entendre <PATIENT_NAME> ! Je vous appelle pour convenir de votre "
+                                "prochain rendez-vous de suivi. Quel jour et à quelle heure seriez-vous disponible ?"},
+    ],
+    "Au revoir": [
+        {"match": GOODBYE, "reply": "Merci beaucoup <PATIENT_NAME>, c'était un plaisir de discuter avec vous. "
+                                    "Prenez bien soin de vous, au revoir !"},
+    ],
+}
+
+TRIGRAM_DIM = 512
+# Dates et heures écrites en toutes lettres : réponses propres à un patient, jamais mises en cache
+DATE_WORDS = re.compile(
+    r"\b(lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche|janvier|février|mars|avril|mai|juin|juillet|août|"
+    r"septembre|octobre|novembre|décembre|heures?|midi|minuit|demain|aujourd hui|hier|semaine|mois)\b"
+)
+# Négations : deux énoncés proches mais de polarité différente ("j ai bien dormi" / "j ai pas bien dormi")
+# n'ont jamais la même réponse
+NEGATIONS = frozenset(("ne", "n", "pas", "jamais", "plus", "rien", "mal", "personne", "aucun", "aucune", "non",
+                       "sans", "guère"))
+# Mots sans contenu propre, ignorés pour comparer deux énoncés proches
+STOP_WORDS = frozenset((
+    "le", "la", "les", "l", "un", "une", "des", "de", "du", "d", "à", "au", "aux", "et", "ou", "je", "j", "tu",
+    "il", "elle", "on", "nous", "vous", "c", "ce", "cette", "ça", "est", "ai", "a", "en", "y", "que", "qu", "qui",
+    "me", "m", "te", "t", "se", "s", "ma", "mon", "mes", "votre", "vos", "oui", "ouais", "euh", "ben", "bah",
+    "alors", "voilà", "hein", "ah", "oh", "bon", "merci", "beaucoup",
+))
+# Mots du dossier patient assez longs pour être significatifs (centres d'intérêt, santé, proches...)
+PRIVATE_TERM_MIN_LENGTH = 5
+
+
+def private_terms(patient: dict) -> frozenset:
+    """
+    Mots du dossier patient hors champs anonymisés (ceux-ci deviennent des
+    placeholders) : une réponse qui en contient un est propre à ce patient.
+    """
+    words = set()
+
+    def collect(value):
+        if isinstance(value, str):
+            words.update(word for word in normalize_transcript(value).split() if len(word) >= PRIVATE_TERM_MIN_LENGTH)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item)
+        elif isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+
+    for field, value in (patient or {}).items():
+        if field not in PLACEHOLDERS:
+            collect(value)
+    return frozenset(words)
+
+
+def meaning_signature(normalized: str) -> tuple:
+    """(négations, mots de contenu) d'un énoncé normalisé : deux énoncés ne partagent une réponse que s'ils sont égaux."""
+    words = set(normalized.split())
+    return frozenset(words & NEGATIONS), frozenset(words - NEGATIONS - STOP_WORDS)
+
+
+def shareable(text: str, private: frozenset = frozenset()) -> bool:
+    """
+    Texte sans information propre à un patient, réutilisable pour un autre appel
+    (cache de réponses, cache audio) : ni chiffre, ni date ou heure en lettres,
+    ni nom propre resté en clair, ni mot du dossier du patient (`private_terms`).
+    """
+    if any(char.isdigit() for char in text):
+        return False
+    normalized = normalize_transcript(text)
+    if DATE_WORDS.search(normalized) or has_proper_noun(text):
+        return False
+    return not private.intersection(normalized.split())
+
+
+def concerning(utterance: str) -> bool:
+    """Propos qui signale un problème (douleur, chute...) : jamais de réponse type ni de cache."""
+    return bool(CONCERN_PATTERN.search(utterance) or CONCERN_PATTERN.search(normalize_transcript(utterance)))
+
+
+def has_proper_noun(text: str) -> bool:
+    """Mot à majuscule hors début de phrase, placeholders exclus : nom propre non couvert par l'anonymiseur."""
+    sentence_start = True
+    for word in text.split():
+        if word[:1].isupper() and not sentence_start:
+            return True
+        sentence_start = word[-1] in ".!?"
+    return False
+
+
+def trigram_vector(text: str, dim: int = TRIGRAM_DIM) -> np.ndarray:
+    """Sac de trigrammes de caractères haché sur `dim` composantes, normé (similarité cosinus)."""
+    padded = f"  {text} "
+    indices = [zlib.crc32(padded[i:i + 3].encode()) % dim for i in range(len(padded) - 2)]
+    vector = np.bincount(indices, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ResponseCache:
+    """
+    Cache des réponses du LLM, clé (étape du plan, énoncé anonymisé et normalisé).
+
+    Recherche exacte, puis par similarité (cosinus sur trigrammes de caractères)
+    parmi les énoncés déjà vus pour la même étape ; un énoncé similaire n'est
+    retenu que s'il a les mêmes négations et les mêmes mots de contenu
+    (`meaning_signature`) : la similarité ne couvre que les variantes de
+    transcription et les mots de remplissage. Éviction LRU (`max_entries`)
+    et TTL. Les modèles (`templates`) sont consultés en premier.
+
+    Le cache ne voit que du texte anonymisé et ne conserve une réponse que pour
+    un énoncé court, sans date ni heure (en chiffres ou en lettres) ni nom propre non anonymisé
+    (mot à majuscule hors début de phrase) dans l'énoncé ou la réponse, et dont
+    la réponse ne reprend aucun mot du dossier du patient (`private_terms`) :
+    une réponse ne transporte jamais une information propre à un patient vers
+    un autre appel. Un énoncé inquiétant (CONCERN_PATTERN du routeur) n'est
+    jamais servi par le cache ni les modèles.
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl: float = 24 * 3600, similarity: float = 0.9,
+                 max_words: int = 12, templates: dict = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.max_words = max_words
+        self.templates = {}
+        for step, rules in (DEFAULT_TEMPLATES if templates is None else templates).items():
+            self.add_templates(step, rules)
+        self._entries = OrderedDict()  # (étape, énoncé normalisé) -> (réponse, instant d'ajout)
+        self._by_step = {}  # étape -> {énoncé normalisé: vecteur}
+        self._matrices = {}  # étape -> (énoncés, matrice) reconstruite à la demande
+        self.stats = {"template": 0, "exact": 0, "similar": 0, "miss": 0, "stored": 0, "rejected": 0,
+                      "evictions": 0}
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ResponseCache":
+        """Charge des modèles supplémentaires depuis un fichier JSON {étape: [{match, reply}]}."""
+        cache = cls(**kwargs)
+        with open(path, "r", encoding="utf-8") as f:
+            for step, rules in json.load(f).items():
+                cache.add_templates(step, rules)
+        return cache
+
+    def add_templates(self, step: str, rules: list):
+        if any(not rule.get("match") for rule in rules):
+            raise ValueError(f"réponse type sans `match` pour l'étape {step!r}")
+        compiled = [(re.compile(rule["match"]), rule["reply"]) for rule in rules]
+        self.templates.setdefault(step, []).extend(compiled)
+
+    # --- Recherche ---
+    def lookup(self, step: str, utterance: str) -> tuple:
+        """
+        Retourne (réponse anonymisée, origine) avec origine parmi "template",
+        "exact", "similar", ou (None, "miss").
+        """
+        if concerning(utterance):
+            self.stats["miss"] += 1
+            return None, "miss"
+        normalized = normalize_transcript(utterance)
+        for pattern, reply in self.templates.get(step, ()):
+            if pattern.search(normalized):
+                self.stats["template"] += 1
+                return reply, "template"
+        key = (step, normalized)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.stats["exact"] += 1
+                return entry[0], "exact"
+            self._evict(key)
+        match = self._nearest(step, normalized)
+        if match is not None:
+            self.stats["similar"] += 1
+            return self._entries[(step, match)][0], "similar"
+        self.stats["miss"] += 1
+        return None, "miss"
+
+    def _nearest(self, step: str, normalized: str):
+        candidates = self._by_step.get(step)
+        if not candidates:
+            return None
+        if step not in self._matrices:
+            keys = list(candidates)
+            self._matrices[step] = (keys, np.stack([candidates[k] for k in keys]))
+        keys, matrix = self._matrices[step]
+        scores = matrix @ trigram_vector(normalized)
+        signature = meaning_signature(normalized)
+        for index in np.flatnonzero(scores >= self.similarity)[np.argsort(-scores[scores >= self.similarity])]:
+            if meaning_signature(keys[index]) != signature:
+                continue
+            key = (step, keys[index])
+            if time.monotonic() - self._entries[key][1] > self.ttl:
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return keys[index]
+        return None
+
+    # --- Ajout ---
+    def cacheable(self, utterance: str, response: str, private: frozenset = frozenset()) -> bool:
+        words = utterance.split()
+        if not words or len(words) > self.max_words or concerning(utterance):
+            return False
+        return shareable(utterance, private) and shareable(response, private)
+
+    def put(self, step: str, utterance: str, response: str, private: frozenset = frozenset()) -> bool:
+        """
+        Mémorise une réponse anonymisée ; retourne False si elle n'est pas
+        cacheable. `private` : mots du dossier du patient (`private_terms`).
+        """
+        if not response or not self.cacheable(utterance, response, private):
+            self.stats["rejected"] += 1
+            return False
+        normalized = normalize_transcript(utterance)
+        key = (step, normalized)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = (response, time.monotonic())
+        self._by_step.setdefault(step, {})[normalized] = trigram_vector(normalized)
+        self._matrices.pop(step, None)
+        self.stats["stored"] += 1
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+        return True
+
+    def _evict(self, key: tuple):
+        step, normalized = key
+        self._entries.pop(key, None)
+        vectors = self._by_step.get(step)
+        if vectors is not None:
+            vectors.pop(normalized, None)
+            if not vectors:
+                del self._by_step[step]
+        self._matrices.pop(step, None)
+        self.stats["evictions"] += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def hit_rate(self) -> float:
+        hits = self.stats["template"] + self.stats["exact"] + self.stats["similar"]
+        total = hits + self.stats["miss"]
+        return hits / total if total else 0.0
+
+    def log_stats(self):
+        logging.info("Cache de réponses: %s entrées, taux de succès %.0f%%, %s", len(self), self.hit_rate() * 100,
+                     self.stats)
+
+
+async def replay(text: str):
+    """Réponse en cache présentée comme un flux de deltas (un seul delta)."""
+    yield text
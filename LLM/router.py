@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+
+SMALL = "small"
+LARGE = "large"
+
+# Étapes ouvertes (conversation libre, centres d'intérêt) : réponse plus riche attendue
+OPEN_STEP_PATTERN = re.compile(r"centre d'int[ée]r[êe]t|parler d|suite de conversation|loisir|famille", re.IGNORECASE)
+# Propos du patient qui demandent une réponse soignée, quelle que soit l'étape
+CONCERN_PATTERN = re.compile(
+    r"douleur|j'ai mal|tomb[ée]|chute|inqui[eè]t|angoiss|triste|seule?\b|essouffl|vertige|malaise|urgence",
+    re.IGNORECASE,
+)
+LONG_QUESTION_WORDS = 25
+# Tokens de la première phrase, celle dont dépend le début de la lecture
+FIRST_SENTENCE_TOKENS = 12
+
+
+def classify_turn(step: str, question: str) -> tuple:
+    """(niveau, motif) : SMALL pour les étapes fermées du plan, LARGE pour les étapes ouvertes ou délicates."""
+    if CONCERN_PATTERN.search(question or ""):
+        return LARGE, "concern"
+    if len((question or "").split()) > LONG_QUESTION_WORDS:
+        return LARGE, "long"
+    if OPEN_STEP_PATTERN.search(step or ""):
+        return LARGE, "open_step"
+    return SMALL, "plan_step"
+
+
+class LatencyEstimate:
+    """
+    Estimation glissante du délai avant le premier token (médiane et 90e
+    centile des `window` dernières requêtes) et du débit (moyenne
+    exponentielle) d'un modèle. La médiane ignore les blocages ponctuels,
+    que le doublement des requêtes traite ; elle ne monte que si le modèle
+    ralentit durablement. Une requête abandonnée avant son premier token (doublon
+    perdant) ne donne qu'une borne inférieure de son TTFT : la mesure est
+    censurée, et les quantiles sont ceux de l'estimateur de Kaplan-Meier. Compter
+    la durée écoulée comme un TTFT sous-estimerait justement les modèles lents.
+    """
+
+    def __init__(self, window: int = 50, alpha: float = 0.2):
+        self.alpha = alpha
+        self._ttfts = deque(maxlen=window)  # (secondes, censurée)
+        self.tokens_per_second = None
+        self.samples = 0
+        self.censored = 0
+        self.errors = 0
+        self.updated_at = None
+
+    def observe_ttft(self, seconds: float, censored: bool = False):
+        """`censored` : requête abandonnée avant le premier token, le TTFT dépasse `seconds`."""
+        if censored:
+            self.censored += 1
+        else:
+            self.samples += 1
+        self.updated_at = time.monotonic()
+        self._ttfts.append((seconds, censored))
+
+    def observe_rate(self, tokens: int, seconds: float):
+        if tokens < 2 or seconds <= 0:
+            return
+        rate = (tokens - 1) / seconds
+        self.tokens_per_second = rate if self.tokens_per_second is None else (
+            self.tokens_per_second + self.alpha * (rate - self.tokens_per_second))
+
+    def _quantile(self, q: float):
+        if not self._ttfts:
+            return None
+        # Kaplan-Meier : une mesure censurée reste "à risque" jusqu'à sa durée, sans compter comme premier token.
+        # À durée égale, les premiers tokens passent avant les abandons.
+        values = sorted(self._ttfts)
+        at_risk, survival = len(values), 1.0
+        for seconds, censored in values:
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if 1 - survival > q + 1e-9:
+                    return seconds
+            at_risk -= 1
+        # Trop d'abandons pour atteindre le quantile : la plus longue durée observée en est une borne inférieure
+        return values[-1][0]
+
+    @property
+    def ttft(self):
+        """TTFT médian, ou None sans mesure."""
+        return self._quantile(0.5)
+
+    @property
+    def ttft_high(self):
+        """90e centile du TTFT, ou None sans mesure."""
+        return self._quantile(0.9)
+
+    def first_sentence(self):
+        """Délai estimé avant la première phrase complète, ou None sans mesure."""
+        if self.ttft is None:
+            return None
+        rate = self.tokens_per_second
+        return self.ttft + (FIRST_SENTENCE_TOKENS / rate if rate else 0.0)
+
+    def to_dict(self) -> dict:
+        return {
+            "ttft_ms": None if self.ttft is None else round(self.ttft * 1000, 1),
+            "ttft_high_ms": None if self.ttft is None else round(self.ttft_high * 1000, 1),
+            "tokens_per_second": None if self.tokens_per_second is None else round(self.tokens_per_second, 1),
+            "samples": self.samples,
+            "censored": self.censored,
+            "errors": self.errors,
+        }
+
+
+_DONE = object()
+
+
+class _Attempt:
+    """Une requête streamée vers un modèle ; les deltas sont mis en file par une tâche."""
+
+    def __init__(self, tier: str, client, estimate: LatencyEstimate, request: tuple, timeout=None):
+        self.tier = tier
+        self.client = client
+        self.estimate = estimate
+        self.queue = asyncio.Queue()
+        self.first = asyncio.Event()  # premier token reçu, ou échec
+        self.error = None
+        self.tokens = 0
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.task = asyncio.create_task(self._run(client.stream_response(*request, timeout=timeout)))
+
+    async def _run(self, deltas):
+        finished = False
+        try:
+            async for delta in deltas:
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                    self.estimate.observe_ttft(self.first_token_at - self.started_at)
+                    self.first.set()
+                self.tokens += 1
+                self.queue.put_nowait(delta)
+            finished = True
+        except asyncio.CancelledError:
+            if self.first_token_at is None:
+                self.estimate.observe_ttft(time.monotonic() - self.started_at, censored=True)
+            raise
+        except Exception as e:
+            self.error = e
+            self.estimate.errors += 1
+        finally:
+            if finished and self.first_token_at is not None:
+                self.estimate.observe_rate(self.tokens, time.monotonic() - self.first_token_at)
+            self.first.set()
+            self.queue.put_nowait(_DONE)
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None and self.first_token_at is None
+
+    def cancel(self) -> int:
+        """Abandonne la requête (le flux HTTP est fermé) ; retourne les tokens déjà reçus."""
+        self.task.cancel()
+        return self.tokens
+
+    async def deltas(self):
+        while True:
+            delta = await self.queue.get()
+            if delta is _DONE:
+                break
+            yield delta
+        if self.error:
+            raise self.error
+
+
+class LLMRouter:
+    """
+    Client LLM des tours de conversation, réparti sur deux modèles : `small`
+    (rapide) pour les étapes fermées du plan, `large` pour les étapes ouvertes
+    et les propos délicats (`classify_turn`). Même interface que
+    `AsyncDeepInfraLLM` (`get_response`, `stream_response`) ; les autres
+    méthodes (résumé, maintien des connexions) sont celles de `small`.
+
+    Requêtes doublées : si le premier token n'est pas arrivé après le délai de
+    l'étape (`deadlines[niveau]`), ou si la requête échoue avant, la même
+    requête part vers l'autre modèle et le premier flux qui répond est gardé,
+    l'autre est annulé. La part de requêtes doublées est bornée par
+    `hedge_budget` (moyenne glissante) pour ne pas doubler la charge quand le
+    fournisseur entier ralentit.
+
+    Les estimations TTFT et débit de chaque modèle (`LatencyEstimate`) sont
+    mises à jour à chaque requête : un modèle dont la première phrase arrive
+    (en médiane) après le délai de l'étape est évité tant que l'autre fait
+    mieux ; une requête lui est de nouveau confiée si son estimation date de
+    plus de `probe_interval` secondes, pour constater son rétablissement.
+    """
+
+    def __init__(self, small, large, deadlines: dict = None, hedge: bool = True, hedge_budget: float = 0.2,
+                 probe_interval: float = 30.0, classify=classify_turn, on_route=None, on_hedge=None, on_estimate=None):
+        self.clients = {SMALL: small, LARGE: large}
+        self.deadlines = {SMALL: 0.8, LARGE: 1.2, **(deadlines or {})}
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.probe_interval = probe_interval
+        self.classify = classify
+        self.on_route = on_route  # appelé avec (modèle, motif)
+        self.on_hedge = on_hedge  # appelé avec "primary", "hedge" ou "failed"
+        self.on_estimate = on_estimate  # appelé avec (modèle, LatencyEstimate) après chaque requête
+        self.estimates = {SMALL: LatencyEstimate(), LARGE: LatencyEstimate()}
+        self._hedge_rate = 0.0
+        self.stats = {"requests": 0, "hedged": 0, "hedge_won": 0, "failed_over": 0, "wasted_tokens": 0}
+
+    async def warmup(self):
+        """Préchauffe les clients des deux modèles (même fournisseur : connexions partagées)."""
+        await asyncio.gather(*(client.warmup() for client in self.clients.values()))
+
+    def __getattr__(self, name):
+        # Résumés, préchauffage, etc. : modèle rapide
+        return getattr(self.clients[SMALL], name)
+
+    @property
+    def model(self) -> str:
+        return self.clients[SMALL].model
+
+    def route(self, step: str, question: str) -> tuple:
+        """(niveau principal, niveau de secours, délai avant doublement, motif)."""
+        tier, reason = self.classify(step, question)
+        other = LARGE if tier == SMALL else SMALL
+        deadline = self.deadlines[tier]
+        estimate = self.estimates[tier]
+        expected, alternative = estimate.first_sentence(), self.estimates[other].first_sentence()
+        stale = estimate.updated_at is not None and time.monotonic() - estimate.updated_at > self.probe_interval
+        if expected is not None and expected > deadline and alternative is not None and alternative < expected \
+                and not stale:
+            logging.info("Modèle %s lent (%.2fs estimées), requête envoyée à %s", tier, expected, other)
+            tier, other, reason = other, tier, "degraded"
+        return tier, other, deadline, reason
+
+    def _allow_hedge(self) -> bool:
+        return self.hedge and self._hedge_rate < self.hedge_budget
+
+    def _finish(self, hedged: bool):
+        self._hedge_rate += 0.05 * ((1.0 if hedged else 0.0) - self._hedge_rate)
+        if self.on_estimate:
+            for tier, estimate in self.estimates.items():
+                self.on_estimate(self.clients[tier].model, estimate)
+
+    async def stream_response(self, context, step, question, timeout=None):
+        tier, other, deadline, reason = self.route(step, question)
+        self.stats["requests"] += 1
+        if self.on_route:
+            self.on_route(self.clients[tier].model, reason)
+        request = (context, step, question)
+        primary = _Attempt(tier, self.clients[tier], self.estimates[tier], request, timeout)
+        attempts = [primary]
+        winner = None
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(primary.first.wait()), deadline)
+            except asyncio.TimeoutError:
+                pass
+            if primary.first.is_set() and not primary.failed:
+                winner = primary
+            elif primary.failed or self._allow_hedge():
+                # Premier token en retard (ou échec) : même requête vers l'autre modèle
+                attempts.append(_Attempt(other, self.clients[other], self.estimates[other], request, timeout))
+                self.stats["hedged"] += 1
+                if primary.failed:
+                    self.stats["failed_over"] += 1
+                logging.info("Requête doublée vers %s après %.2fs (%s)", other, deadline,
+                             "échec" if primary.failed else "délai")
+                winner = await self._first_to_answer(attempts)
+            else:
+                await primary.first.wait()
+                winner = primary
+            if winner is not primary and not winner.failed:
+                self.stats["hedge_won"] += 1
+            if self.on_hedge and len(attempts) > 1:
+                self.on_hedge("failed" if winner.failed else "primary" if winner is primary else "hedge")
+            for attempt in attempts:
+                if attempt is not winner:
+                    self.stats["wasted_tokens"] += attempt.cancel()
+            async for delta in winner.deltas():
+                yield delta
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            self._finish(len(attempts) > 1)
+
+    @staticmethod
+    async def _first_to_answer(attempts: list) -> _Attempt:
+        """Premier flux à produire un token ; si tous échouent, le dernier (son erreur sera levée)."""
+        pending = {asyncio.ensure_future(attempt.first.wait()): attempt for attempt in attempts}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    attempt = pending.pop(future)
+                    if not attempt.failed or not pending:
+                        return attempt
+        finally:
+            for future in pending:
+                future.cancel()
+        return attempts[-1]
+
+    async def get_response(self, context, step, question, timeout=None):
+        return "".join([delta async for delta in self.stream_response(context, step, question, timeout=timeout)])
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "hedge_rate": round(self._hedge_rate, 3),
+            "models": {self.clients[tier].model: estimate.to_dict() for tier, estimate in self.estimates.items()},
+        }
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import re
+import time
+from difflib import SequenceMatcher
+
+
+def normalize_transcript(text: str) -> str:
+    """Minuscules, sans ponctuation ni espaces multiples : Azure varie surtout sur ces points."""
+    text = re.sub(r"[^\w\s<>]", " ", text.lower())
+    return " ".join(text.split())
+
+
+class Speculation:
+    """
+    Génération lancée sur un transcript partiel. Les deltas reçus sont conservés
+    pour pouvoir être rejoués si la spéculation est validée.
+    """
+
+    def __init__(self, transcript: str, request: tuple, deltas):
+        self.transcript = transcript
+        self.normalized = normalize_transcript(transcript)
+        self.request = request  # (context, step, question) anonymisés
+        self.deltas = []
+        self.done = asyncio.Event()
+        self.error = None
+        # Horodatages (time.monotonic) pour les traces de tour
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self._new_delta = asyncio.Event()
+        self._task = asyncio.create_task(self._consume(deltas))
+
+    async def _consume(self, deltas):
+        try:
+            async for delta in deltas:
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                self.deltas.append(delta)
+                self._new_delta.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+            self._new_delta.set()
+
+    def cancel(self) -> int:
+        """Annule la génération ; retourne le nombre de tokens déjà reçus (gaspillés)."""
+        self._task.cancel()
+        return len(self.deltas)
+
+    async def stream(self):
+        """Rejoue les deltas déjà reçus puis suit la génération en cours."""
+        index = 0
+        while True:
+            if index < len(self.deltas):
+                yield self.deltas[index]
+                index += 1
+                continue
+            if self.done.is_set():
+                break
+            self._new_delta.clear()
+            await self._new_delta.wait()
+        if self.error:
+            raise self.error
+
+    async def text(self) -> str:
+        await self.done.wait()
+        if self.error:
+            raise self.error
+        return "".join(self.deltas)
+
+
+class SpeculativeResponder:
+    """
+    Démarre la requête LLM dès que le transcript partiel d'Azure est stable depuis
+    `stable_ms`. À la fin du tour, `resolve` compare le transcript final à celui de
+    la spéculation : si identique (ou similaire au-delà de `similarity`), la réponse
+    spéculative est utilisée ; sinon elle est annulée et l'appelant relance la requête.
+
+    `build_request(transcript)` retourne le tuple (context, step, question) anonymisé
+    à envoyer au LLM pour l'état courant de la session.
+    """
+
+    def __init__(self, llm_client, build_request, stable_ms: int = 250, similarity: float = 0.9, on_metric=None):
+        self.llm_client = llm_client
+        self.build_request = build_request
+        self.stable_ms = stable_ms
+        self.similarity = similarity
+        self._current = None
+        self._pending_text = None
+        self._timer = None
+        self.metrics = {"started": 0, "hits": 0, "misses": 0, "wasted_tokens": 0}
+        self.on_metric = on_metric  # appelé avec (compteur de `metrics`, incrément)
+
+    def _count(self, name: str, amount: int = 1):
+        self.metrics[name] += amount
+        if self.on_metric and amount:
+            self.on_metric(name, amount)
+
+    def on_partial(self, text: str):
+        """Nouveau transcript partiel (à appeler depuis la boucle d'événements)."""
+        self._pending_text = text
+        if self._timer:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(self.stable_ms / 1000, self._on_stable)
+
+    def _on_stable(self):
+        self._timer = None
+        text = self._pending_text
+        if not text:
+            return
+        if self._current and self._current.normalized == normalize_transcript(text):
+            return
+        self._discard()
+        request = self.build_request(text)
+        self._current = Speculation(text, request, self.llm_client.stream_response(*request))
+        self._count("started")
+        logging.info("Génération spéculative lancée sur: %s", text)
+
+    def _discard(self):
+        if self._current:
+            self._count("wasted_tokens", self._current.cancel())
+            self._current = None
+
+    def resolve(self, final_text: str):
+        """
+        Retourne la Speculation à utiliser pour `final_text`, ou None si aucune ne
+        correspond (l'éventuelle spéculation en cours est alors annulée).
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._pending_text = None
+        speculation, self._current = self._current, None
+        if speculation is None:
+            return None
+        request = self.build_request(final_text)
+        ratio = SequenceMatcher(None, speculation.normalized, normalize_transcript(final_text)).ratio()
+        # Le contexte et l'étape doivent être ceux du tour courant
+        if ratio >= self.similarity and speculation.request[:2] == request[:2] and speculation.error is None:
+            self._count("hits")
+            logging.info("Spéculation validée (similarité %.2f)", ratio)
+            return speculation
+        self._count("misses")
+        self._count("wasted_tokens", speculation.cancel())
+        logging.info("Spéculation rejetée (similarité %.2f), nouvelle requête", ratio)
+        return None
+
+    def close(self):
+        if self._timer:
+            self._timer.cancel()
+        self._discard()
+
+    def stats(self) -> dict:
+        resolved = self.metrics["hits"] + self.metrics["misses"]
+        hit_rate = self.metrics["hits"] / resolved if resolved else 0.0
+        return {**self.metrics, "hit_rate": round(hit_rate, 3)}
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import re
+import time
+from datetime import datetime
+
+from LLM.json_stream import JSONStreamParser
+
+# Champs extraits pendant l'appel (réponse du LLM contrainte par ce schéma). Les
+# champs absents ou nuls ne modifient pas l'état : le LLM ne renvoie que ce que
+# les nouveaux échanges apprennent.
+SUMMARY_UPDATE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "next_appointment_datetime": {"type": ["string", "null"], "description": "ISO 8601 (YYYY-MM-DDTHH:MM:SS)"},
+        "food": {"type": ["string", "null"], "description": "alimentation, appétit"},
+        "sleep": {"type": ["string", "null"], "description": "sommeil"},
+        "interests": {"type": "array", "items": {"type": "string"}, "description": "centres d'intérêt évoqués"},
+        "conditions": {"type": ["string", "null"], "description": "santé, remarques importantes"},
+        "key_points": {"type": "array", "items": {"type": "string"}, "description": "nouveaux points clés"},
+    },
+    "additionalProperties": False,
+}
+TEXT_FIELDS = ("food", "sleep", "conditions")
+LIST_FIELDS = ("interests", "key_points")
+MAX_LIST_ITEMS = 20
+EXTRACTION_RESULTS = ("complete", "repaired", "partial", "failed")
+
+
+# Heure après la date ("2026-10-20T14:30" ou "2026-10-20 14:30")
+TIME_PART = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+
+
+def parse_appointment(value):
+    """
+    Date de rendez-vous normalisée (ISO 8601, à la seconde), ou None si invalide
+    ou sans heure ("2026-10-20" seul deviendrait un rendez-vous à minuit).
+    """
+    if not isinstance(value, str) or value.strip() in ("", "None", "null"):
+        return None
+    if not TIME_PART.search(value):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None).isoformat(timespec="seconds")
+
+
+class RollingSummary:
+    """
+    Résumé structuré tenu à jour pendant l'appel, sous forme anonymisée. Les
+    champs texte sont remplacés par la dernière valeur extraite, les listes
+    sont complétées (sans doublon).
+    """
+
+    def __init__(self):
+        self.fields = {"next_appointment_datetime": None, "food": None, "sleep": None, "conditions": None,
+                       "interests": [], "key_points": []}
+
+    def merge(self, update: dict) -> int:
+        """Intègre une extraction ; retourne le nombre de champs retenus."""
+        accepted = 0
+        if "next_appointment_datetime" in update:
+            appointment = parse_appointment(update["next_appointment_datetime"])
+            if appointment:
+                self.fields["next_appointment_datetime"] = appointment
+                accepted += 1
+        for field in TEXT_FIELDS:
+            value = update.get(field)
+            if isinstance(value, str) and value.strip() and value.strip() != "None":
+                self.fields[field] = value.strip()
+                accepted += 1
+        for field in LIST_FIELDS:
+            values = update.get(field)
+            if isinstance(values, str):
+                values = [values]
+            if not isinstance(values, list):
+                continue
+            known = {item.lower() for item in self.fields[field]}
+            for item in values:
+                if isinstance(item, str) and item.strip() and item.strip().lower() not in known:
+                    if len(self.fields[field]) >= MAX_LIST_ITEMS:
+                        break
+                    self.fields[field].append(item.strip())
+                    known.add(item.strip().lower())
+                    accepted += 1
+        return accepted
+
+    def state(self) -> dict:
+        """Champs déjà connus, envoyés au LLM avec les nouveaux échanges (sans les points clés, déjà résumés)."""
+        return {field: value for field, value in self.fields.items() if value and field != "key_points"}
+
+    def to_summary(self, restore, patient: dict) -> dict:
+        """Résumé final (données restaurées), au format du résumé post-appel."""
+        fields = {field: restore(value) if isinstance(value, str) else [restore(item) for item in value]
+                  for field, value in self.fields.items() if value is not None}
+        return {
+            "patient_name": patient.get("name"),
+            "age": patient.get("age"),
+            "next_appointment_datetime": self.fields["next_appointment_datetime"] or "None",
+            "food": fields.get("food"),
+            "sleep": fields.get("sleep"),
+            "interests": fields.get("interests", []),
+            "conditions": fields.get("conditions"),
+            "conversation_summary": " ".join(fields.get("key_points", [])),
+        }
+
+
+class IncrementalSummarizer:
+    """
+    Extraction du résumé au fil de l'appel. Chaque tour (ou lot de `batch_turns`
+    tours) est envoyé en tâche de fond avec l'état courant ; une seule
+    extraction est en cours par appel, les tours arrivés entre-temps partent
+    dans la suivante. La réponse est lue en streaming par un parseur tolérant :
+    une réponse entourée de texte ou interrompue donne quand même les champs
+    complets reçus.
+
+    À la fin de l'appel, `finalize()` n'attend que l'extraction en cours et, le
+    cas échéant, celle des derniers tours. Elle retourne None si des tours n'ont
+    pas pu être extraits : l'appelant repasse alors par le résumé complet.
+
+    `extracted` compte les tours intégrés au résumé ; avec `summary.fields`, il
+    permet à un autre worker de reprendre l'extraction (`restore`).
+    """
+
+    def __init__(self, llm, anonymizer, patient: dict, batch_turns: int = 1, timeout: float = 10.0,
+                 on_extraction=None):
+        self.llm = llm
+        self.anonymizer = anonymizer
+        self.patient = patient
+        self.batch_turns = batch_turns
+        self.timeout = timeout
+        self.on_extraction = on_extraction  # appelé avec le résultat de chaque extraction
+        self.summary = RollingSummary()
+        self._pending = []  # tours (patient, IA) anonymisés pas encore envoyés
+        self._failed = []  # tours dont l'extraction a échoué, renvoyés à la finalisation
+        self._task = None
+        self.sent = 0  # tours reçus par add_turn ou restore
+        self.extracted = 0
+        self.stats = dict.fromkeys(EXTRACTION_RESULTS, 0)
+
+    def add_turn(self, patient_text: str, ai_text: str):
+        self.sent += 1
+        self._pending.append((self.anonymizer.sanitize(patient_text), self.anonymizer.sanitize(ai_text)))
+        self._schedule()
+
+    def _schedule(self):
+        if len(self._pending) >= self.batch_turns and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._drain())
+
+    def restore(self, fields: dict, extracted: int, turns: list):
+        """
+        Reprise d'un appel commencé sur un autre worker : résumé déjà extrait
+        (`fields`, couvrant `extracted` tours) et transcript complet (patient, IA).
+        Les tours ni extraits ni déjà reçus ici partent dans la prochaine extraction.
+        """
+        if extracted > self.extracted:
+            self.summary.fields = {field: list(value) if isinstance(value, list) else value
+                                   for field, value in fields.items()}
+            self.extracted = extracted
+        start = max(self.sent, extracted)
+        for patient_text, ai_text in turns[start:]:
+            self._pending.append((self.anonymizer.sanitize(patient_text), self.anonymizer.sanitize(ai_text)))
+        self.sent = max(self.sent, len(turns))
+        self._schedule()
+
+    async def _drain(self):
+        while len(self._pending) >= self.batch_turns:
+            turns, self._pending = self._pending, []
+            if await self._extract(turns, self.timeout) == "failed":
+                self._failed.extend(turns)
+
+    async def _extract(self, turns: list, timeout: float) -> str:
+        parser = JSONStreamParser()
+        error = None
+        deltas = self.llm.stream_summary_update(self.summary.state(), turns, timeout=timeout)
+        try:
+            async for delta in deltas:
+                parser.feed(delta)
+                if parser.complete:
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            await deltas.aclose()
+        update = parser.value()
+        if update is None or (not update and not parser.complete):
+            # Coupé avant le premier membre complet : les tours seront renvoyés
+            result = "failed"
+            logging.warning("Extraction du résumé impossible (%s tours): %s", len(turns), error or "réponse sans JSON")
+        else:
+            self.summary.merge(update)
+            self.extracted += len(turns)
+            if error is not None or not parser.complete:
+                result = "partial"
+            else:
+                result = "complete" if parser.clean else "repaired"
+        self.stats[result] += 1
+        if self.on_extraction:
+            self.on_extraction(result)
+        return result
+
+    async def finalize(self, timeout: float = 5.0):
+        """Résumé final (dict), ou None si la fin d'appel n'a pas pu être extraite à temps."""
+        deadline = time.monotonic() + timeout
+        if self._task is not None and not self._task.done():
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                logging.warning("Extraction du résumé en cours trop longue, abandon")
+                return None
+        remaining, self._failed, self._pending = self._failed + self._pending, [], []
+        if remaining:
+            result = await self._extract(remaining, max(deadline - time.monotonic(), 0.1))
+            if result == "failed":
+                return None
+        return self.summary.to_summary(self.anonymizer.restore, self.patient)
+
+    def success_rate(self) -> float:
+        total = sum(self.stats.values())
+        return (total - self.stats["failed"]) / total if total else 1.0
+
@@ -0,0 +1,150 @@
+import logging
+import time
+
+# Format du flux écrit par /media-stream : PCM 16 bits, 8 kHz, mono
+SAMPLE_RATE = 8000
+
+
+class STTSession:
+    """
+    Un recognizer et son flux d'entrée, indépendants du moteur : le recognizer
+    expose les signaux `recognizing`, `recognized` et `canceled` et les méthodes
+    de reconnaissance continue de `speechsdk.SpeechRecognizer` ; le flux,
+    `write` et `close`.
+
+    Les callbacks sont ceux passés à `bind`, lus à chaque événement : une session
+    reprise après une redirection Twilio est simplement rebranchée sur la
+    nouvelle connexion.
+    """
+
+    def __init__(self, recognizer, push_stream, connection=None):
+        self.recognizer = recognizer
+        self.push_stream = push_stream
+        self.connection = connection
+        self.call_sid = None  # appel servi, fixé par le pool à l'attribution
+        self.created_at = time.monotonic()
+        self.parked_at = None
+        self.started = False
+        self.closed = False
+        self._on_recognized = None
+        self._on_recognizing = None
+        recognizer.recognizing.connect(self._recognizing)
+        recognizer.recognized.connect(self._recognized)
+        recognizer.canceled.connect(lambda evt: logging.error("Reconnaissance vocale annulée: %s", evt))
+
+    def bind(self, on_recognized=None, on_recognizing=None):
+        self._on_recognized = on_recognized
+        self._on_recognizing = on_recognizing
+
+    def _recognizing(self, evt):
+        handler = self._on_recognizing
+        if evt.result.text and handler:
+            handler(evt.result.text)
+
+    def _recognized(self, evt):
+        handler = self._on_recognized
+        if evt.result.text and handler:
+            handler(evt.result.text)
+
+    def write(self, pcm_data: bytes):
+        self.push_stream.write(pcm_data)
+
+    def start(self):
+        """
+        Démarre la reconnaissance continue sans attendre (variante _async du SDK) :
+        l'audio écrit entre-temps est mis en tampon par le flux d'entrée, et un
+        échec est signalé par l'événement `canceled`.
+        """
+        if not self.started:
+            self.started = True
+            self.recognizer.start_continuous_recognition_async()
+
+    def close(self):
+        """Ferme le flux et arrête la reconnaissance (bloquant)."""
+        if self.closed:
+            return
+        self.closed = True
+        self.bind(None, None)
+        self.push_stream.close()
+        if self.started:
+            self.recognizer.stop_continuous_recognition()
+        if self.connection is not None:
+            self.connection.close()
+
+
+class STTEngine:
+    """
+    Interface commune des moteurs STT. `create_session` construit un recognizer
+    prêt à démarrer ; l'appel peut être coûteux et bloquant (SDK), il est fait
+    par le pool, hors de la boucle d'événements.
+    """
+
+    name = "base"
+
+    def create_session(self) -> STTSession:
+        raise NotImplementedError
+
+
+class AzureSTTEngine(STTEngine):
+    """
+    Azure Speech : la configuration (clé, langue, segmentation) et le format
+    audio sont construits une fois et partagés par tous les recognizers. Chaque
+    session ouvre sa connexion au service dès sa création.
+    """
+
+    name = "azure"
+
+    def __init__(self, speech_key: str, region: str, language: str = "fr-FR", segmentation_silence_ms: int = None,
+                 preconnect: bool = True):
+        self.speech_key = speech_key
+        self.region = region
+        self.language = language
+        self.segmentation_silence_ms = segmentation_silence_ms
+        self.preconnect = preconnect
+        self._speechsdk = None
+        self._speech_config = None
+        self._audio_format = None
+
+    def _configure(self):
+        import azure.cognitiveservices.speech as speechsdk
+
+        self._speechsdk = speechsdk
+        speech_config = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.region)
+        speech_config.speech_recognition_language = self.language
+        if self.segmentation_silence_ms:
+            # Aligne la segmentation Azure sur notre fin de tour pour obtenir le résultat final plus tôt
+            speech_config.set_property(speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
+                                       str(self.segmentation_silence_ms))
+        self._audio_format = speechsdk.audio.AudioStreamFormat(
+            samples_per_second=SAMPLE_RATE, bits_per_sample=16, channels=1
+        )
+        self._speech_config = speech_config
+
+    def create_session(self) -> STTSession:
+        if self._speech_config is None:
+            self._configure()
+        speechsdk = self._speechsdk
+        push_stream = speechsdk.audio.PushAudioInputStream(stream_format=self._audio_format)
+        audio_config = speechsdk.audio.AudioConfig(stream=push_stream)
+        recognizer = speechsdk.SpeechRecognizer(speech_config=self._speech_config, audio_config=audio_config)
+        connection = None
+        if self.preconnect:
+            connection = speechsdk.Connection.from_recognizer(recognizer)
+            connection.open(True)
+        return STTSession(recognizer, push_stream, connection)
+
+
+def create_stt_engine(name: str, speech_key: str = None, region: str = None, language: str = "fr-FR",
+                      segmentation_silence_ms: int = None, script_path: str = None) -> STTEngine:
+    """Instancie le moteur STT demandé ("azure" ou "scripted", hors ligne)."""
+    if name == "azure":
+        return AzureSTTEngine(speech_key, region, language, segmentation_silence_ms)
+    if name == "scripted":
+        from fakes.speech import ScriptedSTTEngine, DEFAULT_SCRIPT
+
+        script = DEFAULT_SCRIPT
+        if script_path:
+            with open(script_path, "r", encoding="utf-8") as f:
+                script = [line.strip() for line in f if line.strip()]
+        return ScriptedSTTEngine(script, segmentation_silence_ms=segmentation_silence_ms or 400)
+    raise ValueError(f"Moteur STT inconnu: {name}")
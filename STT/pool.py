@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from STT.engine import STTEngine, STTSession
+
+
+class RecognizerPool:
+    """
+    Recognizers d'un worker : un pool de `size` sessions construites à l'avance,
+    et les sessions des appels en cours, réutilisées d'une connexion
+    /media-stream à l'autre pour un même `call_sid` (redirections Twilio).
+
+    Les appels bloquants du SDK (construction, arrêt) passent par un exécuteur
+    partagé de `executor_threads` threads ; le démarrage est asynchrone. Aucun
+    thread n'est donc créé par connexion. Une session rendue est gardée
+    `park_ttl` secondes en attendant la connexion suivante du même appel ; une
+    session du pool non utilisée après `max_idle` secondes est remplacée
+    (connexion au service expirée).
+    """
+
+    def __init__(self, engine: STTEngine, size: int = 4, executor_threads: int = 8, park_ttl: float = 30.0,
+                 max_idle: float = 300.0):
+        self.engine = engine
+        self.size = size
+        self.park_ttl = park_ttl
+        self.max_idle = max_idle
+        self._executor = ThreadPoolExecutor(max_workers=executor_threads, thread_name_prefix="stt")
+        self._idle = deque()
+        self._parked = {}  # call_sid -> STTSession
+        self._filling = None
+        self._janitor = None
+        self._tasks = set()  # fermetures en cours
+        self.in_use = 0
+        self.stats = {"pool": 0, "parked": 0, "new": 0, "closed": 0, "errors": 0}
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _blocking(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def start(self, janitor_interval: float = 5.0):
+        """Remplit le pool en tâche de fond et lance le nettoyage périodique."""
+        self._fill()
+        self._janitor = asyncio.create_task(self._expire_loop(janitor_interval))
+
+    async def fill(self) -> int:
+        """Attend que le pool soit rempli (préchauffage) ; retourne le nombre de recognizers prêts."""
+        self._fill()
+        await asyncio.shield(self._filling)
+        if self.size and not self._idle:
+            raise RuntimeError("aucun recognizer n'a pu être créé")
+        return len(self._idle)
+
+    async def stop(self):
+        for task in (self._janitor, self._filling):
+            if task:
+                task.cancel()
+        sessions = list(self._idle) + list(self._parked.values())
+        self._idle.clear()
+        self._parked.clear()
+        await asyncio.gather(*(self._close(session) for session in sessions))
+        self._executor.shutdown(wait=False)
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    @property
+    def parked(self) -> int:
+        return len(self._parked)
+
+    async def acquire(self, call_sid: str = None) -> tuple:
+        """
+        Session pour une connexion : (session, origine) avec origine parmi
+        "parked" (même appel, reconnaissance déjà en cours), "pool" ou "new".
+        La reconnaissance est démarrée sans attendre la connexion au service.
+        """
+        session = self._parked.pop(call_sid, None) if call_sid else None
+        source = "parked"
+        if session is None:
+            source = "pool"
+            session = self._pop_idle()
+            if session is None:
+                source = "new"
+                session = await self._blocking(self.engine.create_session)
+            session.start()
+        session.parked_at = None
+        session.call_sid = call_sid
+        self.in_use += 1
+        self.stats[source] += 1
+        self._fill()
+        return session, source
+
+    def release(self, call_sid: str, session: STTSession):
+        """Fin d'une connexion : la session reste ouverte pour la suivante du même appel."""
+        self.in_use -= 1
+        session.bind(None, None)
+        if not call_sid or session.closed:
+            self._spawn(self._close(session))
+            return
+        previous = self._parked.pop(call_sid, None)
+        if previous is not None and previous is not session:
+            self._spawn(self._close(previous))
+        session.parked_at = time.monotonic()
+        self._parked[call_sid] = session
+
+    def discard(self, call_sid: str):
+        """Appel terminé : ferme la session gardée pour cet appel."""
+        session = self._parked.pop(call_sid, None)
+        if session is not None:
+            self._spawn(self._close(session))
+
+    def _pop_idle(self):
+        now = time.monotonic()
+        while self._idle:
+            session = self._idle.popleft()
+            if now - session.created_at <= self.max_idle:
+                return session
+            self._spawn(self._close(session))
+        return None
+
+    def _fill(self):
+        if self._filling is None or self._filling.done():
+            self._filling = asyncio.create_task(self._fill_pool())
+
+    async def _fill_pool(self):
+        while len(self._idle) < self.size:
+            # Constructions en parallèle, dans la limite des threads de l'exécuteur
+            results = await asyncio.gather(
+                *(self._blocking(self.engine.create_session) for _ in range(self.size - len(self._idle))),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    self.stats["errors"] += 1
+                    logging.error("Création d'un recognizer du pool impossible: %s", result)
+                else:
+                    self._idle.append(result)
+            if any(isinstance(result, Exception) for result in results):
+                return
+
+    async def _close(self, session: STTSession):
+        try:
+            await self._blocking(session.close)
+        except Exception as e:
+            logging.error("Fermeture du recognizer impossible: %s", e)
+        self.stats["closed"] += 1
+
+    async def _expire_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for call_sid, session in list(self._parked.items()):
+                if now - session.parked_at > self.park_ttl:
+                    self.discard(call_sid)
+            while self._idle and now - self._idle[0].created_at > self.max_idle:
+                self._spawn(self._close(self._idle.popleft()))
+            self._fill()
@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+from collections import OrderedDict
+
+from TTS.synthesizer import TTSBackend
+
+
+def audio_key(text: str, voice: str, language: str) -> str:
+    """Clé d'un audio synthétisé : empreinte de (texte, voix, langue)."""
+    content = "\x1f".join((" ".join(text.split()), voice or "", language or ""))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class AudioStore:
+    """
+    Audio μ-law 8 kHz sur disque (`<répertoire>/<2 car.>/<clé>.ulaw`), lu par
+    projection mémoire : `get` retourne une vue sur le fichier projeté, que
+    l'envoi découpe en trames sans copie.
+
+    La taille totale est bornée (`max_bytes`) avec éviction LRU des fichiers ;
+    au démarrage, l'ordre LRU est repris de la date de modification. Au plus
+    `max_mapped` fichiers restent projetés.
+
+    L'index (tailles, projections, ordre LRU) n'est pas protégé par un verrou :
+    il n'est modifié que depuis la boucle d'événements ; seule l'écriture d'un
+    fichier (`write`) peut passer par un thread.
+    """
+
+    def __init__(self, directory: str = "tts_cache", max_bytes: int = 64 * 1024 * 1024, max_mapped: int = 512):
+        self.directory = os.path.abspath(directory)  # indépendant d'un changement de répertoire courant
+        self.max_bytes = max_bytes
+        self.max_mapped = max_mapped
+        self._sizes = OrderedDict()  # clé -> taille, du moins au plus récemment utilisé
+        self._mapped = OrderedDict()  # clé -> mmap
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evictions": 0}
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.ulaw")
+
+    def _scan(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".ulaw"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._sizes
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def get(self, key: str):
+        """Vue (memoryview) sur l'audio en cache, ou None."""
+        if key not in self._sizes:
+            self.stats["misses"] += 1
+            return None
+        self._sizes.move_to_end(key)
+        mapped = self._mapped.get(key)
+        if mapped is None:
+            try:
+                mapped = self._map(key)
+            except OSError as e:
+                logging.error("Audio en cache illisible (%s): %s", key, e)
+                self._remove(key)
+                self.stats["misses"] += 1
+                return None
+        else:
+            self._mapped.move_to_end(key)
+        self.stats["hits"] += 1
+        return memoryview(mapped)
+
+    def preload(self, key: str) -> bool:
+        """Projette l'audio en mémoire et en demande la lecture au noyau, sans compter d'accès."""
+        if key not in self._sizes or key in self._mapped:
+            return key in self._mapped
+        try:
+            mapped = self._map(key)
+        except OSError as e:
+            logging.error("Audio en cache illisible (%s): %s", key, e)
+            return False
+        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            mapped.madvise(mmap.MADV_WILLNEED)
+        return True
+
+    def _map(self, key: str):
+        path = self._path(key)
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        os.utime(path)  # ordre LRU retrouvé au prochain démarrage
+        self._mapped[key] = mapped
+        while len(self._mapped) > self.max_mapped:
+            # Pas de close() : une vue peut encore être en cours d'envoi ;
+            # la projection est libérée avec la dernière vue
+            self._mapped.popitem(last=False)
+        return mapped
+
+    def write(self, key: str, audio: bytes) -> bool:
+        """
+        Écrit le fichier audio (atomiquement) sans toucher à l'index : seule
+        partie de l'ajout exécutée hors de la boucle d'événements. `add` le
+        référence ensuite, depuis la boucle.
+        """
+        if not audio or len(audio) > self.max_bytes:
+            return False
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+        return True
+
+    def add(self, key: str, size: int):
+        """Référence un fichier écrit par `write` et applique l'éviction LRU."""
+        if key in self._sizes:
+            self.total_bytes -= self._sizes.pop(key)
+            self._mapped.pop(key, None)
+        self._sizes[key] = size
+        self.total_bytes += size
+        self.stats["stored"] += 1
+        self._evict()
+
+    def put(self, key: str, audio: bytes):
+        if self.write(key, audio):
+            self.add(key, len(audio))
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._sizes:
+            self._remove(next(iter(self._sizes)))
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        self.total_bytes -= self._sizes.pop(key, 0)
+        self._mapped.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class CachedTTS(TTSBackend):
+    """
+    Moteur TTS avec cache audio : une phrase déjà synthétisée (même texte, voix
+    et langue) est servie depuis `AudioStore` sans appel au moteur. Les
+    synthèses simultanées d'une même phrase sont regroupées.
+
+    `synthesize(text, cache=False)` contourne le cache, pour les phrases propres
+    à un patient (nom, date) qui ne doivent pas être conservées sur disque.
+    """
+
+    def __init__(self, backend: TTSBackend, store: AudioStore, language: str = "fr-FR", max_chars: int = 200,
+                 on_lookup=None):
+        self.backend = backend
+        self.store = store
+        self.language = language
+        self.max_chars = max_chars
+        self.on_lookup = on_lookup  # appelé avec "hit", "miss" ou "bypass"
+        self.name = f"cached-{backend.name}"
+        self._inflight = {}
+
+    def key(self, text: str) -> str:
+        return audio_key(text, f"{self.backend.name}:{getattr(self.backend, 'voice', '')}", self.language)
+
+    def _count(self, result: str):
+        if self.on_lookup:
+            self.on_lookup(result)
+
+    async def synthesize(self, text: str, cache: bool = True):
+        if not cache or len(text) > self.max_chars:
+            self._count("bypass")
+            return await self.backend.synthesize(text)
+        key = self.key(text)
+        audio = self.store.get(key)
+        if audio is not None:
+            self._count("hit")
+            return audio
+        self._count("miss")
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._synthesize_and_store(key, text))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _synthesize_and_store(self, key: str, text: str) -> bytes:
+        audio = await self.backend.synthesize(text)
+        # Écriture du fichier dans un thread, index mis à jour sur la boucle
+        if audio and await asyncio.to_thread(self.store.write, key, bytes(audio)):
+            self.store.add(key, len(audio))
+        return audio
+
+    async def warmup(self, texts, concurrency: int = 4) -> int:
+        """
+        Prépare le moteur, projette en mémoire l'audio déjà en cache des phrases
+        fixes et synthétise les autres ; retourne le nombre de phrases synthétisées.
+        """
+        limiter = asyncio.Semaphore(concurrency)
+        texts = [text for text in dict.fromkeys(texts) if text]
+        missing = [text for text in texts if self.key(text) not in self.store]
+        try:
+            await self.backend.warmup()
+        except Exception as e:
+            logging.error("Préchauffage du moteur TTS impossible: %s", e)
+        for text in texts[:self.store.max_mapped]:
+            self.store.preload(self.key(text))
+
+        async def prepare(text: str):
+            async with limiter:
+                try:
+                    await self._synthesize_and_store(self.key(text), text)
+                except Exception as e:
+                    logging.error("Préchauffage TTS impossible pour « %s »: %s", text, e)
+
+        await asyncio.gather(*(prepare(text) for text in missing))
+        logging.info("Cache TTS: %s phrases synthétisées au démarrage, %s en cache (%.1f Mo)",
+                     len(missing), len(self.store), self.store.total_bytes / 1e6)
+        return len(missing)
+
+    def hit_rate(self) -> float:
+        total = self.store.stats["hits"] + self.store.stats["misses"]
+        return self.store.stats["hits"] / total if total else 0.0
+
+    def close(self):
+        self.backend.close()
@@ -0,0 +1,54 @@
+import re
+
+# Ponctuation de fin de phrase suivie d'un espace (ou fin de flux)
+_SENTENCE_END = re.compile(r"[.!?;:…]+[\"»)\]]*\s+")
+
+
+class SentenceChunker:
+    """
+    Découpe un flux de tokens LLM en phrases prêtes à être synthétisées.
+    Une phrase n'est émise que si elle dépasse `min_chars`, pour éviter
+    d'envoyer au TTS des fragments trop courts ("Oui.", "Bien.").
+    """
+
+    def __init__(self, min_chars: int = 12, max_chars: int = 240):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> list:
+        """Ajoute un delta et retourne les phrases complètes disponibles."""
+        if not delta:
+            return []
+        self._buffer += delta
+        chunks = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            end = match.end()
+            if end - start >= self.min_chars:
+                chunks.append(self._buffer[start:end].strip())
+                start = end
+        self._buffer = self._buffer[start:]
+        # Pas de ponctuation depuis trop longtemps : coupe au dernier espace
+        if len(self._buffer) > self.max_chars:
+            cut = self._buffer.rfind(" ", 0, self.max_chars)
+            if cut > 0:
+                chunks.append(self._buffer[:cut].strip())
+                self._buffer = self._buffer[cut + 1:]
+        return [c for c in chunks if c]
+
+    def flush(self) -> list:
+        """Retourne le reste du buffer à la fin du flux."""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+
+async def chunk_sentences(deltas, min_chars: int = 12):
+    """Transforme un générateur asynchrone de deltas en générateur de phrases."""
+    chunker = SentenceChunker(min_chars=min_chars)
+    async for delta in deltas:
+        for sentence in chunker.feed(delta):
+            yield sentence
+    for sentence in chunker.flush():
+        yield sentence
@@ -0,0 +1,34 @@
+import base64
+import json
+
+# 20 ms de μ-law à 8 kHz, la taille de trame utilisée par Twilio
+FRAME_BYTES = 160
+
+
+def media_messages(stream_sid: str, ulaw_audio, frame_bytes: int = FRAME_BYTES):
+    """
+    Découpe l'audio μ-law (bytes, ou vue sur un fichier projeté du cache TTS :
+    les trames sont lues sans copie) en messages `media` Twilio (JSON sérialisé).
+    """
+    view = memoryview(ulaw_audio)
+    # Seule la charge utile change d'une trame à l'autre (base64 : rien à échapper)
+    prefix = json.dumps({"event": "media", "streamSid": stream_sid, "media": {"payload": ""}})[:-3]
+    for offset in range(0, len(view), frame_bytes):
+        yield prefix + base64.b64encode(view[offset:offset + frame_bytes]).decode("ascii") + '"}}'
+
+
+async def send_audio(websocket, stream_sid: str, ulaw_audio, mark: str = None):
+    """
+    Envoie l'audio sur le flux bidirectionnel. Twilio met les trames en file et
+    les joue dans l'ordre ; le `mark` optionnel est renvoyé par Twilio une fois
+    l'audio précédent joué.
+    """
+    for message in media_messages(stream_sid, ulaw_audio):
+        await websocket.send_text(message)
+    if mark:
+        await websocket.send_text(json.dumps({"event": "mark", "streamSid": stream_sid, "mark": {"name": mark}}))
+
+
+async def clear_audio(websocket, stream_sid: str):
+    """Vide l'audio en file chez Twilio (interruption) ; les marks en attente sont renvoyés aussitôt."""
+    await websocket.send_text(json.dumps({"event": "clear", "streamSid": stream_sid}))
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+
+# Format attendu par Twilio sur un flux média bidirectionnel : μ-law 8 kHz mono
+SAMPLE_RATE = 8000
+ULAW_SILENCE = b"\xff"
+
+
+class TTSBackend:
+    """
+    Interface commune des moteurs TTS.
+    `synthesize` retourne de l'audio μ-law 8 kHz mono, directement envoyable à Twilio.
+    """
+
+    name = "base"
+
+    async def synthesize(self, text: str) -> bytes:
+        raise NotImplementedError
+
+    async def warmup(self):
+        """Prépare le moteur (SDK, connexion) avant la première synthèse."""
+
+    def close(self):
+        pass
+
+
+class AzureTTS(TTSBackend):
+    """
+    Synthèse via Azure Speech, en sortie brute μ-law 8 kHz (aucun transcodage nécessaire).
+
+    Un SpeechSynthesizer traite ses requêtes une à une : les phrases des appels
+    simultanés sont réparties sur un pool de `pool_size` synthétiseurs (créés à
+    la demande, ou tous au préchauffage). Au-delà, une phrase attend qu'un
+    synthétiseur se libère.
+    """
+
+    name = "azure"
+
+    def __init__(self, speech_key: str, region: str, voice: str = "fr-FR-DeniseNeural", pool_size: int = 4):
+        self.speech_key = speech_key
+        self.region = region
+        self.voice = voice
+        self.pool_size = max(1, pool_size)
+        self._speechsdk = None
+        self._speech_config = None
+        self._idle = deque()  # synthétiseurs libres
+        self._created = 0
+        self._slots = None  # asyncio.Semaphore(pool_size), créé dans la boucle du worker
+        self._lock = threading.Lock()
+
+    def _configure(self):
+        # SDK Speech importé au premier usage (préchauffage ou synthèse), hors de l'import de l'application
+        with self._lock:
+            if self._speech_config is not None:
+                return
+            import azure.cognitiveservices.speech as speechsdk
+
+            speech_config = speechsdk.SpeechConfig(subscription=self.speech_key, region=self.region)
+            speech_config.speech_synthesis_voice_name = self.voice
+            speech_config.set_speech_synthesis_output_format(
+                speechsdk.SpeechSynthesisOutputFormat.Raw8Khz8BitMonoMULaw
+            )
+            self._speechsdk = speechsdk
+            self._speech_config = speech_config
+
+    def _create_synthesizer(self, connect: bool = False):
+        self._configure()
+        # audio_config=None : l'audio reste en mémoire au lieu d'aller vers un haut-parleur
+        synthesizer = self._speechsdk.SpeechSynthesizer(speech_config=self._speech_config, audio_config=None)
+        if connect:
+            # Connexion au service ouverte avant la première phrase non cachée
+            self._speechsdk.Connection.from_speech_synthesizer(synthesizer).open(True)
+        return synthesizer
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        return self._slots
+
+    async def warmup(self):
+        missing = self.pool_size - self._created
+        self._created += missing
+        try:
+            synthesizers = await asyncio.gather(
+                *(asyncio.to_thread(self._create_synthesizer, True) for _ in range(missing))
+            )
+        except Exception:
+            self._created -= missing
+            raise
+        self._idle.extend(synthesizers)
+
+    async def _acquire(self):
+        if self._idle:
+            return self._idle.pop()
+        self._created += 1
+        try:
+            return await asyncio.to_thread(self._create_synthesizer)
+        except Exception:
+            self._created -= 1
+            raise
+
+    def _synthesize_blocking(self, synthesizer, text: str) -> bytes:
+        result = synthesizer.speak_text_async(text).get()
+        if result.reason == self._speechsdk.ResultReason.SynthesizingAudioCompleted:
+            return result.audio_data
+        logging.error("Échec de la synthèse Azure (%s) pour: %s", result.reason, text)
+        return b""
+
+    async def synthesize(self, text: str) -> bytes:
+        async with self._semaphore():
+            synthesizer = await self._acquire()
+            try:
+                return await asyncio.to_thread(self._synthesize_blocking, synthesizer, text)
+            finally:
+                self._idle.append(synthesizer)
+
+
+class LocalTTS(TTSBackend):
+    """
+    Substitut local pour les tests : produit du silence μ-law dont la durée
+    est proportionnelle à la longueur du texte, avec une latence configurable.
+    """
+
+    name = "local"
+
+    def __init__(self, ms_per_char: int = 60, latency: float = 0.0):
+        self.ms_per_char = ms_per_char
+        self.latency = latency
+
+    async def synthesize(self, text: str) -> bytes:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        n_samples = SAMPLE_RATE * self.ms_per_char * len(text) // 1000
+        return ULAW_SILENCE * n_samples
+
+
+def create_tts_backend(name: str, speech_key: str = None, region: str = None, voice: str = None,
+                       pool_size: int = 4) -> TTSBackend:
+    """Instancie le moteur TTS demandé ("azure" ou "local")."""
+    if name == "azure":
+        return AzureTTS(speech_key, region, voice or "fr-FR-DeniseNeural", pool_size=pool_size)
+    if name == "local":
+        return LocalTTS()
+    raise ValueError(f"Moteur TTS inconnu: {name}")
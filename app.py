@@ -1,11 +1,41 @@
-import os, json, base64, asyncio, audioop, threading, time, logging
+import os, asyncio, time, logging, datetime, hmac, random
+from urllib.parse import parse_qs
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect, BackgroundTasks, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from twilio.twiml.voice_response import VoiceResponse, Connect, Stream
 from dotenv import load_dotenv
-import azure.cognitiveservices.speech as speechsdk
-from LLM.deepinfra import DeepInfraLLM
-from twilio.rest import Client as TwilioClient
+from LLM.deepinfra import AsyncDeepInfraLLM
+from LLM.router import LLMRouter, SMALL, LARGE
+from LLM.http_pool import close_shared_http_client
+from LLM.speculative import SpeculativeResponder
+from LLM.context import ConversationContext, Turn
+from LLM.anonymizer import Anonymizer
+from LLM.response_cache import ResponseCache, private_terms, replay, shareable
+from LLM.summary import IncrementalSummarizer
+from audio.vad import EndpointDetector
+from audio.ingest import MediaIngestor, parse_message
+from STT.engine import create_stt_engine
+from STT.pool import RecognizerPool
+from TTS.chunker import chunk_sentences, SentenceChunker
+from TTS.playback import send_audio, clear_audio
+from TTS.synthesizer import create_tts_backend
+from TTS.cache import AudioStore, CachedTTS
+from post_call import PostCallQueue
+from turn_pipeline import TurnPipeline, UserTurn
+from metrics import (
+    registry, CallTrace, CallTraceLog, monitor_event_loop_lag, ACTIVE_CALLS, ACTIVE_RECOGNIZERS, TURNS,
+    LLM_REQUESTS, LLM_ERRORS, TWILIO_REQUESTS, TWILIO_ERRORS, RESPONSE_CACHE_LOOKUPS, SUMMARY_EXTRACTIONS,
+    SUMMARY_SECONDS, TTS_CACHE_LOOKUPS, STT_SETUP_SECONDS, BARGE_INS, STALE_ANSWER_TOKENS, STALE_ANSWER_AUDIO_SECONDS,
+    LLM_ROUTED, LLM_HEDGES, LLM_TTFT_ESTIMATE, LLM_TOKENS_PER_SECOND_ESTIMATE, ARCHIVE_RECORDS, ARCHIVE_BATCH_SECONDS,
+    WARMUP_STEP_SECONDS, SPECULATION_COUNTERS,
+)
+from session_store import SessionStore, create_session_backend
+from schedule_store import ScheduleStore, normalize_datetime
+from call_archive import CallArchive
+from call_recording import CallRecorder, STT_FINAL, STT_PARTIAL
+from call_assets import AssetCache, PatientDirectory, DEFAULT_CONVERSATION_PLAN
+from startup import Lazy, Warmup
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -19,49 +49,287 @@ TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_CALLER_NUMBER")  # Numéro Twilio d'où les appels seront passés
 PUBLIC_HOST = "presageaichatbot-g6ghcqg8gxh5apcs.westcentralus-01.azurewebsites.net"  # ex: "xxxx.ngrok-free.app"
+# "stream" : réponse LLM synthétisée phrase par phrase sur le flux média ; "twiml" : ancien mode <Say> + <Redirect>
+RESPONSE_MODE = os.getenv("RESPONSE_MODE", "stream")
+TTS_BACKEND = os.getenv("TTS_BACKEND", "azure")  # "azure" ou "local" (tests)
+AZURE_TTS_VOICE = os.getenv("AZURE_TTS_VOICE", "fr-FR-DeniseNeural")
+# Synthétiseurs Azure par worker : phrases d'appels différents synthétisées en parallèle
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "4"))
+# Cache audio TTS (mode stream) : activation, répertoire, taille max (Mo), fichier optionnel de
+# phrases fixes à synthétiser au démarrage (une par ligne), en plus de l'accueil et des réponses types
+TTS_CACHE = os.getenv("TTS_CACHE", "true").lower() == "true"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "64"))
+TTS_WARMUP_PATH = os.getenv("TTS_WARMUP_PATH")
+GREETING = "Bonjour, je suis votre assistante médicale"
+# Génération spéculative sur les transcripts partiels : activation, stabilité requise (ms), similarité min
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "true").lower() == "true"
+SPECULATIVE_STABLE_MS = int(os.getenv("SPECULATIVE_STABLE_MS", "250"))
+SPECULATIVE_SIMILARITY = float(os.getenv("SPECULATIVE_SIMILARITY", "0.9"))
+# Cache de réponses par étape du plan : activation, taille max, durée de vie (s), similarité min,
+# fichier JSON optionnel de réponses types {étape: [{"match": regex, "reply": texte}]}
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "true").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+RESPONSE_TEMPLATES_PATH = os.getenv("RESPONSE_TEMPLATES_PATH")
+# Historique envoyé au LLM : tours gardés mot pour mot, budget de tokens avant repli dans le résumé
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Traitements de fin d'appel (résumé, planning) : workers et taille max de la file
+POST_CALL_WORKERS = int(os.getenv("POST_CALL_WORKERS", "4"))
+POST_CALL_QUEUE_SIZE = int(os.getenv("POST_CALL_QUEUE_SIZE", "1000"))
+# Résumé extrait au fil de l'appel : activation, tours par extraction, délai d'une extraction (s),
+# attente max (s) de la fin d'extraction après raccrochage avant repli sur le résumé complet
+INCREMENTAL_SUMMARY = os.getenv("INCREMENTAL_SUMMARY", "true").lower() == "true"
+SUMMARY_BATCH_TURNS = int(os.getenv("SUMMARY_BATCH_TURNS", "1"))
+SUMMARY_EXTRACTION_TIMEOUT = float(os.getenv("SUMMARY_EXTRACTION_TIMEOUT", "10"))
+SUMMARY_FINALIZE_TIMEOUT = float(os.getenv("SUMMARY_FINALIZE_TIMEOUT", "3"))
+# Sorties JSON du LLM : "json_schema", "json_object" ou "none" (fournisseur sans sortie structurée)
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "json_schema")
+# Sessions en mémoire : nombre max (LRU) et durée de vie sans activité (s)
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+# État des appels partagé entre workers : "memory" (un seul worker) ou "sqlite" (fichier commun aux
+# workers du conteneur, de préférence en mémoire partagée)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "call_sessions.db")
+# Planning des appels (SQLite)
+SCHEDULE_DB_PATH = os.getenv("SCHEDULE_DB_PATH", "call_schedule.db")
+# Archive des transcripts et résumés (call_archive.py) : segments compressés écrits en tâche de fond,
+# fsync "always", "interval" (toutes les ARCHIVE_FSYNC_INTERVAL s) ou "never", lots de ARCHIVE_BATCH_SIZE
+# enregistrements ou de ARCHIVE_MAX_DELAY s. Endpoints /archive désactivés sans ARCHIVE_TOKEN
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "call_archive")
+ARCHIVE_FSYNC = os.getenv("ARCHIVE_FSYNC", "interval")
+ARCHIVE_FSYNC_INTERVAL = float(os.getenv("ARCHIVE_FSYNC_INTERVAL", "1"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "256"))
+ARCHIVE_MAX_DELAY = float(os.getenv("ARCHIVE_MAX_DELAY", "0.5"))
+ARCHIVE_SEGMENT_MB = float(os.getenv("ARCHIVE_SEGMENT_MB", "64"))
+ARCHIVE_TOKEN = os.getenv("ARCHIVE_TOKEN")
+# Enregistrement des connexions pour le rejeu (call_recording.py, benchmarks/replay_calls.py) :
+# trames Twilio, résultats STT et timings des tours, pour une fraction CALL_RECORDING_RATE des connexions
+CALL_RECORDING = os.getenv("CALL_RECORDING", "false").lower() == "true"
+CALL_RECORDING_DIR = os.getenv("CALL_RECORDING_DIR", "call_recordings")
+CALL_RECORDING_RATE = float(os.getenv("CALL_RECORDING_RATE", "1"))
+# Dossiers patients (JSON {téléphone: dossier}) et éléments d'appel préparés par call_assets.py
+PATIENTS_PATH = os.getenv("PATIENTS_PATH", "patients.json")
+CALL_ASSETS_DIR = os.getenv("CALL_ASSETS_DIR", "call_assets")
+PLAN_MODEL = os.getenv("PLAN_MODEL", "meta-llama/Llama-3.3-70B-Instruct-Turbo")
+# Appels non aboutis : délai de base (s) avant nouvelle tentative, doublé à chaque échec
+CALL_RETRY_DELAY = float(os.getenv("CALL_RETRY_DELAY", "300"))
+CALL_MAX_ATTEMPTS = int(os.getenv("CALL_MAX_ATTEMPTS", "3"))
+# Moteur STT ("azure" ou "scripted" : hors ligne, textes de STT_SCRIPT_PATH), recognizers prêts à l'avance
+# par worker, threads partagés pour les appels bloquants du SDK, durée (s) pendant laquelle le recognizer
+# d'un appel est gardé entre deux connexions /media-stream (redirections)
+STT_BACKEND = os.getenv("STT_BACKEND", "azure")
+STT_SCRIPT_PATH = os.getenv("STT_SCRIPT_PATH")
+STT_POOL_SIZE = int(os.getenv("STT_POOL_SIZE", "4"))
+STT_EXECUTOR_THREADS = int(os.getenv("STT_EXECUTOR_THREADS", "8"))
+STT_PARK_TTL = float(os.getenv("STT_PARK_TTL", "30"))
+# Taille (ms) des blocs audio transmis au recognizer (Twilio envoie des trames de 20 ms)
+AUDIO_CHUNK_MS = int(os.getenv("AUDIO_CHUNK_MS", "100"))
+# Silence final (ms) après lequel le tour du patient est considéré terminé
+# Client LLM : requêtes simultanées max, délai par requête (s), intervalle de maintien des connexions (s)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "20"))
+LLM_KEEPALIVE_INTERVAL = float(os.getenv("LLM_KEEPALIVE_INTERVAL", "60"))
+# Préchauffage au démarrage (connexions, recognizers, audio et prompts) : délai (s) au-delà duquel le
+# worker se déclare prêt quand même (/ready), tentatives supplémentaires par étape en échec, étapes
+# désactivées (llm, twilio, stt, prompts, tts ; séparées par des virgules)
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+WARMUP_RETRIES = int(os.getenv("WARMUP_RETRIES", "2"))
+WARMUP_SKIP = {step.strip() for step in os.getenv("WARMUP_SKIP", "").split(",") if step.strip()}
+# Routage des tours entre un petit modèle (étapes fermées du plan) et un grand (étapes ouvertes) ;
+# délai (s) sans premier token avant de doubler la requête vers l'autre modèle, par niveau, et part
+# max des requêtes doublées
+LLM_ROUTER = os.getenv("LLM_ROUTER", "true").lower() == "true"
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "meta-llama/Meta-Llama-3-8B-Instruct")
+LLM_LARGE_MODEL = os.getenv("LLM_LARGE_MODEL", "meta-llama/Llama-3.3-70B-Instruct-Turbo")
+LLM_HEDGE = os.getenv("LLM_HEDGE", "true").lower() == "true"
+LLM_HEDGE_DEADLINE_SMALL = float(os.getenv("LLM_HEDGE_DEADLINE_SMALL", "0.8"))
+LLM_HEDGE_DEADLINE_LARGE = float(os.getenv("LLM_HEDGE_DEADLINE_LARGE", "1.2"))
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.2"))
+VAD_END_SILENCE_MS = int(os.getenv("VAD_END_SILENCE_MS", "400"))
+# Traces de latence par appel (JSON Lines) ; vide pour ne garder que les dernières en mémoire
+CALL_TRACE_PATH = os.getenv("CALL_TRACE_PATH", "call_traces.jsonl")
+# Attente max (s) du résultat final Azure après la fin de tour avant d'utiliser le partiel
+FINAL_RESULT_WAIT = float(os.getenv("FINAL_RESULT_WAIT", "0.8"))
+# Interruption d'une réponse par le patient : activation, durée de parole (ms) détectée par la VAD
+# avant d'interrompre (un partiel STT interrompt aussitôt)
+BARGE_IN = os.getenv("BARGE_IN", "true").lower() == "true"
+BARGE_IN_MIN_SPEECH_MS = int(os.getenv("BARGE_IN_MIN_SPEECH_MS", "300"))
 
-twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-llm_client = DeepInfraLLM(api_key=DEEPINFRA_API_KEY, base_url=DEEPINFRA_BASE_URL)
+def create_twilio_client():
+    from twilio.rest import Client as TwilioClient
 
-app = FastAPI()
+    return TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
-# --- Fonctions de sanitization des données sensibles ---
-def sanitize_context(text: str) -> str:
-    """
-    Remplace les données sensibles par des placeholders.
-    Par exemple, "Paul" devient "<PATIENT_NAME>" et "75 ans" devient "<PATIENT_AGE>".
-    """
-    if text is None:
-        return ""
-    sanitized = text.replace("Paul", "<PATIENT_NAME>").replace("75 ans", "<PATIENT_AGE>")
-    return sanitized
+# Clients créés au premier usage (préchauffage ou requête) : l'import de l'application reste rapide
+twilio_client = Lazy(create_twilio_client, "Client Twilio")
+llm_options = dict(
+    api_key=DEEPINFRA_API_KEY,
+    base_url=DEEPINFRA_BASE_URL,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    request_timeout=LLM_REQUEST_TIMEOUT,
+    structured_output=LLM_STRUCTURED_OUTPUT,
+)
+llm_client = AsyncDeepInfraLLM(model=LLM_SMALL_MODEL, **llm_options)
+if LLM_ROUTER:
+    # Résumés et maintien des connexions restent sur le petit modèle
+    llm_client = LLMRouter(
+        llm_client, AsyncDeepInfraLLM(model=LLM_LARGE_MODEL, **llm_options),
+        deadlines={SMALL: LLM_HEDGE_DEADLINE_SMALL, LARGE: LLM_HEDGE_DEADLINE_LARGE},
+        hedge=LLM_HEDGE, hedge_budget=LLM_HEDGE_BUDGET,
+        on_route=lambda model, reason: LLM_ROUTED.inc(model=model, reason=reason),
+        on_hedge=lambda result: LLM_HEDGES.inc(result=result),
+        on_estimate=lambda model, estimate: (
+            LLM_TTFT_ESTIMATE.set(estimate.ttft or 0, model=model),
+            LLM_TOKENS_PER_SECOND_ESTIMATE.set(estimate.tokens_per_second or 0, model=model),
+        ),
+    )
+schedule_store = ScheduleStore(SCHEDULE_DB_PATH)
+# Transcripts et résumés : aucune écriture disque sur le chemin d'un tour
+archive = CallArchive(
+    ARCHIVE_DIR, fsync=ARCHIVE_FSYNC, fsync_interval=ARCHIVE_FSYNC_INTERVAL, batch_size=ARCHIVE_BATCH_SIZE,
+    max_delay=ARCHIVE_MAX_DELAY, segment_max_bytes=int(ARCHIVE_SEGMENT_MB * 1024 * 1024),
+    on_batch=lambda records, size, seconds: (ARCHIVE_RECORDS.inc(records), ARCHIVE_BATCH_SECONDS.observe(seconds)),
+)
+patient_directory = PatientDirectory(PATIENTS_PATH)
+asset_cache = AssetCache(CALL_ASSETS_DIR, model=PLAN_MODEL)
+response_cache = None
+if RESPONSE_CACHE:
+    cache_options = dict(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, similarity=RESPONSE_CACHE_SIMILARITY)
+    response_cache = (ResponseCache.from_file(RESPONSE_TEMPLATES_PATH, **cache_options) if RESPONSE_TEMPLATES_PATH
+                      else ResponseCache(**cache_options))
+stt_pool = RecognizerPool(
+    create_stt_engine(STT_BACKEND, AZURE_SPEECH_KEY, AZURE_REGION, segmentation_silence_ms=VAD_END_SILENCE_MS,
+                      script_path=STT_SCRIPT_PATH),
+    size=STT_POOL_SIZE, executor_threads=STT_EXECUTOR_THREADS, park_ttl=STT_PARK_TTL,
+)
+tts_backend = create_tts_backend(
+    TTS_BACKEND, AZURE_SPEECH_KEY, AZURE_REGION, AZURE_TTS_VOICE, pool_size=TTS_POOL_SIZE
+) if RESPONSE_MODE == "stream" else None
+tts_cache = None
+if tts_backend is not None and TTS_CACHE:
+    # L'accueil et les phrases récurrentes sont servis depuis le disque, sans synthèse
+    tts_cache = tts_backend = CachedTTS(
+        tts_backend, AudioStore(TTS_CACHE_DIR, max_bytes=int(TTS_CACHE_MAX_MB * 1024 * 1024)),
+        on_lookup=lambda result: TTS_CACHE_LOOKUPS.inc(result=result),
+    )
 
-def restore_sensitive_data(text: str) -> str:
-    """
-    Remplace les placeholders par les vraies données sensibles.
-    """
-    if text is None:
-        return ""
-    restored = text.replace("<PATIENT_NAME>", "Paul").replace("<AGE>", "75")
-    return restored
+def fixed_phrases() -> list:
+    """Phrases synthétisées au démarrage : accueil, phrases des réponses types sans donnée patient, fichier optionnel."""
+    replies = ([reply for rules in response_cache.templates.values() for _, reply in rules]
+               if response_cache is not None else [])
+    phrases = [GREETING]
+    for reply in replies:
+        # Même découpage que lors de la lecture de la réponse
+        chunker = SentenceChunker()
+        phrases += [sentence for sentence in chunker.feed(reply) + chunker.flush() if "<" not in sentence]
+    if TTS_WARMUP_PATH:
+        with open(TTS_WARMUP_PATH, "r", encoding="utf-8") as f:
+            phrases += [line.strip() for line in f if line.strip()]
+    return phrases
+
+def warm_twilio():
+    """Client REST créé (import du SDK) et connexion TLS ouverte vers l'API Twilio."""
+    client = twilio_client.get()
+    if hasattr(client, "api"):
+        client.api.v2010.accounts(TWILIO_ACCOUNT_SID).fetch()
+
+def warm_prompts() -> dict:
+    """Dossiers patients et éléments préparés des appels de l'heure à venir, relus avant le premier appel."""
+    now = datetime.datetime.now()
+    due = schedule_store.due_calls(now - datetime.timedelta(minutes=10), now + datetime.timedelta(hours=1), limit=500)
+    prepared = 0
+    for call in due:
+        patient = patient_directory.get(call["patient"])
+        if patient is not None and asset_cache.get(patient) is not None:
+            prepared += 1
+    default_anonymizer.sanitize(GREETING)
+    return {"due_calls": len(due), "prepared": prepared}
+
+async def warm_tts() -> dict:
+    synthesized = await tts_cache.warmup(fixed_phrases())
+    return {"synthesized": synthesized, "cached": len(tts_cache.store)}
+
+# Étapes indépendantes, exécutées en parallèle au démarrage ; /ready attend leur fin
+warmup = Warmup(timeout=WARMUP_TIMEOUT, retries=WARMUP_RETRIES, skip=WARMUP_SKIP,
+                on_step=lambda step, seconds, ok: WARMUP_STEP_SECONDS.set(seconds, step=step))
+warmup.add("llm", lambda: llm_client.warmup())
+warmup.add("twilio", lambda: asyncio.to_thread(warm_twilio))
+warmup.add("stt", lambda: stt_pool.fill())
+warmup.add("prompts", lambda: asyncio.to_thread(warm_prompts))
+if tts_cache is not None:
+    warmup.add("tts", warm_tts)
+elif tts_backend is not None:
+    warmup.add("tts", tts_backend.warmup)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    post_call_queue.start()
+    archive.start()
+    await stt_pool.start()
+    warmup.start()
+    # Connexions TLS vers DeepInfra ouvertes par le préchauffage, puis maintenues
+    keepalive_task = asyncio.create_task(llm_client.keep_warm(LLM_KEEPALIVE_INTERVAL, delay=LLM_KEEPALIVE_INTERVAL))
+    loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+    yield
+    keepalive_task.cancel()
+    loop_lag_task.cancel()
+    await warmup.stop()
+    await post_call_queue.stop()
+    # Après la file post-appel : les derniers résumés sont écrits avant l'arrêt
+    await archive.stop()
+    await stt_pool.stop()
+    await close_shared_http_client()
+
+app = FastAPI(lifespan=lifespan)
+
+# --- Données sensibles ---
+# Dossier patient utilisé tant que les dossiers ne sont pas transmis à la session
+DEFAULT_PATIENT = {"name": "Paul", "age": 75}
+default_anonymizer = Anonymizer.from_patient(DEFAULT_PATIENT)
 
 # --- Gestion des sessions par appel ---
 class CallSession:
-    def __init__(self, call_sid: str):
+    def __init__(self, call_sid: str, patient: dict = None, assets=None, phone: str = None):
         self.call_sid = call_sid
-        self.conversation = []  # liste de dicts avec "patient" et "IA"
+        self.patient = patient or DEFAULT_PATIENT
+        self.phone = phone  # clé du patient dans l'archive
+        self.started_at = datetime.datetime.now().isoformat(timespec="seconds")
+        # Anonymiseur propre au patient : chaque texte n'est anonymisé qu'une fois.
+        # Plan, préfixe de prompt et tables d'anonymisation préparés avant l'appel (call_assets.py)
+        self.anonymizer = assets.anonymizer() if assets else Anonymizer.from_patient(self.patient)
+        self.profile_messages = [{"role": "system", "content": assets.profile_prompt}] if assets else []
+        # Mots du dossier (santé, centres d'intérêt...) : une réponse qui les reprend n'est pas mise en cache
+        self.private_terms = private_terms(self.patient)
+        self.conversation = []  # liste de Turn (texte brut), seule copie complète du transcript
         self.current_step_index = 0
-        self.context = ""
-        self.conversation_plan = [
-            "Salutation et Verifier l'identité du patient nom",
-            "Prendre date de RDV pour prochain suivi, avec heure",
-            "Se renseigner sur quelque chose de spécifique 1 (s'il mange bien)",
-            "Se renseigner sur quelque chose de spécifique 2 (s'il a dormi)",
-            "Parler d'un centre d'intérêt du patient 1",
-            "Parler d'un centre d'intérêt du patient 2",
-            "Au revoir"
-        ]
+        # Historique borné et déjà anonymisé, sous forme de messages de chat
+        self.context = self._new_context()
+        self.conversation_plan = assets.plan if assets else DEFAULT_CONVERSATION_PLAN
         self.summary_generated = False
+        # Résumé structuré extrait en tâche de fond à chaque tour
+        self.summarizer = IncrementalSummarizer(
+            llm_client, self.anonymizer, self.patient, batch_turns=SUMMARY_BATCH_TURNS,
+            timeout=SUMMARY_EXTRACTION_TIMEOUT, on_extraction=self._on_extraction,
+        ) if INCREMENTAL_SUMMARY else None
+        # État partagé entre workers : version connue ici, changements pas encore écrits
+        self.version = 0
+        self._changes = []
+
+    def _new_context(self) -> ConversationContext:
+        return ConversationContext(
+            max_turns=CONTEXT_MAX_TURNS, token_budget=CONTEXT_TOKEN_BUDGET, sanitize=self.anonymizer.sanitize,
+            summary_source=self._summary_state,
+        )
+
+    def _summary_state(self):
+        """Résumé structuré (anonymisé) et tours couverts, qui condensent les tours repliés du contexte."""
+        if self.summarizer is None:
+            return None
+        return self.summarizer.summary.fields, self.summarizer.extracted
 
     def get_current_step(self) -> str:
         if self.current_step_index < len(self.conversation_plan):
@@ -71,48 +339,111 @@ class CallSession:
     def increment_step(self):
         if self.current_step_index < len(self.conversation_plan) - 1:
             self.current_step_index += 1
+        self._record("step")
+
+    def history_messages(self) -> list:
+        """Messages anonymisés placés après le préfixe statique : profil du patient puis historique."""
+        return self.profile_messages + self.context.history_messages()
 
     def append_conversation(self, patient_text: str, ai_text: str):
-        self.conversation.append({"patient": patient_text, "IA": ai_text})
-        self.context += f"Question: {patient_text}\nRéponse: {ai_text}\n"
-
-    def save_summary(self, summary: dict):
-        filename = f"conversation_summary_{self.call_sid}.json"
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(json.dumps(summary, indent=2, ensure_ascii=False))
-        logging.info(f"Résumé sauvegardé dans {filename}")
-
-# Dictionnaire pour stocker les sessions en cours
-sessions = {}
-
-# --- Fonctions utilitaires STT ---
-def create_speech_recognizer():
-    speech_config = speechsdk.SpeechConfig(subscription=AZURE_SPEECH_KEY, region=AZURE_REGION)
-    speech_config.speech_recognition_language = "fr-FR"
-    audio_format = speechsdk.audio.AudioStreamFormat(
-        samples_per_second=8000, bits_per_sample=16, channels=1
-    )
-    push_stream = speechsdk.audio.PushAudioInputStream(stream_format=audio_format)
-    audio_config = speechsdk.audio.AudioConfig(stream=push_stream)
-    recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
-    return recognizer, push_stream
-
-def start_azure_recognition(recognizer, on_recognized):
-    def recognizing_handler(evt):
-        pass  # Logging intermédiaire si nécessaire
-    def recognized_handler(evt):
-        text = evt.result.text
-        if text:
-            on_recognized(text)
-    def canceled_handler(evt):
-        logging.error("Azure Speech recognition canceled: %s", evt)
-    recognizer.recognizing.connect(recognizing_handler)
-    recognizer.recognized.connect(recognized_handler)
-    recognizer.canceled.connect(canceled_handler)
-    recognizer.start_continuous_recognition()
+        self.conversation.append(Turn(patient_text, ai_text))
+        self.context.add_turn(patient_text, ai_text)
+        if self.summarizer is not None:
+            self.summarizer.add_turn(patient_text, ai_text)
+        self._record("turn", patient_text, ai_text)
+        archive.record_turn(self.call_sid, self.phone, len(self.conversation) - 1, patient_text, ai_text)
+
+    def transcript_text(self) -> str:
+        return "\n".join(f"Patient: {turn.patient}\nIA: {turn.ai}" for turn in self.conversation)
+
+    def memory_usage(self) -> int:
+        """Taille approximative en octets du transcript et de l'historique LLM."""
+        return sum(len(turn.patient) + len(turn.ai) for turn in self.conversation) + self.context.memory_usage()
+
+    # --- État partagé entre workers (cf. SessionStore) ---
+    def _record(self, *change):
+        if sessions.backend is not None:
+            self._changes.append(change)
+
+    def _on_extraction(self, result: str):
+        SUMMARY_EXTRACTIONS.inc(result=result)
+        if result != "failed" and sessions.backend is not None:
+            self._record("summary", {field: list(value) if isinstance(value, list) else value
+                                     for field, value in self.summarizer.summary.fields.items()},
+                         self.summarizer.extracted)
+            sessions.save_soon(self)
+
+    @property
+    def changes(self) -> int:
+        return len(self._changes)
+
+    def mark_synced(self, changes: int):
+        del self._changes[:changes]
+
+    def snapshot(self) -> dict:
+        summary = None
+        if self.summarizer is not None:
+            summary = {"fields": self.summarizer.summary.fields, "extracted": self.summarizer.extracted}
+        return {"turns": [[turn.patient, turn.ai] for turn in self.conversation], "step": self.current_step_index,
+                "summary": summary}
+
+    def rebase(self, state: dict) -> dict:
+        """État relu d'un autre worker, complété des changements faits ici depuis la dernière écriture."""
+        state = dict(state, turns=list(state["turns"]))
+        for change in self._changes:
+            if change[0] == "turn":
+                state["turns"].append([change[1], change[2]])
+            elif change[0] == "step":
+                state["step"] = min(state["step"] + 1, max(len(self.conversation_plan) - 1, state["step"]))
+            elif change[0] == "summary" and change[2] > (state.get("summary") or {}).get("extracted", 0):
+                state["summary"] = {"fields": change[1], "extracted": change[2]}
+        return state
+
+    def restore(self, state: dict):
+        """Reprend l'état d'un appel (transcript, étape du plan, résumé en cours) écrit par un autre worker."""
+        self.conversation = [Turn(patient_text, ai_text) for patient_text, ai_text in state["turns"]]
+        self.context = self._new_context()
+        for turn in self.conversation:
+            self.context.add_turn(turn.patient, turn.ai)
+        self.current_step_index = state["step"]
+        summary = state.get("summary")
+        if self.summarizer is not None:
+            self.summarizer.restore(summary["fields"] if summary else {}, summary["extracted"] if summary else 0,
+                                    state["turns"])
+
+    def archive_call(self, summary: dict):
+        """Transcript complet et résumé, écrits dans l'archive en tâche de fond."""
+        archive.record_call(self.call_sid, self.phone, [[turn.patient, turn.ai] for turn in self.conversation],
+                            summary, started_at=self.started_at)
+
+def load_call_assets(call_sid: str) -> tuple:
+    """
+    Numéro, dossier patient et éléments préparés pour un appel : (phone, patient,
+    assets), sans appel au LLM. `assets` vaut None si l'appel n'a pas été préparé
+    ou si le dossier a changé depuis (plan par défaut).
+    """
+    phone = schedule_store.patient_for_call(call_sid)
+    patient = patient_directory.get(phone) if phone else None
+    if patient is None:
+        return phone, None, None
+    assets = asset_cache.get(patient)
+    if assets is None:
+        logging.info("Appel %s non préparé, plan par défaut", call_sid)
+    return phone, patient, assets
+
+async def create_session(call_sid: str) -> CallSession:
+    phone, patient, assets = await asyncio.to_thread(load_call_assets, call_sid)
+    return CallSession(call_sid, patient, assets, phone=phone)
+
+# Sessions en cours, évincées à la fin de l'appel, par inactivité ou par LRU ; cache local de
+# l'état partagé entre workers si SESSION_BACKEND le permet
+sessions = SessionStore(
+    max_sessions=SESSION_MAX, ttl=SESSION_TTL,
+    backend=create_session_backend(SESSION_BACKEND, SESSION_DB_PATH, ttl=SESSION_TTL),
+)
 
 # --- Fonctions Twilio ---
-def update_call_with_twilio_tts(call_sid, text):
+async def update_call_with_twilio_tts(call_sid, text):
     if PUBLIC_HOST.startswith("http://") or PUBLIC_HOST.startswith("https://"):
         public_url = PUBLIC_HOST
     else:
@@ -123,69 +454,219 @@ def update_call_with_twilio_tts(call_sid, text):
         <Redirect>{public_url}/incoming-call?redirected=true</Redirect>
     </Response>
     '''
+    TWILIO_REQUESTS.inc(operation="update")
     try:
-        twilio_client.calls(call_sid).update(twiml=twiml_response)
+        # Client REST Twilio synchrone : requête exécutée hors de la boucle d'événements
+        await asyncio.to_thread(twilio_client.get().calls(call_sid).update, twiml=twiml_response)
         logging.info("Appel %s mis à jour pour jouer le TTS.", call_sid)
     except Exception as e:
+        TWILIO_ERRORS.inc(operation="update")
         logging.error("Erreur lors de la mise à jour de l'appel avec Twilio TTS: %s", e)
 
+# --- Réponse en streaming sur le flux média ---
+async def stream_llm_to_call(websocket: WebSocket, stream_sid: str, deltas, anonymizer: Anonymizer,
+                             trace=None, on_mark=None, private: frozenset = frozenset()) -> str:
+    """
+    Envoie la réponse du LLM (générateur asynchrone de deltas) au patient au fil
+    de la génération : les deltas sont restaurés au fil de l'eau, puis chaque
+    phrase complète est synthétisée et envoyée en trames μ-law sur le même
+    WebSocket. Retourne le texte complet (restauré) de la réponse.
+    `trace` (TurnTrace) reçoit l'envoi au TTS, le début de la lecture et la durée
+    d'audio envoyée ; `on_mark` le nom du mark suivant chaque phrase. `private` :
+    mots du dossier du patient, qui excluent une phrase du cache audio.
+    """
+    start_time = time.time()
+    sentences = []
+    async for sentence in chunk_sentences(anonymizer.restore_stream(deltas)):
+        if trace:
+            trace.mark("tts_dispatch")
+        if tts_cache is not None:
+            # Phrases contenant une donnée du patient (nom, date, santé, proches...) : jamais conservées sur disque
+            cache = anonymizer.sanitize(sentence) == sentence and shareable(sentence, private)
+            audio = await tts_cache.synthesize(sentence, cache=cache)
+        else:
+            audio = await tts_backend.synthesize(sentence)
+        if not sentences:
+            if trace:
+                trace.mark("playback_start")
+            logging.info("Premier audio envoyé après %.2fs", time.time() - start_time)
+        mark = f"phrase-{trace.index if trace else 0}-{len(sentences)}"
+        if on_mark:
+            on_mark(mark)
+        if trace:
+            trace.attributes["audio_s"] = round(trace.attributes.get("audio_s", 0) + len(audio) / 8000, 2)
+        await send_audio(websocket, stream_sid, audio, mark=mark)
+        sentences.append(sentence)
+    return " ".join(sentences)
+
 def update_call_schedule(call_sid: str, summary: dict):
+    # Patient associé au call_sid dans make_call ; à défaut, le call_sid sert de clé
+    patient = schedule_store.patient_for_call(call_sid)
     next_appt = summary.get("next_appointment_datetime")
-    if next_appt:
+    if next_appt and next_appt != "None":
         try:
-            if os.path.exists("call_schedule.json"):
-                with open("call_schedule.json", "r", encoding="utf-8") as f:
-                    schedule = json.load(f)
-            else:
-                schedule = {}
-            schedule[call_sid] = next_appt
-            with open("call_schedule.json", "w", encoding="utf-8") as f:
-                json.dump(schedule, f, indent=2)
+            schedule_store.upsert(patient or call_sid, next_appt)
             logging.info("Call schedule updated for call %s", call_sid)
         except Exception as e:
-            logging.error("Error updating call_schedule.json: %s", e)
+            logging.error("Error updating call schedule: %s", e)
     else:
         logging.warning("No 'next_appointment_datetime' found in summary for call %s", call_sid)
+        if patient:
+            # Appel abouti sans nouveau rendez-vous : libère l'entrée côté numéroteur
+            schedule_store.set_status(patient, "done")
+
+def reschedule_unanswered_call(call_sid: str, status: str):
+    """Occupé, pas de réponse, échec : nouvelle tentative plus tard (délai exponentiel)."""
+    patient = schedule_store.patient_for_call(call_sid)
+    if patient:
+        new_status = schedule_store.retry_later(patient, base_delay=CALL_RETRY_DELAY, max_attempts=CALL_MAX_ATTEMPTS)
+        logging.info("Appel %s (%s) : patient %s reprogrammé, statut %s", call_sid, status, patient, new_status)
 
 # --- Génération de résumé ---
-def generate_summary_from_text(conversation_text: str) -> dict:
-    raw_summary = llm_client.generate_summary_json(conversation_text)
-    summary = json.loads(raw_summary) if isinstance(raw_summary, str) else raw_summary
-    return summary
+async def generate_summary_from_text(conversation_text: str) -> dict:
+    return await llm_client.generate_summary_json(conversation_text)
 
-async def poll_call_status(call_sid: str, session: CallSession):
-    max_wait_time = 1000
-    poll_interval = 5
-    elapsed = 0
-    while elapsed < max_wait_time:
+async def summarize_session(session: CallSession) -> dict:
+    """
+    Résumé de fin d'appel : l'extraction faite pendant l'appel, complétée des
+    derniers tours ; à défaut (désactivée ou en échec), un résumé complet du transcript.
+    """
+    start = time.monotonic()
+    summary = await session.summarizer.finalize(SUMMARY_FINALIZE_TIMEOUT) if session.summarizer else None
+    mode = "incremental"
+    if summary is None:
+        mode = "full"
+        conversation_text = session.transcript_text()
+        logging.info("Génération du résumé à partir de la conversation:")
+        logging.info(conversation_text)
+        LLM_REQUESTS.inc(operation="summary")
         try:
-            call_details = twilio_client.calls(call_sid).fetch()
-            logging.info("Statut de l'appel %s après %s s: %s", call_sid, elapsed, call_details.status)
-            if call_details.status == "completed":
-                if not session.summary_generated:
-                    conversation_text = "\n".join(
-                        [f"Patient: {entry['patient']}\nIA: {entry['IA']}" for entry in session.conversation]
-                    )
-                    if conversation_text:
-                        logging.info("Génération du résumé à partir de la conversation:")
-                        logging.info(conversation_text)
-                        summary = generate_summary_from_text(conversation_text)
-                        session.save_summary(summary)
-                        update_call_schedule(call_sid, summary)
-                        session.summary_generated = True
-                break
-        except Exception as e:
-            logging.error("Erreur lors de la vérification du statut de l'appel %s: %s", call_sid, e)
-        await asyncio.sleep(poll_interval)
-        elapsed += poll_interval
-    else:
-        logging.warning("Temps d'attente maximum atteint pour l'appel %s, résumé non généré.", call_sid)
+            summary = await generate_summary_from_text(conversation_text)
+        except Exception:
+            LLM_ERRORS.inc(operation="summary")
+            raise
+    SUMMARY_SECONDS.observe(time.monotonic() - start, mode=mode)
+    logging.info("Résumé de l'appel %s (%s) en %.2fs", session.call_sid, mode, time.monotonic() - start)
+    return summary
+
+# Statuts Twilio pour lesquels l'appel est terminé
+TERMINAL_CALL_STATUSES = {"completed", "busy", "no-answer", "failed", "canceled"}
+
+async def process_completed_call(call_sid: str, status: str):
+    """Traitement de fin d'appel, exécuté par les workers de la file post-appel."""
+    if status != "completed":
+        await asyncio.to_thread(reschedule_unanswered_call, call_sid, status)
+    # Session de ce worker ou état écrit par un autre (dernière connexion de l'appel ailleurs)
+    await sessions.flush(call_sid)
+    session = await sessions.open(call_sid, create_session, create=False)
+    if session is None:
+        logging.info("Appel %s terminé (%s) sans session.", call_sid, status)
+        if status == "completed":
+            await asyncio.to_thread(update_call_schedule, call_sid, {})
+        return
+    try:
+        if session.summary_generated:
+            return
+        if session.conversation:
+            summary = await summarize_session(session)
+            session.archive_call(summary)
+            await asyncio.to_thread(update_call_schedule, call_sid, summary)
+            session.summary_generated = True
+        elif status == "completed":
+            await asyncio.to_thread(update_call_schedule, call_sid, {})
+    finally:
+        # L'appel est terminé : la session n'a plus lieu d'occuper la mémoire
+        sessions.release(call_sid)
+
+post_call_queue = PostCallQueue(process_completed_call, maxsize=POST_CALL_QUEUE_SIZE, workers=POST_CALL_WORKERS)
+
+# --- Métriques ---
+registry.gauge("presage_post_call_queue_depth", "Appels en attente de traitement post-appel",
+               function=lambda: post_call_queue.depth)
+registry.gauge("presage_archive_queue_depth", "Enregistrements en attente d'écriture dans l'archive",
+               function=lambda: archive.depth)
+registry.gauge("presage_sessions", "Sessions d'appel en mémoire", function=lambda: len(sessions))
+registry.gauge("presage_ready", "Worker préchauffé et prêt (1) ou en préchauffage (0)",
+               function=lambda: 1 if warmup.ready else 0)
+registry.gauge("presage_stt_pool_idle", "Recognizers prêts dans le pool", function=lambda: stt_pool.idle)
+registry.gauge("presage_stt_parked", "Recognizers gardés entre deux connexions d'un appel",
+               function=lambda: stt_pool.parked)
+registry.gauge("presage_tts_cache_bytes", "Taille du cache audio TTS",
+               function=lambda: tts_cache.store.total_bytes if tts_cache is not None else 0)
+registry.gauge("presage_response_cache_entries", "Réponses en cache",
+               function=lambda: len(response_cache) if response_cache is not None else 0)
+call_trace_log = CallTraceLog(CALL_TRACE_PATH or None)
 
 # --- Endpoints FastAPI ---
 @app.get("/")
 async def root():
     return {"message": "Bienvenue sur le serveur de l'assistant médical."}
 
+@app.get("/ready")
+async def ready():
+    """Sonde de disponibilité : 503 tant que le préchauffage n'est pas terminé."""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Métriques au format texte Prometheus."""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/metrics/calls")
+async def recent_call_traces(limit: int = 20):
+    """Derniers enregistrements de timing par appel (un arbre de spans par tour)."""
+    return list(call_trace_log.recent)[-limit:]
+
+@app.get("/sessions/stats")
+async def sessions_stats():
+    """Occupation mémoire et compteurs d'éviction des sessions."""
+    return sessions.stats()
+
+# Archive des appels : transcripts en clair, réservés aux détenteurs du jeton
+def check_archive_token(request: Request):
+    if not ARCHIVE_TOKEN:
+        raise HTTPException(status_code=404, detail="Archive non exposée (ARCHIVE_TOKEN absent).")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {ARCHIVE_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Jeton d'archive invalide.")
+
+def archive_period(since: str, until: str) -> tuple:
+    try:
+        return (normalize_datetime(since) if since else None), (normalize_datetime(until) if until else None)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates 'since' et 'until' attendues au format ISO 8601.")
+
+@app.get("/archive/stats")
+async def archive_stats():
+    """Appels et patients archivés, segments, file d'écriture."""
+    return await asyncio.to_thread(archive.summary)
+
+@app.get("/archive/patients/{phone}/calls")
+async def patient_calls(phone: str, request: Request, limit: int = 20, since: str = None, until: str = None):
+    """Derniers appels d'un patient (transcript et résumé), du plus récent au plus ancien."""
+    check_archive_token(request)
+    since, until = archive_period(since, until)
+    return await asyncio.to_thread(archive.patient_history, phone, limit, since, until)
+
+@app.get("/archive/calls/{call_sid}")
+async def archived_call(call_sid: str, request: Request):
+    """Appel archivé ; pour un appel en cours, les tours déjà écrits."""
+    check_archive_token(request)
+    call = await asyncio.to_thread(archive.call, call_sid)
+    if call is None:
+        raise HTTPException(status_code=404, detail="Appel inconnu.")
+    return call
+
+@app.get("/archive/export")
+async def export_archive(request: Request, patient: str = None, since: str = None, until: str = None,
+                         kind: str = "call"):
+    """Export JSON Lines en flux, par ordre chronologique : appels complets, ou tours ("turns")."""
+    check_archive_token(request)
+    if kind not in ("call", "turns"):
+        raise HTTPException(status_code=400, detail="Le paramètre 'kind' vaut 'call' ou 'turns'.")
+    since, until = archive_period(since, until)
+    return StreamingResponse(archive.export(patient, since, until, kind), media_type="application/x-ndjson")
+
 # Endpoint pour lancer un appel vers un numéro cible
 @app.post("/make-call")
 async def make_call(request: Request):
@@ -204,20 +685,44 @@ async def make_call(request: Request):
     else:
         public_url = f"https://{PUBLIC_HOST}"
     
+    TWILIO_REQUESTS.inc(operation="create")
     try:
-        call = twilio_client.calls.create(
+        call = await asyncio.to_thread(
+            twilio_client.get().calls.create,
             from_=TWILIO_PHONE_NUMBER,         # Numéro Twilio d'où l'appel est lancé
             to=target_phone,                    # Numéro cible passé dans le payload
             url=f"{public_url}/incoming-call",  # URL pour le callback de l'appel
             method="GET",                       # Méthode HTTP utilisée par Twilio pour récupérer le TwiML
-            send_digits="1234#"                 # DTMF à envoyer automatiquement
+            send_digits="1234#",                # DTMF à envoyer automatiquement
+            status_callback=f"{public_url}/call-status",  # Notification de fin d'appel
+            status_callback_event=["completed"],
+            status_callback_method="POST",
         )
         logging.info("Appel lancé vers %s, Call SID: %s", target_phone, call.sid)
+        await asyncio.to_thread(schedule_store.record_call, call.sid, target_phone)
         return {"message": "Appel lancé", "call_sid": call.sid}
     except Exception as e:
+        TWILIO_ERRORS.inc(operation="create")
         logging.error("Erreur lors du lancement de l'appel: %s", e)
         raise HTTPException(status_code=500, detail="Erreur lors du lancement de l'appel.")
 
+@app.post("/call-status")
+async def call_status(request: Request):
+    """
+    Webhook de statut Twilio (status_callback de make_call). Les appels terminés
+    sont placés dans la file post-appel, une seule fois par call_sid.
+    """
+    form = parse_qs((await request.body()).decode("utf-8"))
+    call_sid = form.get("CallSid", [None])[0]
+    status = form.get("CallStatus", [None])[0]
+    if not call_sid:
+        raise HTTPException(status_code=400, detail="Le paramètre 'CallSid' est requis.")
+    logging.info("Statut de l'appel %s: %s", call_sid, status)
+    if status in TERMINAL_CALL_STATUSES:
+        stt_pool.discard(call_sid)
+        post_call_queue.submit(call_sid, status)
+    return Response(status_code=204)
+
 @app.api_route("/incoming-call", methods=["GET", "POST"])
 async def handle_incoming_call(request: Request, background_tasks: BackgroundTasks):
     """
@@ -225,11 +730,15 @@ async def handle_incoming_call(request: Request, background_tasks: BackgroundTas
     """
     response = VoiceResponse()
     is_redirected = request.query_params.get("redirected", "false") == "true"
-    if not is_redirected:
-        response.say("Bonjour, je suis votre assistante médicale", language="fr-FR", voice="Polly.Lea-Neural")
+    # Accueil joué depuis le cache audio sur le flux média, sinon par <Say>
+    stream_greeting = not is_redirected and tts_cache is not None
+    if not is_redirected and not stream_greeting:
+        response.say(GREETING, language="fr-FR", voice="Polly.Lea-Neural")
     connect = Connect()
     ws_url = f"wss://{request.url.hostname}/media-stream"
     stream = Stream(url=ws_url)
+    if stream_greeting:
+        stream.parameter(name="greeting", value="true")
     connect.append(stream)
     response.append(connect)
     return Response(content=str(response), media_type="application/xml")
@@ -237,56 +746,154 @@ async def handle_incoming_call(request: Request, background_tasks: BackgroundTas
 @app.websocket("/media-stream")
 async def media_stream(websocket: WebSocket):
     await websocket.accept()
-    recognizer, push_stream = create_speech_recognizer()
-    transcript_lock = threading.Lock()
-    current_transcript = ""
-    last_recognized_time = time.time()
-    silence_threshold = 1
+    ACTIVE_CALLS.inc()
+    # Recognizer obtenu à l'événement start (call_sid connu) : repris de la connexion
+    # précédente du même appel, ou pris dans le pool
+    stt = None
+    ingestor = None
     local_call_sid = None
+    stream_sid = None
     session = None  # instance de CallSession
+    call_trace = CallTrace()
+    endpointer = EndpointDetector(end_silence_ms=VAD_END_SILENCE_MS)
+    recorder = None  # CallRecorder si la connexion est enregistrée
 
-    def on_recognized(text):
-        nonlocal current_transcript, last_recognized_time
-        with transcript_lock:
-            current_transcript += " " + text
-            last_recognized_time = time.time()
-        logging.info("Texte reconnu: %s", text)
+    def build_llm_request(transcript: str) -> tuple:
+        # Sanitize l'intégralité des données envoyées au LLM
+        sanitized_context = session.history_messages() if session else []
+        anonymizer = session.anonymizer if session else default_anonymizer
+        sanitized_step = anonymizer.sanitize_cached(session.get_current_step() if session else "Suite de conversation")
+        return sanitized_context, sanitized_step, anonymizer.sanitize(transcript)
 
-    threading.Thread(target=start_azure_recognition, args=(recognizer, on_recognized), daemon=True).start()
+    speculator = SpeculativeResponder(
+        llm_client, build_llm_request, stable_ms=SPECULATIVE_STABLE_MS, similarity=SPECULATIVE_SIMILARITY,
+        on_metric=lambda name, amount: SPECULATION_COUNTERS[name].inc(amount),
+    ) if SPECULATIVE_LLM else None
 
-    async def silence_detector():
-        nonlocal current_transcript, last_recognized_time, local_call_sid, session
-        while True:
-            await asyncio.sleep(1)
-            with transcript_lock:
-                elapsed = time.time() - last_recognized_time
-                if current_transcript.strip() and elapsed > silence_threshold:
-                    transcript_to_send = current_transcript.strip()
-                    logging.info("Silence détecté. Texte brut: %s", transcript_to_send)
-                    
-                    # Sanitize l'intégralité des données envoyées au LLM
-                    sanitized_context = sanitize_context(session.context) if session else ""
-                    sanitized_step = sanitize_context(session.get_current_step()) if session else "Suite de conversation"
-                    sanitized_question = sanitize_context(transcript_to_send)
-                    
-                    # Affichage du prompt complet qui sera envoyé au LLM
-                    logging.info("Prompt envoyé au LLM (anonymisé) :\nContext: %s\nStep: %s\nQuestion: %s", 
-                                 sanitized_context, sanitized_step, sanitized_question)
-                    
-                    response_text = await asyncio.to_thread(
-                        llm_client.get_response, sanitized_context, sanitized_step, sanitized_question
+    async def respond(turn: UserTurn):
+        """
+        Réponse à un tour du patient : cache, génération spéculative ou LLM, puis
+        lecture. Retourne l'enregistrement du tour dans la session, appelé une
+        fois la réponse jouée (jamais si le patient l'interrompt).
+        """
+        nonlocal answer_trace
+        transcript_to_send = turn.text
+        turn_trace = answer_trace = call_trace.new_turn()
+        turn_trace.attributes["resumed"] = turn.resumed
+        if turn.last_audio:
+            turn_trace.mark("last_audio", turn.last_audio)
+        if turn.stt_final:
+            turn_trace.mark("stt_final", turn.stt_final)
+        turn_trace.mark("endpoint", turn.endpoint)
+
+        sanitized_context, sanitized_step, sanitized_question = build_llm_request(transcript_to_send)
+        # Réponse déjà en cours de génération sur le partiel, si celui-ci correspond
+        speculation = speculator.resolve(transcript_to_send) if speculator else None
+        # Étapes prévisibles : réponse type, ou déjà générée pour un énoncé équivalent
+        cached_response, cache_result = None, None
+        if response_cache is not None:
+            cached_response, cache_result = response_cache.lookup(sanitized_step, sanitized_question)
+            RESPONSE_CACHE_LOOKUPS.inc(result=cache_result)
+            if cached_response and speculation:
+                speculation.cancel()
+                speculation = None
+        turn_trace.attributes["speculative"] = speculation is not None
+        turn_trace.attributes["cache"] = cache_result
+        if speculation:
+            turn_trace.mark("llm_request", speculation.started_at)
+            if speculation.first_token_at:
+                turn_trace.mark("first_token", speculation.first_token_at)
+        elif not cached_response:
+            turn_trace.mark("llm_request")
+
+        # Affichage du prompt complet qui sera envoyé au LLM
+        logging.info("Prompt envoyé au LLM (anonymisé) :\nContext: %s\nStep: %s\nQuestion: %s",
+                     sanitized_context, sanitized_step, sanitized_question)
+
+        anonymizer = session.anonymizer if session else default_anonymizer
+        if not cached_response:
+            LLM_REQUESTS.inc(operation="turn")
+        llm_stream = None
+        try:
+            if RESPONSE_MODE == "stream" and stream_sid:
+                # La réponse est jouée au fil de l'eau, le flux reste ouvert
+                if cached_response:
+                    deltas = replay(cached_response)
+                elif speculation:
+                    deltas = speculation.stream()
+                else:
+                    deltas = llm_stream = llm_client.stream_response(
+                        sanitized_context, sanitized_step, sanitized_question
                     )
-                    # Restaurer les données sensibles dans la réponse obtenue
-                    restored_response_text = restore_sensitive_data(response_text)
-                    logging.info("Réponse du LLM après restauration: %s", restored_response_text)
-                    
-                    if session:
-                        session.append_conversation(transcript_to_send, restored_response_text)
-                        session.increment_step()
-                        update_call_with_twilio_tts(session.call_sid, restored_response_text)
-                    current_transcript = ""
-
-    silence_task = asyncio.create_task(silence_detector())
+                if not cached_response:
+                    deltas = turn_trace.wrap_stream(deltas)
+                restored_response_text = await stream_llm_to_call(
+                    websocket, stream_sid, deltas, anonymizer, trace=turn_trace, on_mark=pipeline.track_mark,
+                    private=session.private_terms if session else frozenset(),
+                )
+            else:
+                if cached_response:
+                    response_text = cached_response
+                elif speculation:
+                    response_text = await speculation.text()
+                else:
+                    response_text = await llm_client.get_response(sanitized_context, sanitized_step, sanitized_question)
+                if not cached_response:
+                    turn_trace.mark("last_token")
+                # Restaurer les données sensibles dans la réponse obtenue
+                restored_response_text = anonymizer.restore(response_text)
+        except asyncio.CancelledError:
+            # Interruption par le patient : la requête LLM en cours est abandonnée
+            if speculation:
+                turn_trace.attributes["tokens"] = speculation.cancel()
+            if llm_stream is not None:
+                await llm_stream.aclose()
+            if recorder:
+                recorder.turn(turn_trace, transcript_to_send)
+            raise
+        except Exception as e:
+            LLM_ERRORS.inc(operation="turn")
+            logging.error("Erreur LLM pendant le tour: %s", e)
+            return None
+        if response_cache is not None and not cached_response:
+            # Le cache ne reçoit que la forme anonymisée de la réponse
+            response_cache.put(sanitized_step, sanitized_question, anonymizer.sanitize(restored_response_text),
+                               private=session.private_terms if session else frozenset())
+        logging.info("Réponse du LLM après restauration: %s", restored_response_text)
+
+        if session and (RESPONSE_MODE != "stream" or not stream_sid):
+            turn_trace.mark("tts_dispatch")
+            await update_call_with_twilio_tts(session.call_sid, restored_response_text)
+        turn_trace.observe()
+        if recorder:
+            recorder.turn(turn_trace, transcript_to_send)
+
+        def commit():
+            if session:
+                session.append_conversation(transcript_to_send, restored_response_text)
+                session.increment_step()
+                sessions.save_soon(session)
+            TURNS.inc(mode=RESPONSE_MODE if stream_sid else "twiml")
+        return commit
+
+    async def on_barge_in(turn: UserTurn, phase: str):
+        """Réponse interrompue : l'audio en file chez Twilio est vidé, son coût est comptabilisé."""
+        BARGE_INS.inc(phase=phase)
+        if answer_trace is not None:
+            answer_trace.attributes["barge_in"] = phase
+            STALE_ANSWER_TOKENS.inc(answer_trace.attributes.get("tokens", 0))
+            STALE_ANSWER_AUDIO_SECONDS.inc(answer_trace.attributes.get("audio_s", 0))
+        if RESPONSE_MODE == "stream" and stream_sid:
+            await clear_audio(websocket, stream_sid)
+
+    # Événements STT et fins de tour VAD traités sur la boucle d'événements, sans verrou ;
+    # silence_timeout : filet de sécurité si la détection de fin de tour ne se déclenche pas
+    answer_trace = None  # trace de la dernière réponse (coût d'une réponse interrompue)
+    pipeline = TurnPipeline(
+        respond, endpointer, speculator, final_wait=FINAL_RESULT_WAIT, silence_timeout=1.0,
+        barge_in=BARGE_IN, barge_in_ms=BARGE_IN_MIN_SPEECH_MS, on_barge_in=on_barge_in,
+    )
+    pipeline.start()
 
     try:
         while True:
@@ -300,46 +907,82 @@ async def media_stream(websocket: WebSocket):
                 break
 
             try:
-                message = json.loads(data)
+                event, payload, message = parse_message(data)
             except Exception as e:
                 logging.error("Erreur JSON: %s", e)
                 continue
 
-            event = message.get("event")
-            if event == "start":
+            if event == "media":
+                if payload and ingestor is not None:
+                    endpointer.process(ingestor.feed(payload))
+                    if recorder:
+                        recorder.media(payload)
+            elif event == "start":
                 logging.info("Flux média démarré")
                 call_info = message.get("start", {})
+                stream_sid = message.get("streamSid") or call_info.get("streamSid")
+                if CALL_RECORDING and recorder is None and random.random() < CALL_RECORDING_RATE:
+                    recorder = CallRecorder(os.path.join(
+                        CALL_RECORDING_DIR, f"{call_info.get('callSid') or 'appel'}-{stream_sid}.prc"
+                    ))
+                    recorder.twilio_event(event, data)
                 if call_info:
                     local_call_sid = call_info.get("callSid")
                     if local_call_sid:
                         logging.info("Call SID reçu: %s", local_call_sid)
-                        session = sessions.get(local_call_sid)
-                        if not session:
-                            session = CallSession(local_call_sid)
-                            sessions[local_call_sid] = session
-                        asyncio.create_task(poll_call_status(local_call_sid, session))
-            elif event == "media":
-                media = message.get("media", {})
-                payload = media.get("payload")
-                if payload:
-                    ulaw_data = base64.b64decode(payload)
-                    pcm_data = audioop.ulaw2lin(ulaw_data, 2)
-                    push_stream.write(pcm_data)
+                        call_trace.call_sid = local_call_sid
+                        # Cache local, ou état repris de la connexion précédente sur un autre worker
+                        session = await sessions.open(local_call_sid, create_session)
+                if stt is None:
+                    setup_start = time.monotonic()
+                    stt, stt_source = await stt_pool.acquire(local_call_sid)
+                    STT_SETUP_SECONDS.observe(time.monotonic() - setup_start, source=stt_source)
+                    ACTIVE_RECOGNIZERS.inc()
+                    if recorder:
+                        stt.bind(recorder.wrap_stt(STT_FINAL, pipeline.on_recognized),
+                                 recorder.wrap_stt(STT_PARTIAL, pipeline.on_recognizing))
+                    else:
+                        stt.bind(pipeline.on_recognized, pipeline.on_recognizing)
+                    # Audio décodé par table et transmis au recognizer par blocs de AUDIO_CHUNK_MS
+                    ingestor = MediaIngestor(stt.write, chunk_ms=AUDIO_CHUNK_MS)
+                greeting = call_info.get("customParameters", {}).get("greeting") == "true"
+                if greeting and stream_sid and tts_cache is not None:
+                    await send_audio(websocket, stream_sid, await tts_cache.synthesize(GREETING), mark="accueil")
+            elif event == "mark":
+                mark_name = message.get("mark", {}).get("name")
+                logging.info("Lecture terminée: %s", mark_name)
+                pipeline.on_mark(mark_name)
+                if recorder:
+                    recorder.twilio_event(event, data)
             elif event == "stop":
                 logging.info("Flux média temporairement arrêté")
+                if recorder:
+                    recorder.twilio_event(event, data)
             else:
                 logging.warning("Événement inconnu reçu: %s", event)
     except Exception as e:
         logging.error("Erreur dans la boucle WebSocket: %s", e)
     finally:
-        try:
-            push_stream.close()
-        except Exception as e:
-            logging.error("Erreur lors de la fermeture du push stream: %s", e)
-        silence_task.cancel()
+        if stt is not None:
+            try:
+                ingestor.flush()
+            except Exception as e:
+                logging.error("Erreur lors de l'envoi du dernier bloc audio: %s", e)
+            # Reconnaissance gardée ouverte pour la connexion suivante du même appel
+            stt_pool.release(local_call_sid, stt)
+            ACTIVE_RECOGNIZERS.dec()
+        pipeline.close()
+        if recorder:
+            recorder.close()
+        if speculator:
+            speculator.close()
+            logging.info("Génération spéculative: %s", speculator.stats())
         try:
             await websocket.close()
         except Exception as e:
             logging.error("Erreur lors de la fermeture du WebSocket: %s", e)
-        recognizer.stop_continuous_recognition()
+        ACTIVE_CALLS.dec()
+        if call_trace.turns:
+            await asyncio.to_thread(call_trace_log.write, call_trace)
+        logging.info("Latence de fin de tour: %s", endpointer.stats())
         logging.info("Session STT terminée.")
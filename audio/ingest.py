@@ -0,0 +1,133 @@
+import binascii
+import json
+
+import numpy as np
+
+try:
+    import orjson as _fast_json
+except ImportError:  # dépendance optionnelle
+    _fast_json = None
+
+SAMPLE_RATE = 8000
+
+
+def _build_ulaw_table() -> np.ndarray:
+    """Table G.711 μ-law -> PCM16 (256 entrées), identique à audioop.ulaw2lin."""
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    sign = codes & 0x80
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(sign, -magnitude, magnitude).astype(np.int16)
+
+
+ULAW_TO_PCM16 = _build_ulaw_table()
+
+
+def decode_ulaw(ulaw_data: bytes) -> np.ndarray:
+    """Décode du μ-law 8 bits en PCM16 par simple indexation de table."""
+    return ULAW_TO_PCM16[np.frombuffer(ulaw_data, dtype=np.uint8)]
+
+
+_MEDIA_PREFIX = '{"event":"media"'
+_PAYLOAD_KEY = '"payload":"'
+
+
+def parse_message(data: str):
+    """
+    Analyse un message du flux Twilio. Retourne (event, payload, message) :
+    pour les trames `media` (~50/s par appel), la charge utile base64 est extraite
+    directement de la chaîne sans construire le dictionnaire complet, et
+    `message` vaut None. Les autres événements passent par un parseur JSON.
+    """
+    if data.startswith(_MEDIA_PREFIX):
+        start = data.find(_PAYLOAD_KEY)
+        if start != -1:
+            start += len(_PAYLOAD_KEY)
+            end = data.find('"', start)
+            if end != -1:
+                return "media", data[start:end], None
+    message = _fast_json.loads(data) if _fast_json else json.loads(data)
+    event = message.get("event")
+    payload = message.get("media", {}).get("payload") if event == "media" else None
+    return event, payload, message
+
+
+class PcmRingBuffer:
+    """
+    Tampon circulaire PCM16 préalloué : les trames μ-law y sont décodées
+    directement (`np.take(..., out=)`), sans allocation intermédiaire.
+    """
+
+    def __init__(self, capacity: int):
+        self._buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self._read = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write_ulaw(self, codes: np.ndarray) -> np.ndarray:
+        """Décode `codes` (uint8) dans le tampon ; retourne les échantillons écrits."""
+        n = len(codes)
+        if n > self.capacity - self._size:
+            # Débordement (consommateur bloqué) : on abandonne les échantillons les plus anciens
+            overflow = n - (self.capacity - self._size)
+            self._read = (self._read + overflow) % self.capacity
+            self._size -= overflow
+        start = (self._read + self._size) % self.capacity
+        self._size += n
+        if start + n <= self.capacity:
+            view = self._buffer[start:start + n]
+            ULAW_TO_PCM16.take(codes, out=view)
+            return view
+        first = self.capacity - start
+        ULAW_TO_PCM16.take(codes[:first], out=self._buffer[start:])
+        ULAW_TO_PCM16.take(codes[first:], out=self._buffer[:n - first])
+        return np.concatenate((self._buffer[start:], self._buffer[:n - first]))
+
+    def read(self, n: int) -> bytes:
+        n = min(n, self._size)
+        end = self._read + n
+        if end <= self.capacity:
+            data = self._buffer[self._read:end].tobytes()
+        else:
+            data = self._buffer[self._read:].tobytes() + self._buffer[:end - self.capacity].tobytes()
+        self._read = end % self.capacity
+        self._size -= n
+        return data
+
+
+class MediaIngestor:
+    """
+    Chemin d'entrée audio d'un appel : décode chaque trame μ-law dans un tampon
+    circulaire et ne transmet au recognizer que des blocs de `chunk_ms`
+    (100 ms par défaut, soit 5 trames Twilio), au lieu d'une écriture par trame.
+    """
+
+    def __init__(self, write, chunk_ms: int = 100, capacity_ms: int = 2000, sample_rate: int = SAMPLE_RATE):
+        self.write = write  # ex. push_stream.write
+        self.chunk_samples = sample_rate * chunk_ms // 1000
+        # Capacité multiple de la taille de bloc : les blocs restent contigus en mémoire
+        capacity = max(capacity_ms, 2 * chunk_ms) * sample_rate // 1000
+        self.ring = PcmRingBuffer(capacity - capacity % self.chunk_samples)
+        self.frames = 0
+        self.writes = 0
+
+    def feed(self, payload: str) -> np.ndarray:
+        """
+        Traite la charge utile base64 d'une trame ; retourne le PCM décodé pour la
+        VAD (vue sur le tampon, valable jusqu'à la trame suivante).
+        """
+        pcm = self.ring.write_ulaw(np.frombuffer(binascii.a2b_base64(payload), dtype=np.uint8))
+        self.frames += 1
+        while len(self.ring) >= self.chunk_samples:
+            self.write(self.ring.read(self.chunk_samples))
+            self.writes += 1
+        return pcm
+
+    def flush(self):
+        if len(self.ring):
+            self.write(self.ring.read(len(self.ring)))
+            self.writes += 1
@@ -0,0 +1,170 @@
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+SAMPLE_RATE = 8000
+FRAME_MS = 20
+
+# États de la machine de fin de tour
+SILENCE = "silence"
+SPEECH = "speech"
+HANGOVER = "hangover"
+ENDED = "ended"
+
+
+class EndpointDetector:
+    """
+    Détection d'activité vocale et de fin de tour sur les trames PCM16 du flux Twilio.
+
+    Les caractéristiques (énergie en dBFS, taux de passage par zéro) sont calculées
+    en une seule passe NumPy sur toutes les trames de 20 ms reçues ; une machine à
+    états avec période de maintien (hangover) décide ensuite la fin de tour dès que
+    le silence final dépasse `end_silence_ms`. La fin de tour n'est déclarée que si
+    Azure a déjà produit du texte (partiel ou final) pour ce tour. Trames et
+    résultats STT sont tous traités sur la boucle asyncio de l'appel : aucun
+    verrou n'est nécessaire.
+    """
+
+    def __init__(
+        self,
+        on_endpoint=None,
+        on_speech_start=None,
+        end_silence_ms: int = 400,
+        start_ms: int = 60,
+        min_energy_db: float = -50.0,
+        margin_db: float = 12.0,
+        max_zcr: float = 0.35,
+        sample_rate: int = SAMPLE_RATE,
+        frame_ms: int = FRAME_MS,
+        latency_window: int = 200,
+    ):
+        self.on_endpoint = on_endpoint
+        self.on_speech_start = on_speech_start  # début de parole (interruption d'une réponse en cours)
+        self.frame_ms = frame_ms
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.end_silence_frames = max(1, end_silence_ms // frame_ms)
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.min_energy_db = min_energy_db
+        self.margin_db = margin_db
+        self.max_zcr = max_zcr
+
+        self.state = SILENCE
+        self.noise_floor_db = min_energy_db - margin_db
+        self._remainder = np.empty(0, dtype=np.int16)
+        self._voiced_run = 0
+        self._silence_run = 0
+        self._last_voice_time = None
+
+        # Résultats STT : reçus sur la boucle de l'appel (TurnPipeline), comme les trames audio
+        self._has_text = False
+        self._fired = False
+
+        # Dernières latences de fin de tour (la distribution complète est dans metrics, étape "endpoint")
+        self.latencies_ms = deque(maxlen=latency_window)
+        self.turns = 0
+
+    # --- Caractéristiques vectorisées ---
+    def frame_features(self, samples: np.ndarray):
+        """Retourne (énergie dBFS, taux de passage par zéro) pour chaque trame complète."""
+        n_frames = len(samples) // self.frame_samples
+        frames = samples[:n_frames * self.frame_samples].reshape(n_frames, self.frame_samples).astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1)) + 1e-9
+        energy_db = 20.0 * np.log10(rms / 32768.0)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        return energy_db, zcr
+
+    def process(self, pcm_data):
+        """Traite un bloc PCM16 (bytes ou tableau int16) et fait avancer la machine à états."""
+        samples = pcm_data if isinstance(pcm_data, np.ndarray) else np.frombuffer(pcm_data, dtype=np.int16)
+        if len(self._remainder):
+            samples = np.concatenate((self._remainder, samples))
+        n_full = len(samples) // self.frame_samples * self.frame_samples
+        self._remainder = samples[n_full:].copy()
+        if not n_full:
+            return
+        energy_db, zcr = self.frame_features(samples[:n_full])
+        threshold = max(self.min_energy_db, self.noise_floor_db + self.margin_db)
+        # Voix : énergie nettement au-dessus du bruit, et pas un bruit blanc (ZCR élevé)
+        # sauf si l'énergie est très forte (fricatives prononcées)
+        voiced = (energy_db > threshold) & ((zcr < self.max_zcr) | (energy_db > threshold + self.margin_db))
+        now = time.monotonic()
+        for is_voiced, frame_energy in zip(voiced.tolist(), energy_db.tolist()):
+            self._step(is_voiced, frame_energy, now)
+
+    def _step(self, is_voiced: bool, frame_energy: float, now: float):
+        if is_voiced:
+            self._voiced_run += 1
+            self._silence_run = 0
+            self._last_voice_time = now
+            if self.state in (SILENCE, ENDED) and self._voiced_run >= self.start_frames:
+                self.state = SPEECH
+                self._fired = False
+                if self.on_speech_start:
+                    self.on_speech_start()
+            elif self.state == HANGOVER:
+                self.state = SPEECH
+            return
+
+        self._voiced_run = 0
+        self._silence_run += 1
+        if self.state in (SILENCE, ENDED):
+            # Suivi lent du bruit de fond, uniquement hors parole
+            self.noise_floor_db = 0.95 * self.noise_floor_db + 0.05 * frame_energy
+        elif self.state == SPEECH:
+            self.state = HANGOVER
+        if self.state == HANGOVER and self._silence_run >= self.end_silence_frames:
+            self.state = ENDED
+            self._maybe_fire()
+
+    @property
+    def speaking(self) -> bool:
+        """Vrai tant que le patient parle ou que le silence final n'a pas atteint le seuil."""
+        return self.state in (SPEECH, HANGOVER)
+
+    # --- Résultats Azure ---
+    def on_partial(self, text: str):
+        """Résultat intermédiaire Azure (`recognizing`)."""
+        if text:
+            self._has_text = True
+            if self.state == ENDED:
+                self._maybe_fire()
+
+    def on_final(self, text: str):
+        """Résultat final Azure (`recognized`)."""
+        self.on_partial(text)
+
+    def reset_turn(self):
+        """À appeler quand le tour a été consommé."""
+        self._has_text = False
+
+    def _maybe_fire(self):
+        if self._fired or not self._has_text:
+            return
+        self._fired = True
+        latency_ms = (time.monotonic() - self._last_voice_time) * 1000 if self._last_voice_time else 0.0
+        self.latencies_ms.append(latency_ms)
+        self.turns += 1
+        logging.info("Fin de tour détectée %.0f ms après la dernière trame de voix", latency_ms)
+        if self.on_endpoint:
+            self.on_endpoint(latency_ms)
+
+    @property
+    def last_voice_time(self):
+        """Instant (time.monotonic) de la dernière trame de voix reçue."""
+        return self._last_voice_time
+
+    def stats(self) -> dict:
+        """Statistiques de latence des `latency_window` dernières fins de tour, pour le réglage des seuils."""
+        if not self.latencies_ms:
+            return {"turns": 0}
+        values = np.asarray(self.latencies_ms)
+        return {
+            "turns": self.turns,
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "end_silence_ms": self.end_silence_frames * self.frame_ms,
+        }
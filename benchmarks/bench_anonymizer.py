@@ -0,0 +1,65 @@
+"""
+Coût par tour de l'anonymisation quand la conversation s'allonge.
+
+Compare l'ancienne approche (chaîne de str.replace sur tout l'historique à chaque
+tour, donc O(tours²) au total) à l'anonymiseur compilé appliqué une seule fois
+par nouveau tour.
+
+    python -m benchmarks.bench_anonymizer
+"""
+import time
+
+from LLM.anonymizer import Anonymizer
+from LLM.context import ConversationContext
+
+PATIENT = {"name": "Paul", "age": 75, "city": "Lyon", "doctor": "Dr Martin"}
+PATIENT_TEXT = "Oui Paul c'est bien moi, j'ai 75 ans et j'habite toujours à Lyon, le Dr Martin passe mardi."
+AI_TEXT = "Très bien Paul, et avez-vous bien dormi cette nuit ? Le Dr Martin m'a demandé de vous le demander."
+CHECKPOINTS = (10, 50, 100, 250, 500)
+
+
+def legacy_sanitize(text: str) -> str:
+    return text.replace("Paul", "<PATIENT_NAME>").replace("75 ans", "<PATIENT_AGE>") \
+        .replace("Lyon", "<PATIENT_CITY>").replace("Dr Martin", "<DOCTOR_NAME>")
+
+
+def bench_legacy(turns: int) -> dict:
+    context = ""
+    timings = {}
+    for turn in range(1, turns + 1):
+        start = time.perf_counter()
+        legacy_sanitize(context)
+        legacy_sanitize(PATIENT_TEXT)
+        elapsed = time.perf_counter() - start
+        context += f"Question: {PATIENT_TEXT}\nRéponse: {AI_TEXT}\n"
+        if turn in CHECKPOINTS:
+            timings[turn] = elapsed
+    return timings
+
+
+def bench_incremental(turns: int) -> dict:
+    anonymizer = Anonymizer.from_patient(PATIENT)
+    context = ConversationContext(sanitize=anonymizer.sanitize)
+    timings = {}
+    for turn in range(1, turns + 1):
+        start = time.perf_counter()
+        context.history_messages()
+        anonymizer.sanitize(PATIENT_TEXT)
+        context.add_turn(PATIENT_TEXT, AI_TEXT)
+        elapsed = time.perf_counter() - start
+        if turn in CHECKPOINTS:
+            timings[turn] = elapsed
+    return timings
+
+
+def main():
+    turns = max(CHECKPOINTS)
+    legacy = bench_legacy(turns)
+    incremental = bench_incremental(turns)
+    print(f"{'tour':>6} {'str.replace (µs)':>18} {'incrémental (µs)':>18}")
+    for turn in CHECKPOINTS:
+        print(f"{turn:>6} {legacy[turn] * 1e6:>18.1f} {incremental[turn] * 1e6:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Archivage des appels : un fichier JSON indenté par résumé, écrit sur la boucle
+d'événements (ancien `save_summary`), contre l'archive en écriture différée
+(`call_archive.py`) pour chaque politique fsync.
+
+Mesure le temps passé sur la boucle par enregistrement, le débit d'écriture,
+la taille sur disque, puis la lecture de l'historique d'un patient (l'ancien
+format impose de relire tous les fichiers).
+
+    python -m benchmarks.bench_archive --calls 2000 --turns 8 --patients 200
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from call_archive import CallArchive
+
+PATIENT_LINES = ["Oui c'est bien moi.", "Demain à 10 heures ça me va.", "Oui j'ai bien mangé ce midi.",
+                 "J'ai un peu mal au dos depuis hier.", "Les tomates poussent bien cette année.",
+                 "Mes petits-enfants sont venus dimanche.", "Merci, au revoir."]
+AI_LINES = ["Bonjour, ici Catherine de votre cabinet médical, comment allez-vous aujourd'hui ?",
+            "Très bien, je note votre rendez-vous de demain à 10 heures.",
+            "Parfait. Avez-vous pris vos médicaments ce matin comme d'habitude ?",
+            "Je suis désolée pour votre dos, je le signale au docteur.",
+            "C'est une bonne nouvelle, votre jardin doit être magnifique.",
+            "Quel plaisir, ils ont dû être contents de vous voir."]
+
+
+def make_calls(args) -> list:
+    rng = random.Random(7)
+    calls = []
+    for index in range(args.calls):
+        turns = [[rng.choice(PATIENT_LINES), rng.choice(AI_LINES)] for _ in range(args.turns)]
+        summary = {"next_appointment_datetime": "2026-11-03T10:00:00", "mood": rng.choice(["bon", "fatigué"]),
+                   "key_points": [line for line, _ in turns[:3]],
+                   "conversation_summary": " ".join(line for line, _ in turns)}
+        day = 1 + index % 28
+        calls.append((f"CA{index:08d}", f"+3361{index % args.patients:07d}", f"2026-09-{day:02d}T10:00:00",
+                      turns, summary))
+    return calls
+
+
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50_ms": round(pick(0.5) * 1000, 3), "p95_ms": round(pick(0.95) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3)}
+
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(name) for name in glob.glob(os.path.join(path, "**"), recursive=True)
+               if os.path.isfile(name))
+
+
+def run_legacy(calls: list, directory: str, lookups: list) -> dict:
+    # Ancien comportement : un fichier par résumé, écrit depuis la boucle d'événements
+    loop_seconds = []
+    start = time.perf_counter()
+    for call_sid, phone, started_at, turns, summary in calls:
+        begin = time.perf_counter()
+        with open(os.path.join(directory, f"conversation_summary_{call_sid}.json"), "w", encoding="utf-8") as f:
+            f.write(json.dumps(dict(summary, patient=phone), indent=2, ensure_ascii=False))
+        loop_seconds.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    history = []
+    for phone in lookups:
+        begin = time.perf_counter()
+        found = []
+        for name in glob.glob(os.path.join(directory, "conversation_summary_*.json")):
+            with open(name, encoding="utf-8") as f:
+                record = json.load(f)
+            if record["patient"] == phone:
+                found.append(record)
+        history.append(time.perf_counter() - begin)
+    return {"loop_per_call": percentiles(loop_seconds), "calls_per_second": round(len(calls) / elapsed),
+            "disk_bytes": directory_bytes(directory), "history": percentiles(history),
+            "transcripts": False}
+
+
+async def run_archive(calls: list, directory: str, lookups: list, fsync: str, args) -> dict:
+    archive = CallArchive(directory, fsync=fsync, batch_size=args.batch_size, max_delay=args.max_delay)
+    archive.start()
+    loop_seconds = []
+    start = time.perf_counter()
+    for call_sid, phone, started_at, turns, summary in calls:
+        begin = time.perf_counter()
+        for index, (patient_text, ai_text) in enumerate(turns):
+            archive.record_turn(call_sid, phone, index, patient_text, ai_text)
+        archive.record_call(call_sid, phone, turns, summary, started_at=started_at)
+        loop_seconds.append(time.perf_counter() - begin)
+        # Appels étalés : la tâche d'écriture tourne entre deux appels, comme en production
+        await asyncio.sleep(0)
+    await archive.flush()
+    elapsed = time.perf_counter() - start
+    history = []
+    for phone in lookups:
+        begin = time.perf_counter()
+        await asyncio.to_thread(archive.patient_history, phone, args.history_limit)
+        history.append(time.perf_counter() - begin)
+    export_start = time.perf_counter()
+    exported = 0
+    async for data in archive.export():
+        exported += data.count(b"\n")
+    export_seconds = time.perf_counter() - export_start
+    stats = archive.stats
+    await archive.stop()
+    return {"loop_per_call": percentiles(loop_seconds), "calls_per_second": round(len(calls) / elapsed),
+            "segment_bytes": stats["bytes"], "index_bytes": directory_bytes(directory) - stats["bytes"],
+            "compression": round(stats["raw_bytes"] / stats["bytes"], 2),
+            "batches": stats["batches"], "fsyncs": stats["fsyncs"], "history": percentiles(history),
+            "export_calls_per_second": round(exported / export_seconds), "transcripts": True}
+
+
+async def run(args) -> dict:
+    calls = make_calls(args)
+    rng = random.Random(11)
+    lookups = [f"+3361{rng.randrange(args.patients):07d}" for _ in range(args.lookups)]
+    report = {"calls": args.calls, "turns": args.turns, "patients": args.patients}
+    root = tempfile.mkdtemp(prefix="bench_archive_", dir=args.dir)
+    try:
+        os.makedirs(os.path.join(root, "legacy"))
+        report["legacy_json"] = run_legacy(calls, os.path.join(root, "legacy"), lookups)
+        for fsync in args.fsync:
+            report[f"archive_{fsync}"] = await run_archive(calls, os.path.join(root, fsync), lookups, fsync, args)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive des appels : écriture différée et historique patient")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--history-limit", type=int, default=20)
+    parser.add_argument("--fsync", nargs="+", default=["always", "interval", "never"],
+                        choices=["always", "interval", "never"])
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--max-delay", type=float, default=0.05)
+    parser.add_argument("--dir", default=None, help="répertoire des fichiers de test (disque à mesurer)")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
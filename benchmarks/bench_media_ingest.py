@@ -0,0 +1,89 @@
+"""
+Coût par trame du chemin d'entrée audio (/media-stream).
+
+Compare l'ancien traitement (json.loads du message complet, b64decode,
+audioop.ulaw2lin puis une écriture dans le push stream par trame de 20 ms) au
+nouveau (extraction directe de la charge utile, décodage par table NumPy,
+écritures regroupées par blocs de 100 ms).
+
+    python -m benchmarks.bench_media_ingest
+"""
+import base64
+import json
+import os
+import time
+
+from audio.ingest import MediaIngestor, parse_message
+
+try:
+    import audioop
+except ImportError:  # retiré de la bibliothèque standard en Python 3.13
+    audioop = None
+
+FRAMES = 50 * 60 * 5  # 5 minutes d'appel
+
+
+class CountingStream:
+    """Remplace le push stream Azure : ne fait que compter les écritures."""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data: bytes):
+        self.writes += 1
+        self.bytes += len(data)
+
+
+def make_messages(n: int) -> list:
+    return [
+        json.dumps({
+            "event": "media",
+            "sequenceNumber": str(i + 2),
+            "media": {"track": "inbound", "chunk": str(i + 1), "timestamp": str(i * 20),
+                      "payload": base64.b64encode(os.urandom(160)).decode()},
+            "streamSid": "MZ00000000000000000000000000000000",
+        }, separators=(",", ":"))
+        for i in range(n)
+    ]
+
+
+def bench_legacy(messages: list) -> tuple:
+    stream = CountingStream()
+    start = time.perf_counter()
+    for data in messages:
+        message = json.loads(data)
+        if message.get("event") == "media":
+            payload = message.get("media", {}).get("payload")
+            if payload:
+                stream.write(audioop.ulaw2lin(base64.b64decode(payload), 2))
+    return time.perf_counter() - start, stream
+
+
+def bench_ingestor(messages: list) -> tuple:
+    stream = CountingStream()
+    ingestor = MediaIngestor(stream.write)
+    start = time.perf_counter()
+    for data in messages:
+        event, payload, _ = parse_message(data)
+        if event == "media" and payload:
+            ingestor.feed(payload)
+    ingestor.flush()
+    return time.perf_counter() - start, stream
+
+
+def main():
+    messages = make_messages(FRAMES)
+    results = {"nouveau": bench_ingestor(messages)}
+    if audioop is not None:
+        results["ancien"] = bench_legacy(messages)
+    print(f"{FRAMES} trames ({FRAMES // 50} s d'audio)")
+    print(f"{'chemin':>8} {'µs/trame':>10} {'écritures':>10} {'octets':>10}")
+    for name, (elapsed, stream) in results.items():
+        print(f"{name:>8} {elapsed / FRAMES * 1e6:>10.2f} {stream.writes:>10} {stream.bytes:>10}")
+    if audioop is None:
+        print("audioop indisponible : chemin historique non mesuré")
+
+
+if __name__ == "__main__":
+    main()
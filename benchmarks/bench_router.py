@@ -0,0 +1,148 @@
+"""
+Latence du premier token d'un tour : modèle unique, routeur sans doublement,
+routeur avec requêtes doublées.
+
+Le faux serveur OpenAI est lancé avec une latence par modèle (petit modèle
+rapide, grand modèle plus lent) et une part de requêtes bloquées avant le
+premier token (file d'attente du fournisseur). Les tours parcourent les étapes
+du plan de conversation, avec quelques propos délicats du patient.
+
+    python -m benchmarks.bench_router --turns 200 --stall-rate 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from call_assets import DEFAULT_CONVERSATION_PLAN
+from LLM.deepinfra import AsyncDeepInfraLLM
+from LLM.http_pool import close_shared_http_client
+from LLM.router import LLMRouter, SMALL, LARGE, FIRST_SENTENCE_TOKENS, classify_turn
+
+SMALL_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
+LARGE_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS = [
+    "Oui c'est bien moi.",
+    "Demain à 10 heures ça me va.",
+    "Oui j'ai bien mangé ce midi.",
+    "Pas trop, j'ai mal au dos depuis que je suis tombé dans l'escalier.",
+    "Les tomates poussent bien.",
+    "Oui mes petits-enfants sont venus dimanche.",
+    "Merci, au revoir.",
+]
+CONTEXT = "Patient: Allô ?\nIA: Bonjour <PATIENT_NAME>, ici Catherine de votre cabinet médical."
+
+
+def start_fake_llm(port: int, args) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "fakes.openai_server", "--port", str(port),
+         "--profile", f"8B={args.small_ttft}:{args.small_tps}", "--profile", f"70B={args.large_ttft}:{args.large_tps}",
+         "--stall-rate", str(args.stall_rate), "--stall-seconds", str(args.stall_seconds)],
+        cwd=REPO_ROOT,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/v1/models", timeout=0.5).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Le faux serveur OpenAI n'a pas démarré")
+
+
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50_ms": round(pick(0.5) * 1000, 1), "p95_ms": round(pick(0.95) * 1000, 1),
+            "p99_ms": round(pick(0.99) * 1000, 1), "max_ms": round(values[-1] * 1000, 1)}
+
+
+def create_client(mode: str, base_url: str, args):
+    options = dict(api_key="fake", base_url=base_url, request_timeout=30.0)
+    small = AsyncDeepInfraLLM(model=SMALL_MODEL, **options)
+    if mode == "single":
+        return small
+    return LLMRouter(small, AsyncDeepInfraLLM(model=LARGE_MODEL, **options),
+                     deadlines={SMALL: args.deadline_small, LARGE: args.deadline_large},
+                     hedge=mode == "router_hedge", hedge_budget=args.hedge_budget)
+
+
+async def run_turn(client, index: int, semaphore: asyncio.Semaphore) -> tuple:
+    step_number = index % len(QUESTIONS)
+    step = DEFAULT_CONVERSATION_PLAN[step_number]
+    tier, _ = classify_turn(step, QUESTIONS[step_number])
+    async with semaphore:
+        start = time.perf_counter()
+        first_token = first_sentence = None
+        tokens = 0
+        async for _ in client.stream_response(CONTEXT, step, QUESTIONS[step_number]):
+            tokens += 1
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            if tokens == FIRST_SENTENCE_TOKENS:
+                first_sentence = time.perf_counter() - start
+        return tier, first_token, first_sentence or time.perf_counter() - start
+
+
+async def run_mode(mode: str, base_url: str, args) -> dict:
+    client = create_client(mode, base_url, args)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = await asyncio.gather(*(run_turn(client, i, semaphore) for i in range(args.turns)))
+    report = {
+        "first_token": percentiles([first_token for _, first_token, _ in results]),
+        "first_sentence": percentiles([first_sentence for _, _, first_sentence in results]),
+    }
+    # Par type d'étape (celui du routeur, même pour le modèle unique)
+    for tier in (SMALL, LARGE):
+        report[f"first_token_{tier}_steps"] = percentiles([first_token for turn_tier, first_token, _ in results
+                                                           if turn_tier == tier])
+    if isinstance(client, LLMRouter):
+        report["router"] = client.snapshot()
+    return report
+
+
+async def run(args) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+    report = {"turns": args.turns, "concurrency": args.concurrency, "stall_rate": args.stall_rate}
+    for mode in args.modes:
+        report[mode] = await run_mode(mode, base_url, args)
+    report["server"] = httpx.get(f"http://127.0.0.1:{args.port}/stats").json()
+    await close_shared_http_client()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Routage LLM et requêtes doublées")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--modes", nargs="+", default=["single", "router", "router_hedge"],
+                        choices=["single", "router", "router_hedge"])
+    parser.add_argument("--port", type=int, default=8913)
+    parser.add_argument("--small-ttft", type=float, default=0.25)
+    parser.add_argument("--small-tps", type=float, default=90.0)
+    parser.add_argument("--large-ttft", type=float, default=0.5)
+    parser.add_argument("--large-tps", type=float, default=40.0)
+    parser.add_argument("--stall-rate", type=float, default=0.1, help="part des requêtes bloquées")
+    parser.add_argument("--stall-seconds", type=float, default=3.0)
+    parser.add_argument("--deadline-small", type=float, default=0.8)
+    parser.add_argument("--deadline-large", type=float, default=1.2)
+    parser.add_argument("--hedge-budget", type=float, default=0.2)
+    args = parser.parse_args()
+    process = start_fake_llm(args.port, args)
+    try:
+        print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
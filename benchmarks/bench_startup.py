@@ -0,0 +1,169 @@
+"""
+Démarrage à froid d'un worker, comme après un redémarrage ou une montée en
+charge : durée de `import app`, délai avant que le serveur réponde puis avant
+que /ready annonce le worker prêt, et latence du premier tour comparée aux
+tours suivants.
+
+Le serveur est lancé pour de vrai (`uvicorn app:app`, un worker) avec les
+substituts hors ligne de benchmarks/bench_workers.py. Chaque mesure est faite
+avec le préchauffage et sans (WARMUP_SKIP sur toutes les étapes) : sans, le
+premier tour paie l'import du SDK openai, la création du client et des
+connexions.
+
+    python -m benchmarks.bench_startup --runs 3 --output bench_startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_workers import CallClient
+from benchmarks.load_test import REPO_ROOT, make_speech_frames, percentiles, start_fake_llm
+
+WARMUP_STEPS = "llm,twilio,stt,prompts,tts"
+
+
+def server_env(args, workdir: str, warmup: bool) -> dict:
+    return dict(
+        os.environ,
+        deepinfra_base_url=f"http://127.0.0.1:{args.llm_port}/v1",
+        deepinfra_key="fake",
+        TWILIO_ACCOUNT_SID="ACfake",
+        TWILIO_AUTH_TOKEN="fake",
+        TWILIO_CALLER_NUMBER="+33100000000",
+        RESPONSE_MODE="stream",
+        TTS_BACKEND="local",
+        STT_BACKEND="scripted",
+        SCHEDULE_DB_PATH=os.path.join(workdir, "call_schedule.db"),
+        ARCHIVE_DIR=os.path.join(workdir, "call_archive"),
+        CALL_TRACE_PATH="",
+        # Le premier tour (identité) aurait une réponse type : sans cache, chaque tour passe par le LLM
+        RESPONSE_CACHE="false",
+        # Pas d'API Twilio hors ligne : le client est créé sans requête de préchauffage
+        WARMUP_SKIP="twilio" if warmup else WARMUP_STEPS,
+        PYTHONPATH=REPO_ROOT,
+    )
+
+
+def measure_import(args, workdir: str) -> dict:
+    """Durée de `import app` dans un interpréteur neuf, et les imports directs les plus coûteux."""
+    env = server_env(args, workdir, warmup=True)
+    code = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+    seconds = []
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, capture_output=True, text=True,
+                                check=True)
+        seconds.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    # Lignes "import time: propre | cumulé | nom" ; imports directs de app : un niveau d'indentation
+    modules = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if match and len(match.group(2)) == 3:
+            modules.append((int(match.group(1)) / 1000, match.group(3)))
+    return {"import_ms": percentiles(seconds),
+            "slowest_imports_ms": {name: round(ms, 1) for ms, name in sorted(modules, reverse=True)[:10]}}
+
+
+async def first_turns(args) -> dict:
+    """Un premier appel d'un tour, puis un appel de `--turns` tours sur le worker déjà servi."""
+    url = f"ws://127.0.0.1:{args.port}/media-stream"
+    speech_frames = make_speech_frames()
+    first = CallClient(url, "CAstartup00000000000000000000001", 1, args.speech_ms, args.response_idle,
+                       args.turn_timeout, speech_frames)
+    await first.run()
+    warm = CallClient(url, "CAstartup00000000000000000000002", args.turns, args.speech_ms, args.response_idle,
+                      args.turn_timeout, speech_frames)
+    await warm.run()
+    return {
+        "first_turn_ms": round(first.latencies_ms[0], 1) if first.latencies_ms else None,
+        "warm_turn_ms": percentiles(warm.latencies_ms),
+        "errors": first.errors + warm.errors,
+    }
+
+
+def measure_start(args, workdir: str, warmup: bool) -> dict:
+    start = time.perf_counter()
+    log = open(args.server_log, "a") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--app-dir", REPO_ROOT, "--port", str(args.port),
+         "--log-level", "warning"],
+        cwd=workdir, env=server_env(args, workdir, warmup), stdout=log, stderr=log,
+    )
+    result = {"warmup": warmup}
+    try:
+        deadline = start + 60
+        while time.perf_counter() < deadline and "ready_ms" not in result:
+            try:
+                if "serving_ms" not in result:
+                    if httpx.get(f"http://127.0.0.1:{args.port}/", timeout=0.5).status_code == 200:
+                        result["serving_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                    continue
+                response = httpx.get(f"http://127.0.0.1:{args.port}/ready", timeout=0.5)
+                if response.status_code == 200:
+                    result["ready_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                    result["steps"] = {name: step.get("seconds") for name, step in response.json()["steps"].items()}
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        if "ready_ms" not in result:
+            raise RuntimeError("Le serveur n'est pas devenu prêt")
+        result.update(asyncio.run(first_turns(args)))
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Démarrage à froid : import, disponibilité et premier tour")
+    parser.add_argument("--runs", type=int, default=3, help="démarrages mesurés par configuration")
+    parser.add_argument("--turns", type=int, default=3, help="tours de l'appel servi après le premier")
+    parser.add_argument("--speech-ms", type=int, default=1200)
+    parser.add_argument("--response-idle", type=float, default=0.6)
+    parser.add_argument("--turn-timeout", type=float, default=10.0)
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    parser.add_argument("--llm-tps", type=float, default=50.0)
+    parser.add_argument("--llm-port", type=int, default=8916)
+    parser.add_argument("--port", type=int, default=8917)
+    parser.add_argument("--server-log", help="fichier recevant la sortie du serveur")
+    parser.add_argument("--output", default="bench_startup.json")
+    args = parser.parse_args()
+
+    report = {"config": {k: v for k, v in vars(args).items() if k != "output"}}
+    llm_process = start_fake_llm(args.llm_port, args.llm_ttft, args.llm_tps)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            report.update(measure_import(args, workdir))
+            print(f"import app : p50 {report['import_ms']['p50']} ms | {report['slowest_imports_ms']}", flush=True)
+            for warmup in (True, False):
+                runs = [measure_start(args, workdir, warmup) for _ in range(args.runs)]
+                summary = {
+                    "serving_ms": percentiles([run["serving_ms"] for run in runs]),
+                    "ready_ms": percentiles([run["ready_ms"] for run in runs]),
+                    "first_turn_ms": percentiles([run["first_turn_ms"] for run in runs if run["first_turn_ms"]]),
+                    "warm_turn_ms": percentiles([ms for run in runs for ms in [run["warm_turn_ms"].get("p50")] if ms]),
+                    "runs": runs,
+                }
+                report["with_warmup" if warmup else "without_warmup"] = summary
+                print(f"préchauffage {'oui' if warmup else 'non'} | serveur {summary['serving_ms'].get('p50')} ms | "
+                      f"prêt {summary['ready_ms'].get('p50')} ms | premier tour {summary['first_turn_ms'].get('p50')} ms"
+                      f" | tours suivants {summary['warm_turn_ms'].get('p50')} ms", flush=True)
+    finally:
+        llm_process.terminate()
+        llm_process.wait(timeout=10)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Résultats enregistrés dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
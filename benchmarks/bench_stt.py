@@ -0,0 +1,138 @@
+"""
+Mise en place du STT par connexion /media-stream, avec le moteur hors ligne.
+
+Compare l'ancien schéma (recognizer construit sur la boucle d'événements à
+chaque connexion, un thread par connexion pour démarrer la reconnaissance,
+arrêt bloquant à la fermeture) au pool (`STT.pool.RecognizerPool` : recognizers
+construits à l'avance, repris entre les connexions d'un même appel, exécuteur
+partagé). Le coût de construction et de démarrage du SDK est simulé
+(`--create-ms`, `--start-ms`). La durée de mise en place est comptée depuis
+l'arrivée prévue de la connexion, attente de la boucle d'événements comprise.
+En mode twiml, chaque tour ouvre une nouvelle connexion (`--connections`).
+
+    python -m benchmarks.bench_stt --calls 50 --connections 3
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from fakes.speech import ScriptedSTTEngine
+from STT.pool import RecognizerPool
+
+
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50_ms": round(pick(0.5) * 1000, 2), "p95_ms": round(pick(0.95) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2)}
+
+
+class Sampler:
+    """Nombre de threads et retard de la boucle d'événements, échantillonnés pendant le test."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.max_threads = threading.active_count()
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.max_lag = max(self.max_lag, time.perf_counter() - start - self.interval)
+            self.max_threads = max(self.max_threads, threading.active_count())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+async def legacy_call(engine, arrival: float, connections: int, hold: float, setups: list):
+    for index in range(connections):
+        await asyncio.sleep(max(0.0, arrival + index * hold - time.perf_counter()))
+        session = engine.create_session()
+        threading.Thread(target=session.start, daemon=True).start()
+        # Depuis l'arrivée prévue de la connexion : inclut l'attente de la boucle bloquée
+        setups.append(time.perf_counter() - (arrival + index * hold))
+        await asyncio.sleep(hold * 0.9)
+        session.close()
+
+
+async def pooled_call(pool: RecognizerPool, call_sid: str, arrival: float, connections: int, hold: float,
+                      setups: list):
+    for index in range(connections):
+        await asyncio.sleep(max(0.0, arrival + index * hold - time.perf_counter()))
+        session, _ = await pool.acquire(call_sid)
+        setups.append(time.perf_counter() - (arrival + index * hold))
+        await asyncio.sleep(hold * 0.9)
+        pool.release(call_sid, session)
+    pool.discard(call_sid)
+
+
+async def run_mode(mode: str, args) -> dict:
+    engine = ScriptedSTTEngine(create_cost=args.create_ms / 1000, start_delay=args.start_ms / 1000)
+    pool = None
+    if mode == "pool":
+        pool = RecognizerPool(engine, size=args.pool_size, executor_threads=args.executor_threads)
+        await pool.start()
+        await asyncio.sleep(args.pool_size * args.create_ms / 1000 + 0.2)  # pool rempli avant les appels
+    baseline = threading.active_count()
+    sampler = Sampler()
+    sampler.start()
+    setups = []
+    started = time.perf_counter()
+    calls = []
+    for index in range(args.calls):
+        # Arrivées des appels étalées de `ramp` secondes
+        arrival = started + 0.05 + index * args.ramp
+        if mode == "pool":
+            calls.append(pooled_call(pool, f"CA{index:032d}", arrival, args.connections, args.hold, setups))
+        else:
+            calls.append(legacy_call(engine, arrival, args.connections, args.hold, setups))
+    await asyncio.gather(*calls)
+    wall = time.perf_counter() - started
+    sampler.stop()
+    result = {
+        "setup": percentiles(setups),
+        "threads_per_call": round((sampler.max_threads - baseline) / args.calls, 2),
+        "peak_threads": sampler.max_threads,
+        "max_loop_lag_ms": round(sampler.max_lag * 1000, 1),
+        "wall_s": round(wall, 2),
+    }
+    if pool is not None:
+        result["sources"] = {key: pool.stats[key] for key in ("parked", "pool", "new")}
+        await pool.stop()
+    await asyncio.sleep(args.start_ms / 1000 + 0.1)  # threads de démarrage de l'ancien schéma terminés
+    return result
+
+
+async def run(args) -> dict:
+    return {
+        "calls": args.calls,
+        "connections_per_call": args.connections,
+        "legacy": await run_mode("legacy", args),
+        "pool": await run_mode("pool", args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mise en place du STT par connexion")
+    parser.add_argument("--calls", type=int, default=50, help="appels simultanés")
+    parser.add_argument("--connections", type=int, default=3, help="connexions /media-stream par appel")
+    parser.add_argument("--hold", type=float, default=1.0, help="durée d'une connexion (s)")
+    parser.add_argument("--ramp", type=float, default=0.02, help="écart entre deux arrivées d'appel (s)")
+    parser.add_argument("--create-ms", type=float, default=20.0, help="construction d'un recognizer (simulée)")
+    parser.add_argument("--start-ms", type=float, default=150.0, help="démarrage de la reconnaissance (simulé)")
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--executor-threads", type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Latence du résumé après raccrochage et taux de réussite de l'extraction.
+
+Simule des appels contre le faux serveur OpenAI (en processus) : pour chacun,
+les tours sont envoyés à l'extracteur incrémental au rythme de la conversation,
+puis on mesure la finalisation au raccrochage, comparée au résumé complet du
+transcript (ancien chemin). Une part des réponses JSON peut être mal formée
+(texte autour, virgule finale) pour mesurer le parseur tolérant.
+
+    python -m benchmarks.bench_summary --calls 20 --malformed 0.2
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+from fakes.openai_server import create_app
+from LLM.anonymizer import Anonymizer
+from LLM.deepinfra import AsyncDeepInfraLLM
+from LLM.summary import IncrementalSummarizer
+
+PATIENT = {"name": "Paul", "age": 75}
+TURNS = [
+    ("Oui c'est bien moi.", "Ravie de vous entendre Paul ! Quand seriez-vous disponible pour votre rendez-vous ?"),
+    ("Demain à 10 heures ça me va.", "C'est noté pour le rendez-vous de demain à 10 heures. Avez-vous bien mangé ?"),
+    ("Oui j'ai bien mangé ce midi.", "Très bien. Et avez-vous bien dormi cette nuit ?"),
+    ("Pas trop mal, je me suis réveillé une fois.", "D'accord. Comment va votre jardin en ce moment ?"),
+    ("Les tomates poussent bien.", "Formidable ! Et vos petits-enfants sont-ils venus vous voir ?"),
+    ("Oui dimanche dernier.", "Merci beaucoup Paul, prenez bien soin de vous, au revoir !"),
+]
+
+
+def create_llm(fake_app) -> AsyncDeepInfraLLM:
+    llm = AsyncDeepInfraLLM(api_key="fake", base_url="http://fake/v1")
+    llm.client = AsyncOpenAI(api_key="fake", base_url="http://fake/v1",
+                             http_client=httpx.AsyncClient(transport=httpx.ASGITransport(fake_app)))
+    return llm
+
+
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50_ms": round(pick(0.5) * 1000, 1), "p95_ms": round(pick(0.95) * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1)}
+
+
+async def incremental_call(llm, turn_interval: float, hangup_delay: float) -> tuple:
+    anonymizer = Anonymizer.from_patient(PATIENT)
+    summarizer = IncrementalSummarizer(llm, anonymizer, PATIENT)
+    for patient_text, ai_text in TURNS:
+        await asyncio.sleep(turn_interval)
+        summarizer.add_turn(patient_text, ai_text)
+    # Lecture de la dernière réponse (au revoir) avant le raccrochage
+    await asyncio.sleep(hangup_delay)
+    start = time.perf_counter()
+    summary = await summarizer.finalize()
+    return time.perf_counter() - start, summary, summarizer.stats
+
+
+async def full_call(llm) -> tuple:
+    transcript = "\n".join(f"Patient: {patient}\nIA: {ai}" for patient, ai in TURNS)
+    start = time.perf_counter()
+    summary = await llm.generate_summary_json(transcript)
+    return time.perf_counter() - start, summary
+
+
+async def run(args) -> dict:
+    fake_app = create_app(ttft=args.ttft, tokens_per_second=args.tokens_per_second, malformed=args.malformed)
+    llm = create_llm(fake_app)
+    incremental = await asyncio.gather(*(incremental_call(llm, args.turn_interval, args.hangup_delay)
+                                         for _ in range(args.calls)))
+    full = await asyncio.gather(*(full_call(llm) for _ in range(args.calls)))
+
+    extractions = {}
+    for _, _, stats in incremental:
+        for result, count in stats.items():
+            extractions[result] = extractions.get(result, 0) + count
+    total = sum(extractions.values())
+    return {
+        "calls": args.calls,
+        "malformed": args.malformed,
+        "after_hangup": {
+            "incremental": percentiles([latency for latency, _, _ in incremental]),
+            "full": percentiles([latency for latency, _ in full]),
+        },
+        "extractions": extractions,
+        # Extractions exploitables, et celles qu'un json.loads strict aurait perdues
+        "success_rate": round((total - extractions.get("failed", 0)) / total, 3) if total else None,
+        "repaired_rate": round(extractions.get("repaired", 0) / total, 3) if total else None,
+        "appointment_found": sum(summary is not None and summary["next_appointment_datetime"] != "None"
+                                 for _, summary, _ in incremental),
+        "full_summary_appointment_field": sum("next_appointment_datetime" in summary for _, summary in full),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence du résumé de fin d'appel")
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--turn-interval", type=float, default=1.5, help="durée d'un tour (s)")
+    parser.add_argument("--hangup-delay", type=float, default=2.0,
+                        help="délai entre le dernier tour et le raccrochage (lecture de l'au revoir, s)")
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--malformed", type=float, default=0.2, help="part des réponses JSON mal formées")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Appels simultanés tenus par un conteneur selon le nombre de workers uvicorn.
+
+Le serveur est lancé pour de vrai (`uvicorn app:app --workers N`) avec les
+substituts hors ligne (STT scripté, TTS local, faux serveur OpenAI) et l'état
+des appels partagé (SESSION_BACKEND=sqlite). Comme en mode TwiML, chaque tour
+d'un appel simulé ouvre une nouvelle connexion /media-stream, que le noyau
+attribue à n'importe quel worker : parole en temps réel (trames de 20 ms),
+réponse reçue, marks renvoyés une fois l'audio joué, puis déconnexion.
+
+Pour chaque nombre de workers, les paliers de concurrence donnent la latence
+des tours (dernière trame de parole -> première trame de réponse) et le
+palier le plus haut tenu sous `--slo-ms` (p95) sans erreur. À la fin de chaque
+palier, l'état partagé de chaque appel doit contenir tous ses tours : avec
+`--session-backend memory` et plusieurs workers, ce n'est plus le cas.
+
+Les appels sont simulés par `--client-processes` processus pour que le
+client ne limite pas la mesure ; il faut autant de cœurs libres.
+
+    python -m benchmarks.bench_workers --workers 1,2,4 --concurrency 10,20,40,80 --turns 3
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+from benchmarks.load_test import (REPO_ROOT, FRAME_MS, ULAW_SILENCE_FRAME, make_speech_frames, percentiles,
+                                  start_fake_llm)
+
+
+def start_server(args, workers: int, workdir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        deepinfra_base_url=f"http://127.0.0.1:{args.llm_port}/v1",
+        deepinfra_key="fake",
+        TWILIO_ACCOUNT_SID="ACfake",
+        TWILIO_AUTH_TOKEN="fake",
+        TWILIO_CALLER_NUMBER="+33100000000",
+        RESPONSE_MODE="stream",
+        TTS_BACKEND="local",
+        STT_BACKEND="scripted",
+        SESSION_BACKEND=args.session_backend,
+        SESSION_DB_PATH=os.path.join(workdir, "call_sessions.db"),
+        SCHEDULE_DB_PATH=os.path.join(workdir, "call_schedule.db"),
+        CALL_TRACE_PATH="",
+        WARMUP_SKIP="twilio",  # pas d'API Twilio hors ligne
+        PYTHONPATH=REPO_ROOT,
+    )
+    log = open(args.server_log, "a") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--app-dir", REPO_ROOT, "--port", str(args.port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=log,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/", timeout=0.5).status_code == 200:
+                # Laisse les autres workers terminer leur démarrage
+                time.sleep(1.0 + 0.5 * workers)
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Le serveur n'a pas démarré")
+
+
+class CallClient:
+    """Un appel : une connexion /media-stream par tour, comme après chaque redirection TwiML."""
+
+    def __init__(self, url: str, call_sid: str, turns: int, speech_ms: int, response_idle: float,
+                 turn_timeout: float, speech_frames: list):
+        self.url = url
+        self.call_sid = call_sid
+        self.turns = turns
+        self.speech_frames_count = speech_ms // FRAME_MS
+        self.response_idle = response_idle
+        self.turn_timeout = turn_timeout
+        self.speech_frames = speech_frames
+        self.stream_sid = f"MZ{call_sid[2:]}"
+        self.latencies_ms = []
+        self.errors = []
+
+    async def run(self):
+        for _ in range(self.turns):
+            try:
+                await self._turn()
+            except Exception as e:
+                self.errors.append(repr(e))
+
+    async def _turn(self):
+        async with websockets.connect(self.url, max_size=None) as ws:
+            await ws.send(json.dumps({
+                "event": "start", "streamSid": self.stream_sid,
+                "start": {"streamSid": self.stream_sid, "callSid": self.call_sid, "tracks": ["inbound"]},
+            }))
+            state = {"speaking": self.speech_frames_count, "end_of_speech": None, "first": None, "last": None,
+                     "played_until": 0.0}
+            answered = asyncio.Event()
+            sender = asyncio.create_task(self._send_frames(ws, state))
+            receiver = asyncio.create_task(self._receive(ws, state, answered))
+            try:
+                await asyncio.wait_for(answered.wait(), self.turn_timeout + self.speech_frames_count * FRAME_MS / 1000)
+                self.latencies_ms.append((state["first"] - state["end_of_speech"]) * 1000)
+                # Fin de la réponse (plus de trame pendant `response_idle`), puis de sa lecture
+                while time.perf_counter() - state["last"] < self.response_idle:
+                    await asyncio.sleep(self.response_idle / 4)
+                await asyncio.sleep(max(0.0, state["played_until"] - time.perf_counter()) + 0.1)
+            except asyncio.TimeoutError:
+                self.errors.append("pas de réponse")
+            finally:
+                sender.cancel()
+                receiver.cancel()
+                await ws.send(json.dumps({"event": "stop", "streamSid": self.stream_sid}))
+
+    async def _send_frames(self, ws, state: dict):
+        next_time = time.perf_counter()
+        sequence = 0
+        while True:
+            if state["speaking"]:
+                frame = self.speech_frames[sequence % len(self.speech_frames)]
+                state["speaking"] -= 1
+                if not state["speaking"]:
+                    state["end_of_speech"] = time.perf_counter()
+            else:
+                frame = ULAW_SILENCE_FRAME
+            await ws.send(json.dumps({
+                "event": "media", "streamSid": self.stream_sid,
+                "media": {"track": "inbound", "chunk": str(sequence + 1), "timestamp": str(sequence * FRAME_MS),
+                          "payload": base64.b64encode(frame).decode("ascii")},
+            }, separators=(",", ":")))
+            sequence += 1
+            next_time += FRAME_MS / 1000
+            await asyncio.sleep(max(0.0, next_time - time.perf_counter()))
+
+    async def _receive(self, ws, state: dict, answered: asyncio.Event):
+        loop = asyncio.get_running_loop()
+        async for text in ws:
+            now = time.perf_counter()
+            message = json.loads(text)
+            event = message.get("event")
+            if event == "media":
+                state["played_until"] = max(state["played_until"], now) + FRAME_MS / 1000
+                if not answered.is_set() and not state["speaking"]:
+                    state["first"] = now
+                    answered.set()
+                state["last"] = now
+            elif event == "mark":
+                # Comme Twilio : mark renvoyé une fois l'audio qui le précède joué
+                mark = json.dumps({"event": "mark", "streamSid": self.stream_sid, "mark": message["mark"]})
+                loop.call_later(max(0.0, state["played_until"] - now),
+                                lambda mark=mark: asyncio.ensure_future(ws.send(mark)))
+            elif event == "clear":
+                state["played_until"] = now
+
+
+def run_client_process(job: dict) -> dict:
+    """Appels d'un processus client (exécuté dans un processus séparé)."""
+    speech_frames = make_speech_frames()
+
+    async def main():
+        calls = [CallClient(job["url"], call_sid, job["turns"], job["speech_ms"], job["response_idle"],
+                            job["turn_timeout"], speech_frames) for call_sid in job["call_sids"]]
+
+        async def start(call: CallClient):
+            await asyncio.sleep(random.uniform(0, job["ramp"]))
+            await call.run()
+
+        await asyncio.gather(*(start(call) for call in calls))
+        return {"latencies_ms": [latency for call in calls for latency in call.latencies_ms],
+                "errors": [error for call in calls for error in call.errors]}
+
+    return asyncio.run(main())
+
+
+def shared_turns(db_path: str, call_sids: list) -> dict:
+    """Nombre de tours enregistrés dans l'état partagé, par appel."""
+    if not os.path.exists(db_path):
+        return {}
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT call_sid, state FROM call_state").fetchall()
+    wanted = set(call_sids)
+    return {call_sid: len(json.loads(state)["turns"]) for call_sid, state in rows if call_sid in wanted}
+
+
+def run_level(args, workers: int, concurrency: int, level_index: int, workdir: str) -> dict:
+    call_sids = [f"CAbench{workers:02d}{level_index:02d}{i:020d}" for i in range(concurrency)]
+    processes = min(args.client_processes, concurrency)
+    jobs = [{"url": f"ws://127.0.0.1:{args.port}/media-stream", "call_sids": call_sids[i::processes],
+             "turns": args.turns, "speech_ms": args.speech_ms, "response_idle": args.response_idle,
+             "turn_timeout": args.turn_timeout, "ramp": args.ramp} for i in range(processes)]
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        results = pool.map(run_client_process, jobs)
+    wall = time.perf_counter() - start
+    latencies = [latency for result in results for latency in result["latencies_ms"]]
+    errors = [error for result in results for error in result["errors"]]
+    # Les derniers tours sont écrits en tâche de fond après la déconnexion
+    time.sleep(0.5)
+    turns = shared_turns(os.path.join(workdir, "call_sessions.db"), call_sids)
+    for call_sid in call_sids:
+        httpx.post(f"http://127.0.0.1:{args.port}/call-status", data={"CallSid": call_sid, "CallStatus": "completed"})
+    return {
+        "concurrency": concurrency,
+        "turns_completed": len(latencies),
+        "turns_expected": concurrency * args.turns,
+        "turn_latency_ms": percentiles(latencies),
+        "wall_s": round(wall, 1),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        # Appels dont l'état partagé contient tous les tours joués
+        "state_complete": sum(turns.get(call_sid, 0) == args.turns for call_sid in call_sids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Montée en charge avec plusieurs workers uvicorn")
+    parser.add_argument("--workers", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[10, 20, 40])
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--speech-ms", type=int, default=1200)
+    parser.add_argument("--response-idle", type=float, default=0.6)
+    parser.add_argument("--turn-timeout", type=float, default=10.0)
+    parser.add_argument("--ramp", type=float, default=2.0, help="étalement des débuts d'appel (s)")
+    parser.add_argument("--slo-ms", type=float, default=1500.0, help="latence p95 max d'un palier tenu")
+    parser.add_argument("--session-backend", default="sqlite", choices=["sqlite", "memory"])
+    parser.add_argument("--client-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    parser.add_argument("--llm-tps", type=float, default=50.0)
+    parser.add_argument("--llm-port", type=int, default=8914)
+    parser.add_argument("--port", type=int, default=8915)
+    parser.add_argument("--server-log", help="fichier recevant la sortie du serveur")
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args()
+
+    report = {"cpu_count": os.cpu_count(), "config": {k: v for k, v in vars(args).items() if k != "output"},
+              "workers": []}
+    llm_process = start_fake_llm(args.llm_port, args.llm_ttft, args.llm_tps)
+    try:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as workdir:
+                server = start_server(args, workers, workdir)
+                levels = []
+                try:
+                    for index, concurrency in enumerate(args.concurrency):
+                        level = run_level(args, workers, concurrency, index, workdir)
+                        levels.append(level)
+                        latency = level["turn_latency_ms"]
+                        print(f"{workers} workers | {concurrency:>4} appels | tours {level['turns_completed']}/"
+                              f"{level['turns_expected']} | p50 {latency.get('p50')} p95 {latency.get('p95')} ms | "
+                              f"état complet {level['state_complete']}/{concurrency} | erreurs {level['errors']}",
+                              flush=True)
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+            sustained = [level["concurrency"] for level in levels
+                         if level["errors"] == 0 and level["turn_latency_ms"].get("p95", float("inf")) <= args.slo_ms]
+            report["workers"].append({"workers": workers, "max_calls": max(sustained, default=0), "levels": levels})
+    finally:
+        llm_process.terminate()
+        llm_process.wait(timeout=10)
+    for entry in report["workers"]:
+        print(f"{entry['workers']} workers : {entry['max_calls']} appels simultanés sous {args.slo_ms:.0f} ms (p95)")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Résultats enregistrés dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
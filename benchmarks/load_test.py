@@ -0,0 +1,490 @@
+"""
+Test de charge hors ligne : combien d'appels simultanés un worker `app:app`
+tient-il avant que la latence des tours ne se dégrade ?
+
+L'application FastAPI est exécutée dans ce processus (pilotée directement en
+ASGI, sans réseau). Pour chaque appel simulé : POST /make-call, GET
+/incoming-call, puis un client WebSocket Twilio sur /media-stream qui envoie
+`start` et des trames μ-law toutes les 20 ms, en temps réel (parole synthétique
+puis silence), et enfin le webhook /call-status. Les services externes sont
+remplacés par des substituts locaux :
+- Azure STT : recognizer scripté (fakes.speech), délai du résultat final réglable ;
+- DeepInfra : faux serveur OpenAI dans un sous-processus (fakes.openai_server),
+  TTFT et tokens/s réglables ;
+- Twilio REST : fakes.twilio.FakeTwilioClient, durée des requêtes réglable ;
+- TTS : backend "local".
+
+Latence d'un tour : de la dernière trame de parole envoyée à la première trame
+audio de la réponse reçue. Pour chaque palier de concurrence, le rapport donne
+les p50/p95/p99 de cette latence, le retard de la boucle d'événements, le CPU et
+la RSS du processus ; le tout est enregistré en JSON pour comparer deux versions.
+
+    python -m benchmarks.load_test --concurrency 1,10,25,50 --turns 3 --output load_test.json
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from audio.ingest import ULAW_TO_PCM16
+from fakes.speech import ScriptedSTTEngine
+from fakes.twilio import FakeTwilioClient, post_status_callback
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 8000
+FRAME_MS = 20
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+ULAW_SILENCE_FRAME = b"\xff" * FRAME_SAMPLES
+
+
+# --- Audio synthétique ---
+def encode_ulaw(samples: np.ndarray) -> bytes:
+    """Encode du PCM16 en μ-law par recherche du code le plus proche (hors chemin critique)."""
+    table = ULAW_TO_PCM16.astype(np.int32)
+    codes = np.abs(samples.astype(np.int32)[:, None] - table[None, :]).argmin(axis=1)
+    return codes.astype(np.uint8).tobytes()
+
+
+def make_speech_frames(n_frames: int = 50, seed: int = 0) -> list:
+    """Trames de « parole » : voyelles synthétiques (harmoniques modulées) à environ -20 dBFS."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_frames * FRAME_SAMPLES) / SAMPLE_RATE
+    f0 = 140 + 20 * np.sin(2 * np.pi * 3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    signal = sum(np.sin(k * phase) / k for k in (1, 2, 3, 5))
+    signal = signal * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)) + 0.02 * rng.standard_normal(len(t))
+    pcm = (signal / np.max(np.abs(signal)) * 6000).astype(np.int16)
+    ulaw = encode_ulaw(pcm)
+    return [ulaw[i:i + FRAME_SAMPLES] for i in range(0, len(ulaw), FRAME_SAMPLES)]
+
+
+# --- Client WebSocket ASGI ---
+class AsgiWebSocket:
+    """Client WebSocket branché directement sur l'application ASGI (pas de socket)."""
+
+    def __init__(self, asgi_app, path: str):
+        self.app = asgi_app
+        self.path = path
+        self._to_app = asyncio.Queue()
+        self._from_app = asyncio.Queue()
+        self._task = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": self.path, "raw_path": self.path.encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"testserver")], "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+            "subprotocols": [], "state": {},
+        }
+        self._to_app.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(scope, self._to_app.get, self._from_app.put))
+        message = await self._from_app.get()
+        if message["type"] != "websocket.accept":
+            raise RuntimeError(f"WebSocket refusé: {message}")
+
+    def send_text(self, text: str):
+        self._to_app.put_nowait({"type": "websocket.receive", "text": text})
+
+    async def receive(self) -> dict:
+        return await self._from_app.get()
+
+    async def close(self):
+        self._to_app.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        if self._task:
+            await asyncio.wait_for(self._task, timeout=10)
+
+
+# --- Appel simulé ---
+class SimulatedCall:
+    """
+    Un appel Twilio de bout en bout. L'émetteur envoie une trame toutes les 20 ms
+    (horloge absolue, sans dérive) ; le récepteur horodate les trames de réponse
+    et, comme Twilio, renvoie chaque mark une fois l'audio qui le précède joué
+    en temps réel (aussitôt après un `clear`).
+
+    Avec `interrupt_rate`, le patient reprend la parole `interrupt_after`
+    secondes après le début de certaines réponses, sans attendre leur fin.
+    """
+
+    def __init__(self, app_module, http: httpx.AsyncClient, index: int, turns: int, speech_ms: int,
+                 response_idle: float, turn_timeout: float, speech_frames: list, interrupt_rate: float = 0.0,
+                 interrupt_after: float = 0.5):
+        self.app_module = app_module
+        self.http = http
+        self.index = index
+        self.turns = turns
+        self.speech_frames_count = speech_ms // FRAME_MS
+        self.response_idle = response_idle
+        self.turn_timeout = turn_timeout
+        self.speech_frames = speech_frames
+        self.interrupt_rate = interrupt_rate
+        self.interrupt_after = interrupt_after
+        self.stream_sid = f"MZload{index:026d}"
+        self.latencies_ms = []
+        self.errors = []
+        self._speaking_frames = 0
+        self._end_of_speech = None
+        self._first_response_time = None
+        self._last_response_time = None
+        self._response_event = asyncio.Event()
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.interruptions = 0
+        self._played_until = 0.0  # fin de la lecture de l'audio reçu (time.perf_counter)
+        self._pending_marks = {}  # nom -> handle du renvoi
+
+    async def run(self):
+        try:
+            response = await self.http.post("/make-call", json={"target_phone": f"+336{self.index:08d}"})
+            response.raise_for_status()
+            call_sid = response.json()["call_sid"]
+            (await self.http.get("/incoming-call")).raise_for_status()
+        except Exception as e:
+            self.errors.append(f"http: {e}")
+            return
+        ws = AsgiWebSocket(self.app_module.app, "/media-stream")
+        await ws.connect()
+        ws.send_text(json.dumps({
+            "event": "start", "streamSid": self.stream_sid,
+            "start": {"streamSid": self.stream_sid, "callSid": call_sid, "tracks": ["inbound"],
+                      "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1}},
+        }))
+        sender = asyncio.create_task(self._send_frames(ws))
+        receiver = asyncio.create_task(self._receive(ws))
+        try:
+            for index in range(self.turns):
+                await self._turn(interrupt=index < self.turns - 1 and random.random() < self.interrupt_rate)
+        finally:
+            sender.cancel()
+            ws.send_text(json.dumps({"event": "stop", "streamSid": self.stream_sid}))
+            await ws.close()
+            receiver.cancel()
+        try:
+            await post_status_callback(self.http, "/call-status", call_sid, "completed")
+        except Exception as e:
+            self.errors.append(f"call-status: {e}")
+
+    async def _turn(self, interrupt: bool = False):
+        self._response_event.clear()
+        self._speaking_frames = self.speech_frames_count
+        # Le patient parle, puis se tait : la latence part de sa dernière trame de parole
+        while self._speaking_frames:
+            await asyncio.sleep(FRAME_MS / 1000)
+        end_of_speech = self._end_of_speech
+        try:
+            await asyncio.wait_for(self._response_event.wait(), timeout=self.turn_timeout)
+        except asyncio.TimeoutError:
+            self.errors.append("pas de réponse")
+            return
+        self.latencies_ms.append((self._first_response_time - end_of_speech) * 1000)
+        if interrupt:
+            # Le patient reprend la parole pendant la réponse
+            await asyncio.sleep(self.interrupt_after)
+            self.interruptions += 1
+            return
+        # Laisse la réponse se terminer (plus aucune trame pendant `response_idle`) et être jouée
+        while time.perf_counter() - self._last_response_time < self.response_idle:
+            await asyncio.sleep(self.response_idle / 4)
+        await asyncio.sleep(max(0.0, self._played_until - time.perf_counter()))
+
+    async def _send_frames(self, ws: AsgiWebSocket):
+        next_time = time.perf_counter()
+        sequence = 0
+        while True:
+            if self._speaking_frames:
+                frame = self.speech_frames[sequence % len(self.speech_frames)]
+                self._speaking_frames -= 1
+                if not self._speaking_frames:
+                    self._end_of_speech = time.perf_counter()
+            else:
+                frame = ULAW_SILENCE_FRAME
+            ws.send_text(json.dumps({
+                "event": "media", "sequenceNumber": str(sequence + 2), "streamSid": self.stream_sid,
+                "media": {"track": "inbound", "chunk": str(sequence + 1), "timestamp": str(sequence * FRAME_MS),
+                          "payload": base64.b64encode(frame).decode("ascii")},
+            }, separators=(",", ":")))
+            sequence += 1
+            self.frames_sent += 1
+            next_time += FRAME_MS / 1000
+            await asyncio.sleep(max(0.0, next_time - time.perf_counter()))
+
+    def _send_mark(self, ws: AsgiWebSocket, name: str):
+        self._pending_marks.pop(name, None)
+        ws.send_text(json.dumps({"event": "mark", "streamSid": self.stream_sid, "mark": {"name": name}}))
+
+    def _on_control(self, ws: AsgiWebSocket, text: str):
+        message = json.loads(text)
+        now = time.perf_counter()
+        if message.get("event") == "mark":
+            name = message["mark"]["name"]
+            delay = max(0.0, self._played_until - now)
+            self._pending_marks[name] = asyncio.get_running_loop().call_later(delay, self._send_mark, ws, name)
+        elif message.get("event") == "clear":
+            self._played_until = now
+            for name, handle in list(self._pending_marks.items()):
+                handle.cancel()
+                self._send_mark(ws, name)
+
+    async def _receive(self, ws: AsgiWebSocket):
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.close":
+                return
+            if message["type"] != "websocket.send":
+                continue
+            text = message.get("text", "")
+            if '"media"' not in text:
+                self._on_control(ws, text)
+                continue
+            now = time.perf_counter()
+            self._played_until = max(self._played_until, now) + FRAME_MS / 1000
+            self.frames_received += 1
+            if not self._response_event.is_set() and not self._speaking_frames:
+                self._first_response_time = now
+                self._response_event.set()
+            self._last_response_time = now
+
+
+# --- Mesures ---
+class LoopLagMonitor:
+    """Retard de la boucle d'événements : dépassement d'un sommeil de `interval` secondes."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples_ms = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples_ms.append(max(0.0, (time.perf_counter() - start - self.interval) * 1000))
+
+    def start(self):
+        self.samples_ms = []
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values)
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(array, 50)), 1),
+        "p95": round(float(np.percentile(array, 95)), 1),
+        "p99": round(float(np.percentile(array, 99)), 1),
+        "max": round(float(array.max()), 1),
+        "mean": round(float(array.mean()), 1),
+    }
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stale_answer_cost(app_module) -> dict:
+    """Compteurs cumulés des réponses interrompues (barge-in)."""
+    return {
+        "generating": app_module.BARGE_INS.value(phase="generating"),
+        "playing": app_module.BARGE_INS.value(phase="playing"),
+        "tokens": app_module.STALE_ANSWER_TOKENS.value(),
+        "audio_s": app_module.STALE_ANSWER_AUDIO_SECONDS.value(),
+    }
+
+
+async def run_level(app_module, concurrency: int, args, speech_frames: list) -> dict:
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+        monitor = LoopLagMonitor()
+        monitor.start()
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        stale_before = stale_answer_cost(app_module)
+        max_threads = threading.active_count()
+        calls = [
+            SimulatedCall(app_module, http, i, args.turns, args.speech_ms, args.response_idle, args.turn_timeout,
+                          speech_frames, args.interrupt_rate, args.interrupt_after)
+            for i in range(concurrency)
+        ]
+
+        async def start_call(call: SimulatedCall):
+            # Démarrages étalés : les appels réels n'arrivent pas tous à la même milliseconde
+            await asyncio.sleep(random.uniform(0, args.ramp))
+            await call.run()
+
+        tasks = [asyncio.create_task(start_call(call)) for call in calls]
+        rss_peak = rss_mb()
+        while not all(task.done() for task in tasks):
+            await asyncio.sleep(0.5)
+            rss_peak = max(rss_peak, rss_mb())
+            max_threads = max(max_threads, threading.active_count())
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        monitor.stop()
+        await app_module.post_call_queue.join()
+
+    latencies = [latency for call in calls for latency in call.latencies_ms]
+    errors = [error for call in calls for error in call.errors]
+    errors += [repr(result) for result in results if isinstance(result, Exception)]
+    return {
+        "concurrency": concurrency,
+        "turns_completed": len(latencies),
+        "turns_expected": concurrency * args.turns,
+        "turn_latency_ms": percentiles(latencies),
+        "loop_lag_ms": percentiles(monitor.samples_ms),
+        "cpu_percent": round(cpu / wall * 100, 1),
+        "rss_mb": round(rss_peak, 1),
+        "threads_max": max_threads,
+        "wall_s": round(wall, 2),
+        "frames_sent": sum(call.frames_sent for call in calls),
+        "frames_received": sum(call.frames_received for call in calls),
+        "interruptions": sum(call.interruptions for call in calls),
+        "stale_answers": {key: round(value - stale_before[key], 2)
+                          for key, value in stale_answer_cost(app_module).items()},
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "sessions": app_module.sessions.stats(),
+    }
+
+
+def start_fake_llm(port: int, ttft: float, tokens_per_second: float) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "fakes.openai_server", "--port", str(port), "--ttft", str(ttft),
+         "--tokens-per-second", str(tokens_per_second)],
+        cwd=REPO_ROOT,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/v1/models", timeout=0.5).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Le faux serveur OpenAI n'a pas démarré")
+
+
+def import_app(args, workdir: str):
+    """Importe l'application avec les substituts locaux (à faire avant tout autre import de `app`)."""
+    os.environ.update({
+        "deepinfra_base_url": f"http://127.0.0.1:{args.llm_port}/v1",
+        "deepinfra_key": "fake",
+        "TWILIO_ACCOUNT_SID": "ACfake",
+        "TWILIO_AUTH_TOKEN": "fake",
+        "TWILIO_CALLER_NUMBER": "+33100000000",
+        "RESPONSE_MODE": "stream",
+        "TTS_BACKEND": "local",
+        "STT_BACKEND": "scripted",
+        "SCHEDULE_DB_PATH": os.path.join(workdir, "call_schedule.db"),
+        "ARCHIVE_DIR": os.path.join(workdir, "call_archive"),
+        "SESSION_MAX": str(max(1000, max(args.concurrency) * 2)),
+    })
+    import app as app_module
+
+    app_module.stt_pool.engine = ScriptedSTTEngine(
+        final_delay=args.stt_delay, segmentation_silence_ms=app_module.VAD_END_SILENCE_MS
+    )
+    app_module.twilio_client.set(FakeTwilioClient(latency=args.twilio_latency))
+    return app_module
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        app_module = import_app(args, workdir)
+        logging.getLogger().setLevel(logging.ERROR)
+        speech_frames = make_speech_frames()
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "levels": [],
+        }
+        try:
+            async with app_module.app.router.lifespan_context(app_module.app):
+                for concurrency in args.concurrency:
+                    # Les print() des clients LLM ne doivent pas noyer le rapport
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        level = await run_level(app_module, concurrency, args, speech_frames)
+                    report["levels"].append(level)
+                    latency, lag = level["turn_latency_ms"], level["loop_lag_ms"]
+                    print(f"{concurrency:>5} appels | tours {level['turns_completed']}/{level['turns_expected']} | "
+                          f"latence p50 {latency.get('p50')} p95 {latency.get('p95')} p99 {latency.get('p99')} ms | "
+                          f"lag p99 {lag.get('p99')} ms | CPU {level['cpu_percent']}% | "
+                          f"RSS {level['rss_mb']} Mo | erreurs {level['errors']}", flush=True)
+        finally:
+            os.chdir(cwd)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge hors ligne de /media-stream")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 5, 10, 25],
+                        help="paliers d'appels simultanés, ex. 1,10,50")
+    parser.add_argument("--turns", type=int, default=3, help="tours de parole par appel")
+    parser.add_argument("--speech-ms", type=int, default=1500, help="durée de chaque prise de parole")
+    parser.add_argument("--ramp", type=float, default=2.0, help="étalement des débuts d'appel (s)")
+    parser.add_argument("--response-idle", type=float, default=0.8,
+                        help="silence (s) après lequel la réponse est considérée terminée")
+    parser.add_argument("--turn-timeout", type=float, default=15.0)
+    parser.add_argument("--interrupt-rate", type=float, default=0.0,
+                        help="part des tours où le patient coupe la parole à l'assistante")
+    parser.add_argument("--interrupt-after", type=float, default=0.5,
+                        help="délai (s) entre le début de la réponse et l'interruption")
+    parser.add_argument("--stt-delay", type=float, default=0.3, help="délai du résultat final STT (s)")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="TTFT du faux LLM (s)")
+    parser.add_argument("--llm-tps", type=float, default=50.0, help="tokens/s du faux LLM")
+    parser.add_argument("--twilio-latency", type=float, default=0.15, help="durée d'une requête REST Twilio (s)")
+    parser.add_argument("--llm-port", type=int, default=8911)
+    parser.add_argument("--output", default="load_test_results.json")
+    args = parser.parse_args()
+
+    llm_process = start_fake_llm(args.llm_port, args.llm_ttft, args.llm_tps)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        llm_process.terminate()
+        llm_process.wait(timeout=10)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Résultats enregistrés dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Rejeu d'appels enregistrés (CALL_RECORDING=true, cf. call_recording.py) pour
+comparer la latence de deux versions de l'application sur les mêmes appels.
+
+Chaque enregistrement est renvoyé sur /media-stream, dans ce processus (ASGI,
+comme benchmarks/load_test.py), avec ses trames μ-law à leurs instants d'origine
+divisés par `--speed`. Les services externes reprennent les timings enregistrés :
+- STT : les résultats partiels et finals de l'appel, aux mêmes instants
+  (fakes.speech.ReplayedSTTEngine) ;
+- LLM : faux serveur OpenAI dont le TTFT et le débit sont ceux mesurés pour
+  chaque question (fakes.openai_server --timings) ;
+- Twilio REST et TTS : substituts de load_test.
+
+Le rapport donne, par étape de tour (metrics.TURN_STAGES), les p50/p95 mesurés
+au rejeu et ceux de l'enregistrement ; `diff` compare deux rapports.
+
+    python -m benchmarks.replay_calls show call_recordings/CA123-MZ456.prc
+    python -m benchmarks.replay_calls run call_recordings/*.prc --speed 4 --output replay_main.json
+    python -m benchmarks.replay_calls diff replay_main.json replay_branche.json --threshold 10
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+
+import httpx
+import numpy as np
+
+from benchmarks.load_test import AsgiWebSocket, REPO_ROOT, git_revision, import_app, percentiles
+from call_recording import CallRecording, MEDIA, STOP, START
+from fakes.speech import ReplayedSTTEngine
+from fakes.twilio import post_status_callback
+from metrics import TURN_STAGES
+
+FRAME_SECONDS = 0.02
+
+
+def stage_durations(marks: dict, scale: float = 1.0) -> dict:
+    """Durées (ms) des étapes d'un tour à partir de ses marques (même unité pour toutes)."""
+    durations = {}
+    for stage, (start, end) in TURN_STAGES.items():
+        if start in marks and end in marks and marks[end] >= marks[start]:
+            durations[stage] = (marks[end] - marks[start]) * scale
+    return durations
+
+
+def llm_timings(turns: list) -> dict:
+    """{question: (ttft, tokens/s)} des tours enregistrés dont la réponse a été générée par le LLM."""
+    timings = {}
+    for turn in turns:
+        marks, tokens = turn["marks"], turn["attributes"].get("tokens")
+        if "llm_request" not in marks or "first_token" not in marks:
+            continue
+        ttft = max(0.0, marks["first_token"] - marks["llm_request"])
+        generation = marks.get("last_token", marks["first_token"]) - marks["first_token"]
+        tokens_per_second = tokens / generation if tokens and generation > 0 else 1000.0
+        timings[turn["question"]] = (ttft, tokens_per_second)
+    return timings
+
+
+class ReplayedCall:
+    """
+    Une connexion enregistrée, rejouée : trames et événements `stop` à leurs
+    instants, marks renvoyés une fois l'audio de la réponse joué (cf.
+    load_test.SimulatedCall), à la vitesse `speed`.
+    """
+
+    def __init__(self, app_module, http: httpx.AsyncClient, recording: CallRecording, call_sid: str,
+                 speed: float):
+        self.app_module = app_module
+        self.http = http
+        self.recording = recording
+        self.call_sid = call_sid
+        self.speed = speed
+        self.stream_sid = "MZ" + call_sid[2:]
+        self.frames_sent = 0
+        self.errors = []
+        self._played_until = 0.0
+        self._pending_marks = {}
+
+    async def run(self):
+        start_message = self.recording.start_message()
+        start_message["streamSid"] = self.stream_sid
+        start_message.setdefault("start", {}).update(streamSid=self.stream_sid, callSid=self.call_sid)
+        ws = AsgiWebSocket(self.app_module.app, "/media-stream")
+        await ws.connect()
+        ws.send_text(json.dumps(start_message))
+        receiver = asyncio.create_task(self._receive(ws))
+        try:
+            await self._send_events(ws)
+            # Laisse la dernière réponse se terminer avant de couper
+            await asyncio.sleep(max(0.0, self._played_until - time.perf_counter()) + 0.2)
+        finally:
+            await ws.close()
+            receiver.cancel()
+        try:
+            await post_status_callback(self.http, "/call-status", self.call_sid, "completed")
+        except Exception as e:
+            self.errors.append(f"call-status: {e}")
+
+    async def _send_events(self, ws: AsgiWebSocket):
+        # Les marks enregistrés sont regénérés par le rejeu : seuls l'audio et `stop` sont renvoyés
+        events = list(self.recording.events((START, MEDIA, STOP)))
+        origin = events[0][1] if events else 0.0
+        started = time.perf_counter()
+        sequence = 0
+        for kind, t, data in events:
+            if kind == START:
+                continue
+            await asyncio.sleep(max(0.0, started + (t - origin) / self.speed - time.perf_counter()))
+            if kind == STOP:
+                ws.send_text(json.dumps({"event": "stop", "streamSid": self.stream_sid}))
+                continue
+            ws.send_text(json.dumps({
+                "event": "media", "sequenceNumber": str(sequence + 2), "streamSid": self.stream_sid,
+                "media": {"track": "inbound", "chunk": str(sequence + 1), "timestamp": str(sequence * 20),
+                          "payload": base64.b64encode(data).decode("ascii")},
+            }, separators=(",", ":")))
+            sequence += 1
+            self.frames_sent += 1
+
+    def _send_mark(self, ws: AsgiWebSocket, name: str):
+        self._pending_marks.pop(name, None)
+        ws.send_text(json.dumps({"event": "mark", "streamSid": self.stream_sid, "mark": {"name": name}}))
+
+    async def _receive(self, ws: AsgiWebSocket):
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.close":
+                return
+            if message["type"] != "websocket.send":
+                continue
+            text = message.get("text", "")
+            now = time.perf_counter()
+            if '"media"' in text:
+                self._played_until = max(self._played_until, now) + FRAME_SECONDS / self.speed
+                continue
+            control = json.loads(text)
+            if control.get("event") == "mark":
+                name = control["mark"]["name"]
+                delay = max(0.0, self._played_until - now)
+                self._pending_marks[name] = asyncio.get_running_loop().call_later(delay, self._send_mark, ws, name)
+            elif control.get("event") == "clear":
+                self._played_until = now
+                for name, handle in list(self._pending_marks.items()):
+                    handle.cancel()
+                    self._send_mark(ws, name)
+
+
+def load_recordings(paths: list) -> list:
+    recordings = []
+    for path in paths:
+        try:
+            recordings.append(CallRecording(path))
+        except (OSError, ValueError) as e:
+            print(f"{path} ignoré: {e}", file=sys.stderr)
+    return recordings
+
+
+def start_replay_llm(port: int, timings_path: str) -> subprocess.Popen:
+    # Sans gigue : seuls les timings enregistrés, le TTFT par défaut servant aux autres requêtes (résumés)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "fakes.openai_server", "--port", str(port), "--jitter", "0",
+         "--timings", timings_path],
+        cwd=REPO_ROOT,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/v1/models", timeout=0.5).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Le faux serveur OpenAI n'a pas démarré")
+
+
+async def replay(app_module, recordings: list, call_sids: list, args) -> list:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+        async def play(recording, call_sid):
+            async with semaphore:
+                call = ReplayedCall(app_module, http, recording, call_sid, args.speed)
+                await call.run()
+                return call
+
+        return await asyncio.gather(*(play(recording, call_sid)
+                                      for recording, call_sid in zip(recordings, call_sids)))
+
+
+async def run_replay(args, recordings: list, timings_path: str) -> dict:
+    call_sids = [f"CAreplay{index:024d}" for index in range(len(recordings))]
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["CALL_RECORDING"] = "false"
+        app_module = import_app(argparse.Namespace(
+            llm_port=args.llm_port, concurrency=[args.concurrency], stt_delay=0.0, twilio_latency=args.twilio_latency,
+        ), workdir)
+        logging.getLogger().setLevel(logging.ERROR)
+        # Résultats STT de chaque connexion, en secondes depuis son événement start
+        scripts = {}
+        for recording, call_sid in zip(recordings, call_sids):
+            starts = [t for _, t, _ in recording.events((START,))]
+            origin = starts[0] if starts else 0.0
+            scripts[call_sid] = [(t - origin, final, text) for t, final, text in recording.stt_results()]
+        app_module.stt_pool.engine = ReplayedSTTEngine(scripts, speed=args.speed)
+        app_module.call_trace_log.recent = deque(maxlen=len(recordings) + 10)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        start = time.perf_counter()
+        try:
+            async with app_module.app.router.lifespan_context(app_module.app):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    calls = await replay(app_module, recordings, call_sids, args)
+        finally:
+            os.chdir(cwd)
+        elapsed = time.perf_counter() - start
+
+    replayed = {record["call_sid"]: record for record in app_module.call_trace_log.recent}
+    stages = {"replay": {}, "recorded": {}}
+    per_call = []
+    for recording, call_sid, call in zip(recordings, call_sids, calls):
+        recorded_turns = recording.turns()
+        replay_turns = replayed.get(call_sid, {}).get("turns", [])
+        for turn in recorded_turns:
+            for stage, duration in stage_durations(turn["marks"], 1000).items():
+                stages["recorded"].setdefault(stage, []).append(duration)
+        for turn in replay_turns:
+            # Durées ramenées au temps de l'appel d'origine
+            for stage, duration in stage_durations(turn.get("marks_ms", {}), args.speed).items():
+                stages["replay"].setdefault(stage, []).append(duration)
+        per_call.append({"recording": os.path.basename(recording.path), "call_sid": call_sid,
+                         "duration_s": round(recording.duration, 2), "frames": call.frames_sent,
+                         "turns_recorded": len(recorded_turns), "turns_replayed": len(replay_turns),
+                         "errors": call.errors})
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "stages_ms": {source: {stage: percentiles(values) for stage, values in sorted(by_stage.items())}
+                      for source, by_stage in stages.items()},
+        "calls": per_call,
+    }
+
+
+def command_run(args) -> int:
+    recordings = load_recordings(args.recordings)
+    if not recordings:
+        print("Aucun enregistrement lisible", file=sys.stderr)
+        return 1
+    timings = {}
+    for recording in recordings:
+        timings.update(llm_timings(recording.turns()))
+    # Latences LLM ramenées à la vitesse du rejeu
+    timings = {question: (ttft / args.speed, tokens_per_second * args.speed)
+               for question, (ttft, tokens_per_second) in timings.items()}
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+        json.dump(timings, f, ensure_ascii=False)
+        timings_path = f.name
+    llm_process = start_replay_llm(args.llm_port, timings_path)
+    try:
+        result = asyncio.run(run_replay(args, recordings, timings_path))
+    finally:
+        llm_process.terminate()
+        llm_process.wait(timeout=10)
+        os.unlink(timings_path)
+        for recording in recordings:
+            recording.close()
+    report = {
+        "revision": git_revision(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"speed": args.speed, "concurrency": args.concurrency, "recordings": len(recordings)},
+        **result,
+    }
+    for stage, replay_stats in report["stages_ms"]["replay"].items():
+        recorded_stats = report["stages_ms"]["recorded"].get(stage, {})
+        print(f"{stage:>10} | rejeu p50 {replay_stats.get('p50')} p95 {replay_stats.get('p95')} ms | "
+              f"enregistré p50 {recorded_stats.get('p50')} p95 {recorded_stats.get('p95')} ms")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Rapport écrit dans {args.output}")
+    return 0
+
+
+def command_diff(args) -> int:
+    """Écarts par étape entre deux rapports de rejeu ; code 1 si une étape régresse au-delà du seuil."""
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    before, after = baseline["stages_ms"]["replay"], candidate["stages_ms"]["replay"]
+    print(f"{baseline.get('revision')} -> {candidate.get('revision')}")
+    regressions = []
+    for stage in TURN_STAGES:
+        if stage not in before or stage not in after:
+            continue
+        deltas = []
+        for quantile in ("p50", "p95"):
+            old, new = before[stage].get(quantile), after[stage].get(quantile)
+            if old is None or new is None:
+                continue
+            delta = new - old
+            deltas.append(f"{quantile} {old} -> {new} ms ({delta:+.1f})")
+            if delta > args.threshold and (not old or delta / old * 100 > args.threshold_percent):
+                regressions.append(f"{stage} {quantile}")
+        print(f"{stage:>10} | " + " | ".join(deltas))
+    if regressions:
+        print("Régressions: " + ", ".join(regressions))
+        return 1
+    return 0
+
+
+def command_show(args) -> int:
+    with CallRecording(args.recording) as recording:
+        start_message = recording.start_message().get("start", {})
+        print(json.dumps({
+            "call_sid": start_message.get("callSid"),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(recording.started_at)),
+            "duration_s": round(recording.duration, 2),
+            "indexed": recording.indexed,
+            "events": recording.counts(),
+            "audio_s": round(float(np.sum(recording.index["kind"] == MEDIA)) * FRAME_SECONDS, 2),
+        }, indent=2, ensure_ascii=False))
+        for t, final, text in recording.stt_results():
+            if final:
+                print(f"{t:8.2f}s  STT   {text}")
+        for turn in recording.turns():
+            durations = {stage: round(ms) for stage, ms in stage_durations(turn["marks"], 1000).items()}
+            print(f"tour {turn['index']}: {durations}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rejeu d'appels enregistrés et comparaison de latence")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="rejoue des enregistrements et mesure les étapes des tours")
+    run_parser.add_argument("recordings", nargs="+")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="accélération du rejeu (1 = temps réel)")
+    run_parser.add_argument("--concurrency", type=int, default=10, help="connexions rejouées simultanément")
+    run_parser.add_argument("--twilio-latency", type=float, default=0.15, help="durée d'une requête REST Twilio (s)")
+    run_parser.add_argument("--llm-port", type=int, default=8911)
+    run_parser.add_argument("--output", default="replay_results.json")
+    diff_parser = commands.add_parser("diff", help="compare deux rapports de rejeu")
+    diff_parser.add_argument("baseline")
+    diff_parser.add_argument("candidate")
+    diff_parser.add_argument("--threshold", type=float, default=20.0, help="régression minimale (ms)")
+    diff_parser.add_argument("--threshold-percent", type=float, default=10.0, help="régression minimale (%%)")
+    show_parser = commands.add_parser("show", help="résume un enregistrement")
+    show_parser.add_argument("recording")
+    args = parser.parse_args()
+    handler = {"run": command_run, "diff": command_diff, "show": command_show}[args.command]
+    sys.exit(handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+import asyncio
+import datetime
+import fcntl
+import glob
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    segment  TEXT NOT NULL,                -- nom du fichier segment
+    offset   INTEGER NOT NULL,             -- position de l'en-tête de la trame
+    length   INTEGER NOT NULL,             -- en-tête compris
+    kind     TEXT NOT NULL,                -- "turns" (tours écrits pendant l'appel) ou "call" (appel complet)
+    call_sid TEXT NOT NULL,
+    patient  TEXT,                         -- numéro de téléphone du patient
+    at       TEXT NOT NULL,                -- ISO 8601, heure locale (début de l'appel pour "call")
+    records  INTEGER NOT NULL,
+    PRIMARY KEY (segment, offset)
+);
+CREATE INDEX IF NOT EXISTS idx_frames_patient ON frames (patient, kind, at);
+CREATE INDEX IF NOT EXISTS idx_frames_call ON frames (call_sid);
+CREATE INDEX IF NOT EXISTS idx_frames_at ON frames (kind, at);
+"""
+
+MAGIC = b"PCA1"
+# Magie, longueur des données compressées, crc32 des données compressées
+FRAME_HEADER = struct.Struct("<4sII")
+FSYNC_POLICIES = ("always", "interval", "never")
+# Distingue les archives ouvertes par un même processus (noms de segments)
+_instances = itertools.count(1)
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def encode_frame(records: list, level: int = 6) -> bytes:
+    """Trame : en-tête puis enregistrements JSON Lines compressés (zlib) ensemble."""
+    payload = zlib.compress(
+        "\n".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) for record in records).encode("utf-8"),
+        level,
+    )
+    return FRAME_HEADER.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_frame(data: bytes) -> list:
+    magic, length, crc = FRAME_HEADER.unpack_from(data)
+    payload = data[FRAME_HEADER.size:FRAME_HEADER.size + length]
+    if magic != MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+        raise ValueError("Trame d'archive corrompue")
+    return [json.loads(line) for line in zlib.decompress(payload).decode("utf-8").split("\n")]
+
+
+def _frame_row(segment: str, offset: int, length: int, records: list) -> tuple:
+    first = records[0]
+    kind = "call" if any(record["type"] == "call" for record in records) else "turns"
+    return segment, offset, length, kind, first["call_sid"], first.get("patient"), first["at"], len(records)
+
+
+class CallArchive:
+    """
+    Archive des transcripts et résumés d'appels, en écriture différée.
+
+    `record_turn` et `record_call` ne font que placer l'enregistrement dans une
+    file en mémoire : aucune entrée/sortie disque sur le chemin d'un tour. Une
+    tâche d'écriture regroupe les enregistrements (jusqu'à `batch_size`, ou
+    après `max_delay` secondes) et les écrit depuis un thread :
+
+    - fichiers segments en ajout seul, changés au-delà de `segment_max_bytes` ;
+      un segment n'est écrit que par un processus (verrou `flock`), chaque
+      worker uvicorn a donc les siens ;
+    - une trame compressée par appel et par lot : les tours écrits pendant
+      l'appel (kind "turns"), puis l'appel complet avec son résumé (kind
+      "call"), seule trame lue pour l'historique d'un patient ;
+    - un index SQLite (mode WAL, partagé par les workers) des trames par
+      patient, call_sid et date : l'historique d'un patient coûte une requête
+      indexée et une lecture positionnée par appel.
+
+    Durabilité (`fsync`) : "always" (fsync après chaque lot, avant l'index),
+    "interval" (au plus toutes les `fsync_interval` secondes, et à l'arrêt) ou
+    "never" (laissé au système). Une trame écrite mais absente de l'index
+    (arrêt brutal entre les deux) est réindexée au démarrage ; une trame
+    tronquée en fin de segment est supprimée.
+
+    Les méthodes de lecture (`patient_history`, `call`) font des entrées/sorties
+    bloquantes : à appeler via `asyncio.to_thread`. `export` est un générateur
+    asynchrone qui lit l'archive page par page dans un thread.
+    """
+
+    def __init__(self, directory: str = "call_archive", index_path: str = None, fsync: str = "interval",
+                 fsync_interval: float = 1.0, batch_size: int = 256, max_delay: float = 0.5,
+                 segment_max_bytes: int = 64 * 1024 * 1024, queue_size: int = 100000, compression_level: int = 6,
+                 on_batch=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Politique fsync inconnue: {fsync}")
+        # Chemins absolus : les threads de lecture et d'écriture ne dépendent pas du répertoire courant
+        self.directory = os.path.abspath(directory)
+        self.index_path = os.path.abspath(index_path or os.path.join(directory, "index.db"))
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.segment_max_bytes = segment_max_bytes
+        self.compression_level = compression_level
+        self.on_batch = on_batch  # appelé avec (enregistrements, octets écrits, secondes) après chaque lot
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._task = None
+        # Segment en cours d'écriture (thread d'écriture uniquement)
+        self._writer = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{next(_instances)}"
+        self._segment_number = 0
+        self._segment = None
+        self._fd = None
+        self._segment_size = 0
+        self._dirty = False
+        self._synced_at = time.monotonic()
+        # Descripteurs de lecture, partagés par les threads (os.pread)
+        self._readers = OrderedDict()
+        self._readers_lock = threading.Lock()
+        self.stats = {"queued": 0, "dropped": 0, "written": 0, "batches": 0, "bytes": 0, "raw_bytes": 0,
+                      "fsyncs": 0, "errors": 0, "recovered": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        # Une connexion par thread : sqlite3 interdit le partage entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # L'index se reconstruit depuis les segments : fsync seulement si demandé pour les segments
+            conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync == 'always' else 'NORMAL'}")
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.isolation_level = "DEFERRED"
+            self._local.conn = conn
+        return conn
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    # --- Écriture différée ---
+    def record_turn(self, call_sid: str, patient: str, index: int, patient_text: str, ai_text: str):
+        """Tour de conversation (texte brut), écrit en tâche de fond."""
+        self._put({"type": "turn", "call_sid": call_sid, "patient": patient, "at": _now(), "index": index,
+                   "patient_text": patient_text, "ai_text": ai_text})
+
+    def record_call(self, call_sid: str, patient: str, turns: list, summary: dict, started_at: str = None):
+        """Appel terminé : transcript complet et résumé, écrits en tâche de fond."""
+        self._put({"type": "call", "call_sid": call_sid, "patient": patient, "at": started_at or _now(),
+                   "ended_at": _now(), "turns": turns, "summary": summary})
+
+    def _put(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logging.error("File d'archivage pleine, enregistrement %s de l'appel %s perdu",
+                          record["type"], record["call_sid"])
+            return
+        self.stats["queued"] += 1
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Écrit les enregistrements en file, puis ferme les segments."""
+        if self._task is not None:
+            if not self._task.done():
+                await self._queue.join()
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.close)
+
+    async def flush(self):
+        """Attend l'écriture des enregistrements en file et force leur fsync."""
+        await self._queue.join()
+        await asyncio.to_thread(self._sync)
+
+    async def _run(self):
+        try:
+            await asyncio.to_thread(self.recover)
+        except Exception as e:
+            logging.error("Archive : reprise des segments impossible: %s", e)
+        while True:
+            try:
+                if self._dirty:
+                    record = await asyncio.wait_for(self._queue.get(), self.fsync_interval)
+                else:
+                    record = await self._queue.get()
+            except asyncio.TimeoutError:
+                # Plus rien à écrire : les dernières trames sont synchronisées sans attendre le lot suivant
+                await asyncio.to_thread(self._sync)
+                continue
+            if self._queue.qsize() < self.batch_size - 1:
+                # Le lot se remplit pendant ce délai (tours des autres appels)
+                await asyncio.sleep(self.max_delay)
+            batch = [record]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                self.stats["errors"] += len(batch)
+                logging.error("Échec de l'écriture de %d enregistrements dans l'archive: %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: list):
+        start = time.monotonic()
+        # Une trame par appel : les enregistrements d'un appel sont relus ensemble
+        calls = OrderedDict()
+        for record in batch:
+            calls.setdefault((record["call_sid"], record["type"] == "call"), []).append(record)
+        frames = [(encode_frame(records, self.compression_level), records) for records in calls.values()]
+        size = sum(len(frame) for frame, _ in frames)
+        if self._fd is None or (self._segment_size and self._segment_size + size > self.segment_max_bytes):
+            self._rotate()
+        offset = self._segment_size
+        data = memoryview(b"".join(frame for frame, _ in frames))
+        while data:
+            data = data[os.write(self._fd, data):]
+        self._segment_size += size
+        self._dirty = True
+        if self.fsync == "always" or (self.fsync == "interval"
+                                      and time.monotonic() - self._synced_at >= self.fsync_interval):
+            self._sync()
+        rows = []
+        for frame, records in frames:
+            rows.append(_frame_row(self._segment, offset, len(frame), records))
+            offset += len(frame)
+        with self._connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["bytes"] += size
+        self.stats["raw_bytes"] += sum(len(json.dumps(record, ensure_ascii=False)) for record in batch)
+        if self.on_batch:
+            self.on_batch(len(batch), size, time.monotonic() - start)
+
+    def _rotate(self):
+        self._close_segment()
+        self._segment_number += 1
+        self._segment = f"{self._writer}-{self._segment_number:06d}.seg"
+        self._fd = os.open(os.path.join(self.directory, self._segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                           0o600)
+        # Segment réservé à ce processus ; la reprise au démarrage ignore les segments verrouillés
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._segment_size = os.fstat(self._fd).st_size
+
+    def _sync(self):
+        if self._fd is not None and self._dirty and self.fsync != "never":
+            os.fsync(self._fd)
+            self.stats["fsyncs"] += 1
+        self._dirty = False
+        self._synced_at = time.monotonic()
+
+    def _close_segment(self):
+        if self._fd is not None:
+            self._sync()
+            os.close(self._fd)
+            self._fd = None
+
+    def close(self):
+        self._close_segment()
+        with self._readers_lock:
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers.clear()
+
+    # --- Reprise après arrêt brutal ---
+    def recover(self) -> int:
+        """Indexe les trames écrites après la dernière entrée de l'index ; tronque une trame incomplète."""
+        recovered = 0
+        conn = self._connection()
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.seg"))):
+            segment = os.path.basename(path)
+            if segment == self._segment:
+                continue
+            row = conn.execute("SELECT MAX(offset + length) FROM frames WHERE segment = ?", (segment,)).fetchone()
+            indexed = row[0] or 0
+            if os.path.getsize(path) <= indexed:
+                continue
+            fd = os.open(path, os.O_RDWR)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # segment en cours d'écriture par un autre worker
+                recovered += self._reindex_segment(fd, segment, indexed)
+            finally:
+                os.close(fd)
+        if recovered:
+            logging.warning("Archive : %d trames ajoutées à l'index depuis les segments", recovered)
+        self.stats["recovered"] += recovered
+        return recovered
+
+    def _reindex_segment(self, fd: int, segment: str, offset: int) -> int:
+        size = os.fstat(fd).st_size
+        rows = []
+        while offset < size:
+            header = os.pread(fd, FRAME_HEADER.size, offset)
+            try:
+                if len(header) < FRAME_HEADER.size:
+                    raise ValueError("En-tête incomplet")
+                length = FRAME_HEADER.size + FRAME_HEADER.unpack(header)[1]
+                records = decode_frame(header + os.pread(fd, length - FRAME_HEADER.size, offset + FRAME_HEADER.size))
+            except (ValueError, zlib.error):
+                logging.warning("Archive : fin de segment %s tronquée à l'octet %d", segment, offset)
+                os.ftruncate(fd, offset)
+                break
+            rows.append(_frame_row(segment, offset, length, records))
+            offset += length
+        with self._connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def reindex(self) -> int:
+        """Reconstruit tout l'index depuis les segments (index perdu ou corrompu)."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM frames")
+        return self.recover()
+
+    # --- Lecture (bloquant) ---
+    def _read_frame(self, segment: str, offset: int, length: int) -> list:
+        with self._readers_lock:
+            fd = self._readers.get(segment)
+            if fd is None:
+                fd = self._readers[segment] = os.open(os.path.join(self.directory, segment), os.O_RDONLY)
+                if len(self._readers) > 64:
+                    os.close(self._readers.popitem(last=False)[1])
+            else:
+                self._readers.move_to_end(segment)
+            return decode_frame(os.pread(fd, length, offset))
+
+    def _read_rows(self, rows) -> list:
+        records = []
+        for row in rows:
+            records += self._read_frame(row[0], row[1], row[2])
+        return records
+
+    def patient_history(self, patient: str, limit: int = 20, since: str = None, until: str = None) -> list:
+        """Appels terminés d'un patient, du plus récent au plus ancien, transcript et résumé compris."""
+        rows = self._connection().execute(
+            "SELECT segment, offset, length FROM frames WHERE patient = ? AND kind = 'call' "
+            "AND at >= ? AND at < ? ORDER BY at DESC LIMIT ?",
+            (patient, since or "", until or "\uffff", limit),
+        ).fetchall()
+        return [record for record in self._read_rows(rows) if record["type"] == "call"]
+
+    def call(self, call_sid: str):
+        """Appel complet ; pour un appel en cours ou interrompu, les tours déjà écrits (`summary` à None)."""
+        rows = self._connection().execute(
+            "SELECT segment, offset, length FROM frames WHERE call_sid = ? ORDER BY at, segment, offset",
+            (call_sid,),
+        ).fetchall()
+        records = self._read_rows(rows)
+        complete = [record for record in records if record["type"] == "call"]
+        if complete:
+            return complete[-1]
+        turns = sorted((record for record in records if record["type"] == "turn"), key=lambda record: record["index"])
+        if not turns:
+            return None
+        return {"type": "call", "call_sid": call_sid, "patient": turns[0]["patient"], "at": turns[0]["at"],
+                "ended_at": None, "turns": [[turn["patient_text"], turn["ai_text"]] for turn in turns],
+                "summary": None}
+
+    def _export_page(self, patient, since, until, kind, after: tuple, page_size: int) -> tuple:
+        # Pagination par clé : chaque page est lue par le thread qui la demande
+        query = ("SELECT segment, offset, length, at FROM frames WHERE kind = ? AND at >= ? AND at < ? "
+                 "AND (at, segment, offset) > (?, ?, ?)")
+        params = [kind, since or "", until or "\uffff", *after]
+        if patient is not None:
+            query += " AND patient = ?"
+            params.append(patient)
+        rows = self._connection().execute(query + " ORDER BY at, segment, offset LIMIT ?",
+                                          (*params, page_size)).fetchall()
+        if not rows:
+            return b"", None
+        lines = [json.dumps(record, ensure_ascii=False) for record in self._read_rows(rows)
+                 if kind == "turns" or record["type"] == "call"]
+        last = rows[-1]
+        return ("\n".join(lines) + "\n").encode("utf-8"), (last[3], last[0], last[1])
+
+    async def export(self, patient: str = None, since: str = None, until: str = None, kind: str = "call",
+                     page_size: int = 200):
+        """Enregistrements en JSON Lines (octets), par ordre chronologique, lus page par page hors de la boucle."""
+        after = ("", "", -1)
+        while True:
+            data, after = await asyncio.to_thread(self._export_page, patient, since, until, kind, after, page_size)
+            if after is None:
+                break
+            yield data
+
+    def summary(self) -> dict:
+        conn = self._connection()
+        row = conn.execute("SELECT COUNT(*), COUNT(DISTINCT patient), COALESCE(SUM(length), 0) FROM frames "
+                           "WHERE kind = 'call'").fetchone()
+        return {"calls": row[0], "patients": row[1], "call_bytes": row[2],
+                "segments": len(glob.glob(os.path.join(self.directory, "*.seg"))), "queue_depth": self.depth,
+                **self.stats}
+
+
+if __name__ == "__main__":
+    # python call_archive.py reindex|export [répertoire] [patient]
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    archive_dir = sys.argv[2] if len(sys.argv) > 2 else os.getenv("ARCHIVE_DIR", "call_archive")
+    if command == "reindex":
+        print(f"{CallArchive(archive_dir).reindex()} trames indexées")
+    elif command == "export":
+        async def _export():
+            async for data in CallArchive(archive_dir).export(patient=sys.argv[3] if len(sys.argv) > 3 else None):
+                sys.stdout.write(data.decode("utf-8"))
+        asyncio.run(_export())
+    else:
+        print("Usage: python call_archive.py reindex|export [répertoire] [patient]")
@@ -0,0 +1,308 @@
+"""
+Préparation des appels avant qu'ils ne commencent.
+
+Pour chaque patient dont l'appel est prévu dans la fenêtre à venir, on génère
+une fois pour toutes, hors appel :
+- le plan de conversation personnalisé (LLM, à partir du profil anonymisé), validé ;
+- le préfixe de prompt propre au patient (profil anonymisé) ;
+- les tables de l'anonymiseur.
+
+Le résultat est stocké dans un cache sur disque adressé par contenu : la clé est
+l'empreinte du dossier patient (et de la version des prompts), donc toute
+modification du dossier invalide l'entrée. `CallSession` la charge en O(1) au
+début de l'appel ; sans entrée, l'appel utilise le plan par défaut, sans appel
+au LLM.
+
+    python call_assets.py                      # prépare la fenêtre à venir
+    python call_assets.py --window-hours 48 --concurrency 8
+    python call_assets.py --prune              # supprime les entrées qui ne correspondent plus à un dossier
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from LLM.anonymizer import Anonymizer, PLACEHOLDERS
+
+# À incrémenter quand les prompts ou le format changent : invalide tout le cache
+PROMPT_VERSION = 1
+DEFAULT_CONVERSATION_PLAN = [
+    "Salutation et Verifier l'identité du patient nom",
+    "Prendre date de RDV pour prochain suivi, avec heure",
+    "Se renseigner sur quelque chose de spécifique 1 (s'il mange bien)",
+    "Se renseigner sur quelque chose de spécifique 2 (s'il a dormi)",
+    "Parler d'un centre d'intérêt du patient 1",
+    "Parler d'un centre d'intérêt du patient 2",
+    "Au revoir"
+]
+MIN_PLAN_STEPS = 3
+MAX_PLAN_STEPS = 15
+MAX_STEP_LENGTH = 300
+
+
+class PatientDirectory:
+    """
+    Dossiers patients (fichier JSON {téléphone: dossier}), rechargés si le
+    fichier change. Les dossiers contiennent au moins `name` et `age`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._records = {}
+        self._mtime = None
+
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._records, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._records = json.load(f)
+            self._mtime = mtime
+
+    def get(self, phone: str):
+        self._reload()
+        record = self._records.get(phone)
+        return dict(record, phone=phone) if record is not None else None
+
+    def __iter__(self):
+        self._reload()
+        return iter(self._records)
+
+
+def sanitized_profile(patient: dict, anonymizer: Anonymizer) -> dict:
+    """Dossier patient anonymisé : seul contenu du dossier envoyé au LLM."""
+    def sanitize(value):
+        if isinstance(value, str):
+            return anonymizer.sanitize(value)
+        if isinstance(value, list):
+            return [sanitize(item) for item in value]
+        if isinstance(value, dict):
+            return {key: sanitize(item) for key, item in value.items()}
+        return value
+
+    profile = {}
+    for field, value in patient.items():
+        if field in PLACEHOLDERS:
+            profile[field] = f"{PLACEHOLDERS[field]} ans" if field == "age" else PLACEHOLDERS[field]
+        else:
+            profile[field] = sanitize(value)
+    return profile
+
+
+def profile_prompt(profile: dict) -> str:
+    return "Profil du patient (anonymisé) :\n" + json.dumps(profile, ensure_ascii=False, indent=2)
+
+
+def validate_plan(steps, anonymizer: Anonymizer) -> list:
+    """
+    Vérifie et normalise un plan produit par le LLM : liste de 3 à 15 étapes
+    textuelles, sans donnée personnelle en clair, terminée par la clôture.
+    Lève ValueError si le plan est inutilisable.
+    """
+    if not isinstance(steps, list):
+        raise ValueError("le plan n'est pas une liste")
+    plan = []
+    for step in steps:
+        if isinstance(step, dict):
+            # Étapes structurées ({"step": ..., "description": ...}) : on garde le texte
+            step = " - ".join(str(value) for value in step.values() if isinstance(value, str) and value.strip())
+        if not isinstance(step, str) or not step.strip():
+            continue
+        step = " ".join(step.split())[:MAX_STEP_LENGTH]
+        if anonymizer.sanitize(step) != step:
+            raise ValueError(f"donnée personnelle en clair dans l'étape: {step[:40]}...")
+        plan.append(step)
+    if not MIN_PLAN_STEPS <= len(plan) <= MAX_PLAN_STEPS:
+        raise ValueError(f"{len(plan)} étapes (attendu {MIN_PLAN_STEPS}-{MAX_PLAN_STEPS})")
+    if "revoir" not in plan[-1].lower():
+        plan.append("Au revoir")
+    return plan
+
+
+class CallAssets:
+    """Éléments préparés pour l'appel d'un patient."""
+
+    __slots__ = ("digest", "plan", "profile_prompt", "forward", "reverse", "generated_at")
+
+    def __init__(self, digest: str, plan: list, profile_prompt: str, forward: dict, reverse: dict,
+                 generated_at: str = None):
+        self.digest = digest
+        self.plan = plan
+        self.profile_prompt = profile_prompt
+        self.forward = forward
+        self.reverse = reverse
+        self.generated_at = generated_at or datetime.now().isoformat(timespec="seconds")
+
+    def anonymizer(self) -> Anonymizer:
+        return Anonymizer(self.forward, self.reverse)
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CallAssets":
+        return cls(**{slot: data[slot] for slot in cls.__slots__})
+
+
+class AssetCache:
+    """
+    Cache sur disque adressé par contenu : `<répertoire>/<2 premiers car.>/<empreinte>.json`.
+    Lecture en O(1) (une empreinte, une ouverture de fichier), écriture atomique.
+    """
+
+    def __init__(self, directory: str = "call_assets", model: str = ""):
+        self.directory = directory
+        self.model = model
+        os.makedirs(directory, exist_ok=True)
+
+    def digest(self, patient: dict) -> str:
+        content = json.dumps({"patient": patient, "version": PROMPT_VERSION, "model": self.model},
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, patient: dict):
+        try:
+            with open(self._path(self.digest(patient)), "r", encoding="utf-8") as f:
+                return CallAssets.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.error("Entrée de cache d'appel illisible: %s", e)
+            return None
+
+    def __contains__(self, patient: dict) -> bool:
+        return os.path.exists(self._path(self.digest(patient)))
+
+    def put(self, assets: CallAssets):
+        path = self._path(assets.digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(assets.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def prune(self, keep: set) -> int:
+        """Supprime les entrées dont l'empreinte n'est pas dans `keep` (dossiers modifiés ou supprimés)."""
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json") and name[:-5] not in keep:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+        return removed
+
+
+async def build_assets(patient: dict, llm, digest: str) -> CallAssets:
+    """Génère et valide les éléments d'un appel (seule étape qui appelle le LLM)."""
+    anonymizer = Anonymizer.from_patient(patient)
+    profile = sanitized_profile(patient, anonymizer)
+    steps = await llm.generate_conversation_plan(profile)
+    plan = validate_plan(steps, anonymizer)
+    forward, reverse = anonymizer.maps()
+    return CallAssets(digest, plan, profile_prompt(profile), forward, reverse)
+
+
+class AssetPreparer:
+    """
+    Prépare les appels des patients prévus dans les `window` prochaines heures,
+    avec au plus `concurrency` générations simultanées. Les patients déjà en
+    cache (dossier inchangé) sont ignorés.
+    """
+
+    def __init__(self, store, patients: PatientDirectory, cache: AssetCache, llm, window: timedelta = timedelta(hours=24),
+                 concurrency: int = 4):
+        self.store = store
+        self.patients = patients
+        self.cache = cache
+        self.llm = llm
+        self.window = window
+        self._limiter = asyncio.Semaphore(concurrency)
+        self.stats = {"prepared": 0, "cached": 0, "unknown": 0, "invalid": 0, "failed": 0}
+
+    async def prepare_due(self, now: datetime = None) -> dict:
+        now = now or datetime.now()
+        self.stats = dict.fromkeys(self.stats, 0)
+        due = await asyncio.to_thread(self.store.due_calls, now - timedelta(hours=1), now + self.window)
+        start = time.perf_counter()
+        await asyncio.gather(*(self._prepare(row["patient"]) for row in due))
+        logging.info("Préparation de %s appels en %.1fs: %s", len(due), time.perf_counter() - start, self.stats)
+        return dict(self.stats)
+
+    async def _prepare(self, phone: str):
+        patient = self.patients.get(phone)
+        if patient is None:
+            self.stats["unknown"] += 1
+            return
+        if patient in self.cache:
+            self.stats["cached"] += 1
+            return
+        async with self._limiter:
+            try:
+                assets = await build_assets(patient, self.llm, self.cache.digest(patient))
+            except ValueError as e:
+                self.stats["invalid"] += 1
+                logging.warning("Plan invalide pour %s: %s", phone, e)
+                return
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error("Échec de la préparation de l'appel de %s: %s", phone, e)
+                return
+        await asyncio.to_thread(self.cache.put, assets)
+        self.stats["prepared"] += 1
+
+    async def run_forever(self, interval: float = 900.0):
+        """Boucle de fond du service de numérotation : prépare la fenêtre glissante."""
+        while True:
+            try:
+                await self.prepare_due()
+            except Exception as e:
+                logging.error("Erreur de la préparation des appels: %s", e)
+            await asyncio.sleep(interval)
+
+
+def create_preparer(store, concurrency: int = None, window_hours: float = None) -> AssetPreparer:
+    """AssetPreparer configuré par l'environnement (mêmes variables que l'application)."""
+    from LLM.realtime_llm import AsyncDeepInfraLLM
+
+    llm = AsyncDeepInfraLLM(api_key=os.getenv("deepinfra_key"), base_url=os.getenv("deepinfra_base_url"),
+                            model=os.getenv("PLAN_MODEL", "meta-llama/Llama-3.3-70B-Instruct-Turbo"))
+    return AssetPreparer(
+        store,
+        PatientDirectory(os.getenv("PATIENTS_PATH", "patients.json")),
+        AssetCache(os.getenv("CALL_ASSETS_DIR", "call_assets"), model=llm.model),
+        llm,
+        window=timedelta(hours=window_hours or float(os.getenv("PREPARE_WINDOW_HOURS", "24"))),
+        concurrency=concurrency or int(os.getenv("PREPARE_CONCURRENCY", "4")),
+    )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from schedule_store import ScheduleStore
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Préparation des appels à venir (plans, prompts, anonymisation)")
+    parser.add_argument("--window-hours", type=float, help="fenêtre de préparation (h)")
+    parser.add_argument("--concurrency", type=int, help="générations simultanées max")
+    parser.add_argument("--prune", action="store_true", help="supprime les entrées des dossiers modifiés")
+    args = parser.parse_args()
+
+    preparer = create_preparer(ScheduleStore(os.getenv("SCHEDULE_DB_PATH", "call_schedule.db")),
+                               args.concurrency, args.window_hours)
+    if args.prune:
+        keep = {preparer.cache.digest(preparer.patients.get(phone)) for phone in preparer.patients}
+        print(f"{preparer.cache.prune(keep)} entrées supprimées")
+    else:
+        print(asyncio.run(preparer.prepare_due()))
@@ -1,50 +1,240 @@
-from apscheduler.schedulers.blocking import BlockingScheduler
-import pandas as pd
-import requests
-from datetime import datetime
-
-def make_call(number):
-    url = "https://b7c2-78-196-182-205.ngrok-free.app/make-call"
-    payload = {"target_phone": number}
-    headers = {"Content-Type": "application/json"}
-    
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        print(f"Appel à {number} - Statut : {response.status_code}")
-        if response.status_code == 200:
-            print("Réponse du serveur:", response.json())
-        else:
-            print("Erreur:", response.text)
-    except Exception as e:
-        print(f"Échec de l'appel à {number} : {str(e)}")
-
-def start_scheduled_calls():
-    # Lire le CSV avec parsing des dates ISO
-    patients = pd.read_csv(
-        "../call_schedule.csv",
-        parse_dates=['time'],
-        date_format='ISO8601'  # Format 2025-03-13T14:00:00
-    )
-    
-    scheduler = BlockingScheduler()
-    
-    for _, row in patients.iterrows():
-        # Extraire heure et minute depuis la datetime
-        call_time = row['time'].to_pydatetime()
-        
-        scheduler.add_job(
-            make_call,
-            'cron',
-            year=call_time.year,
-            month=call_time.month,
-            day=call_time.day,
-            hour=call_time.hour,
-            minute=call_time.minute,
-            args=[row['number']]
+"""
+Service de numérotation sortante.
+
+Lit le planning (ScheduleStore) par ordre chronologique et déclenche les appels
+via l'endpoint /make-call de l'application, en respectant :
+- un débit max (seau à jetons calé sur la limite d'appels/seconde Twilio) ;
+- un nombre max d'appels en cours ;
+- des reprises avec délai exponentiel si /make-call échoue (les appels occupés
+  ou sans réponse sont reprogrammés par l'application à la réception du statut) ;
+- la reprogrammation des appels dont le statut n'arrive jamais (webhook perdu,
+  redémarrage), au-delà de la durée max d'un appel et au démarrage du service.
+En parallèle, les appels à venir sont préparés (plans, prompts, cf. call_assets.py).
+
+    python call_manager.py                    # service
+    python call_manager.py --dry-run 500      # simulation contre un faux endpoint local
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from call_assets import create_preparer
+from schedule_store import ScheduleStore
+
+MAKE_CALL_URL = os.getenv("MAKE_CALL_URL", "https://b7c2-78-196-182-205.ngrok-free.app/make-call")
+DIALER_CPS = float(os.getenv("DIALER_CPS", "1"))  # limite Twilio par défaut : 1 appel/s par compte
+DIALER_MAX_LIVE_CALLS = int(os.getenv("DIALER_MAX_LIVE_CALLS", "20"))
+PREPARE_INTERVAL = float(os.getenv("PREPARE_INTERVAL", "900"))  # préparation des appels à venir (s)
+
+
+class TokenBucket:
+    """Seau à jetons : `rate` jetons par seconde, rafale max `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Dialer:
+    def __init__(self, store: ScheduleStore, endpoint: str = MAKE_CALL_URL, calls_per_second: float = DIALER_CPS,
+                 max_live_calls: int = DIALER_MAX_LIVE_CALLS, http_client: httpx.AsyncClient = None,
+                 http_retries: int = 3, retry_base_delay: float = 2.0, max_call_duration: float = 1800.0,
+                 catch_up: timedelta = timedelta(hours=1), lookahead: timedelta = timedelta(seconds=30),
+                 batch_size: int = 200, poll_interval: float = 5.0):
+        self.store = store
+        self.endpoint = endpoint
+        self.bucket = TokenBucket(calls_per_second, burst=max(1, int(calls_per_second)))
+        self.max_live_calls = max_live_calls
+        self.http = http_client or httpx.AsyncClient(
+            timeout=httpx.Timeout(15.0, connect=5.0),
+            limits=httpx.Limits(max_connections=max_live_calls, max_keepalive_connections=max_live_calls),
         )
-        print(f"Appel programmé le {call_time} au {row['number']}")
+        self.http_retries = http_retries
+        self.retry_base_delay = retry_base_delay
+        self.max_call_duration = max_call_duration
+        self.catch_up = catch_up
+        self.lookahead = lookahead
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._live = {}  # patient -> instant du déclenchement
+        self._tasks = set()
+        self.stats = {"dispatched": 0, "http_retries": 0, "failed": 0, "expired": 0, "max_live": 0}
+
+    async def recover(self):
+        """
+        Appels restés "dialing" (statut jamais reçu, redémarrage du service) :
+        reprogrammés s'ils ont dépassé la durée max d'un appel, suivis comme
+        appels en cours sinon.
+        """
+        dialing = await asyncio.to_thread(self.store.with_status, "dialing")
+        now, monotonic = datetime.now(), time.monotonic()
+        for patient, updated_at in dialing.items():
+            age = (now - updated_at).total_seconds()
+            if age > self.max_call_duration:
+                await self._expire(patient)
+            else:
+                self._live[patient] = monotonic - max(0.0, age)
+
+    async def _expire(self, patient: str):
+        status = await asyncio.to_thread(self.store.retry_later, patient, only_status="dialing")
+        if status is not None:
+            self.stats["expired"] += 1
+            logging.warning("Appel à %s sans statut final après %.0fs, reprogrammé (%s)", patient,
+                            self.max_call_duration, status)
+
+    async def run(self, stop_when_idle: bool = False):
+        """Boucle principale : prend les appels dus par lots, dans l'ordre chronologique."""
+        await self.recover()
+        while True:
+            now = datetime.now()
+            due = await asyncio.to_thread(
+                self.store.due_calls, now - self.catch_up, now + self.lookahead, limit=self.batch_size
+            )
+            for row in due:
+                await self._wait_until(datetime.fromisoformat(row["next_call_at"]))
+                await self._wait_for_live_slot()
+                await self.bucket.acquire()
+                # Marqué avant l'envoi pour ne pas être repris par le lot suivant
+                await asyncio.to_thread(self.store.set_status, row["patient"], "dialing")
+                self._live[row["patient"]] = time.monotonic()
+                self.stats["max_live"] = max(self.stats["max_live"], len(self._live))
+                task = asyncio.create_task(self._dispatch(row["patient"]))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            if not due:
+                if stop_when_idle and not self._tasks and not self._live:
+                    break
+                await self._refresh_live()
+                await asyncio.sleep(self.poll_interval)
+
+    async def _wait_until(self, when: datetime):
+        delay = (when - datetime.now()).total_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _wait_for_live_slot(self):
+        while len(self._live) >= self.max_live_calls:
+            await self._refresh_live()
+            if len(self._live) >= self.max_live_calls:
+                await asyncio.sleep(0.5)
+
+    async def _refresh_live(self):
+        """
+        Libère les appels terminés (statut mis à jour par l'application) ou trop
+        longs ; ces derniers, dont le statut n'arrivera plus, sont reprogrammés.
+        """
+        if not self._live:
+            return
+        statuses = await asyncio.to_thread(self.store.statuses, list(self._live))
+        now = time.monotonic()
+        for patient, started in list(self._live.items()):
+            if statuses.get(patient) != "dialing":
+                del self._live[patient]
+            elif now - started > self.max_call_duration:
+                del self._live[patient]
+                await self._expire(patient)
+
+    async def _dispatch(self, patient: str):
+        for attempt in range(self.http_retries):
+            try:
+                response = await self.http.post(self.endpoint, json={"target_phone": patient})
+                if response.status_code == 200:
+                    self.stats["dispatched"] += 1
+                    logging.info("Appel à %s lancé: %s", patient, response.json().get("call_sid"))
+                    return
+                logging.warning("Appel à %s - statut %s: %s", patient, response.status_code, response.text)
+                if response.status_code < 500 and response.status_code != 429:
+                    break  # erreur définitive, inutile de réessayer
+            except httpx.HTTPError as e:
+                logging.warning("Échec de l'appel à %s : %s", patient, e)
+            self.stats["http_retries"] += 1
+            await asyncio.sleep(self.retry_base_delay * 2 ** attempt)
+        self.stats["failed"] += 1
+        self._live.pop(patient, None)
+        await asyncio.to_thread(self.store.retry_later, patient)
+
+    async def close(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.http.aclose()
+
+
+async def dry_run(n_calls: int, calls_per_second: float, max_live_calls: int, call_duration: float,
+                  endpoint_latency: float):
+    """
+    Simulation complète contre un faux endpoint /make-call en mémoire : chaque
+    appel « dure » `call_duration` secondes puis passe au statut terminé.
+    Affiche le débit réellement obtenu.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ScheduleStore(os.path.join(tmp, "dry_run.db"))
+        now = datetime.now()
+        for i in range(n_calls):
+            store.upsert(f"+3360000{i:04d}", now)
+        loop = asyncio.get_running_loop()
+
+        async def fake_make_call(request: httpx.Request) -> httpx.Response:
+            patient = json.loads(request.content)["target_phone"]
+            await asyncio.sleep(endpoint_latency)
+            loop.call_later(call_duration, store.set_status, patient, "done")
+            return httpx.Response(200, json={"message": "Appel lancé", "call_sid": f"CAdry{patient}"})
+
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(fake_make_call))
+        dialer = Dialer(store, endpoint="http://fake/make-call", calls_per_second=calls_per_second,
+                        max_live_calls=max_live_calls, http_client=http_client, poll_interval=0.2)
+        start = time.perf_counter()
+        await dialer.run(stop_when_idle=True)
+        elapsed = time.perf_counter() - start
+        await dialer.close()
+        store.close()
+    print(f"{dialer.stats['dispatched']} appels en {elapsed:.2f}s "
+          f"({dialer.stats['dispatched'] / elapsed:.2f} appels/s, cible {calls_per_second}/s), "
+          f"appels simultanés max: {dialer.stats['max_live']}, échecs: {dialer.stats['failed']}")
+
+
+async def start_scheduled_calls():
+    store = ScheduleStore(os.getenv("SCHEDULE_DB_PATH", "call_schedule.db"))
+    dialer = Dialer(store)
+    # Plans et prompts des appels à venir générés en avance : aucun travail LLM à l'établissement de l'appel
+    prepare_task = asyncio.create_task(create_preparer(store).run_forever(PREPARE_INTERVAL))
+    try:
+        await dialer.run()
+    finally:
+        prepare_task.cancel()
+        await dialer.close()
 
-    scheduler.start()
 
 if __name__ == "__main__":
-    start_scheduled_calls()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Service de numérotation sortante")
+    parser.add_argument("--dry-run", type=int, metavar="N", help="simule N appels contre un faux endpoint")
+    parser.add_argument("--cps", type=float, default=DIALER_CPS, help="appels par seconde")
+    parser.add_argument("--max-live", type=int, default=DIALER_MAX_LIVE_CALLS, help="appels simultanés max")
+    parser.add_argument("--call-duration", type=float, default=2.0, help="durée simulée d'un appel (dry-run)")
+    parser.add_argument("--endpoint-latency", type=float, default=0.05, help="latence simulée de /make-call")
+    args = parser.parse_args()
+    if args.dry_run:
+        logging.getLogger().setLevel(logging.WARNING)
+        asyncio.run(dry_run(args.dry_run, args.cps, args.max_live, args.call_duration, args.endpoint_latency))
+    else:
+        asyncio.run(start_scheduled_calls())
@@ -0,0 +1,230 @@
+"""
+Enregistrement des connexions /media-stream pour les rejouer hors ligne
+(benchmarks/replay_calls.py) : trames Twilio entrantes, résultats STT et
+timings des tours, dans un fichier binaire compact par connexion.
+
+Format (petit-boutiste) :
+
+    en-tête      "PRC1", version (u16), début de l'enregistrement (f64, epoch)
+    événements   type (u8), secondes depuis le début (f64), longueur (u32), données
+    index        une entrée par événement : position (u64), secondes (f64), type (u8)
+    fin          position de l'index (u64), nombre d'entrées (u32), "PRCI"
+
+Les trames `media` sont stockées en μ-law brut (160 octets pour 20 ms), sans
+base64 ni JSON ; `start`, `mark` et `stop` gardent le message Twilio. L'index
+final permet de lire un enregistrement par mmap (`CallRecording`) sans le
+charger : recherche par instant (dichotomie) ou par type d'événement. Un
+fichier sans index (processus interrompu) est relu séquentiellement.
+
+L'enregistreur ne fait aucune entrée/sortie sur la boucle d'événements : les
+événements sont accumulés en mémoire et écrits par blocs depuis un thread.
+"""
+import binascii
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MAGIC = b"PRC1"
+INDEX_MAGIC = b"PRCI"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sHd")
+EVENT_HEADER = struct.Struct("<BdI")
+INDEX_ENTRY = struct.Struct("<QdB")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("t", "<f8"), ("kind", "u1")])
+TRAILER = struct.Struct("<QI4s")
+
+# Types d'événements
+START, MEDIA, MARK, STOP, STT_PARTIAL, STT_FINAL, TURN = range(1, 8)
+KIND_NAMES = {START: "start", MEDIA: "media", MARK: "mark", STOP: "stop", STT_PARTIAL: "stt_partial",
+              STT_FINAL: "stt_final", TURN: "turn"}
+TWILIO_EVENTS = {"start": START, "mark": MARK, "stop": STOP}
+
+# Un seul thread d'écriture pour tous les enregistrements : les blocs d'un fichier restent dans l'ordre
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recorder")
+
+
+def _append(path: str, data: bytes):
+    try:
+        with open(path, "ab") as f:
+            f.write(data)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(data)
+
+
+class CallRecorder:
+    """
+    Enregistrement d'une connexion /media-stream. Les méthodes sont appelées
+    depuis la boucle d'événements, sauf les callbacks STT enveloppés par
+    `wrap_stt` (threads du SDK) : un verrou protège le tampon.
+    """
+
+    def __init__(self, path: str, flush_bytes: int = 64 * 1024):
+        self.path = os.path.abspath(path)
+        self.flush_bytes = flush_bytes
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._buffer = bytearray(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self._index = bytearray()
+        self._written = 0  # octets déjà confiés au thread d'écriture
+        self._events = 0
+        self.closed = False
+
+    def _add(self, kind: int, data: bytes):
+        with self._lock:
+            if self.closed:
+                return
+            # Instant pris sous le verrou : l'index reste trié même avec les threads STT
+            t = time.monotonic() - self._start
+            self._index += INDEX_ENTRY.pack(self._written + len(self._buffer), t, kind)
+            self._buffer += EVENT_HEADER.pack(kind, t, len(data))
+            self._buffer += data
+            self._events += 1
+            if len(self._buffer) >= self.flush_bytes:
+                self._flush()
+
+    def _flush(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._written += len(data)
+        _executor.submit(_append, self.path, data)
+
+    def twilio_event(self, event: str, data: str):
+        """Message Twilio `start`, `mark` ou `stop`, tel que reçu."""
+        kind = TWILIO_EVENTS.get(event)
+        if kind is not None:
+            self._add(kind, data.encode("utf-8"))
+
+    def media(self, payload: str):
+        """Trame `media` : la charge utile base64 est stockée décodée (μ-law)."""
+        self._add(MEDIA, binascii.a2b_base64(payload))
+
+    def wrap_stt(self, kind: int, handler):
+        """Callback STT qui enregistre le texte reçu avant de le transmettre à `handler`."""
+        def on_text(text: str):
+            self._add(kind, text.encode("utf-8"))
+            handler(text)
+        return on_text
+
+    def turn(self, trace, question: str):
+        """Timings d'un tour (`metrics.TurnTrace`, horodatages monotones) et texte envoyé au LLM."""
+        record = {
+            "index": trace.index,
+            "question": question,
+            "marks": {name: round(timestamp - self._start, 6) for name, timestamp in trace.marks.items()},
+            "attributes": trace.attributes,
+        }
+        self._add(TURN, json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+    def close(self):
+        """Ajoute l'index et termine le fichier (écriture en tâche de fond)."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            index_offset = self._written + len(self._buffer)
+            self._buffer += self._index
+            self._buffer += TRAILER.pack(index_offset, self._events, INDEX_MAGIC)
+            self._flush()
+        logging.info("Connexion enregistrée dans %s (%d événements)", self.path, self._events)
+
+
+class CallRecording:
+    """
+    Lecture d'un enregistrement par mmap : seuls l'index (tableau numpy sur le
+    fichier, sans copie) et les événements demandés sont lus.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.started_at = FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version > VERSION:
+            self.close()
+            raise ValueError(f"{path} n'est pas un enregistrement d'appel lisible")
+        self.indexed = False
+        self.index = self._read_index()
+
+    def _read_index(self) -> np.ndarray:
+        size = len(self._mm)
+        if size >= FILE_HEADER.size + TRAILER.size:
+            index_offset, count, magic = TRAILER.unpack_from(self._mm, size - TRAILER.size)
+            if magic == INDEX_MAGIC and index_offset + count * INDEX_DTYPE.itemsize == size - TRAILER.size:
+                self.indexed = True
+                return np.frombuffer(self._mm, dtype=INDEX_DTYPE, count=count, offset=index_offset)
+        # Enregistrement interrompu : index reconstruit en parcourant les événements complets
+        entries = []
+        offset = FILE_HEADER.size
+        while offset + EVENT_HEADER.size <= size:
+            kind, t, length = EVENT_HEADER.unpack_from(self._mm, offset)
+            if offset + EVENT_HEADER.size + length > size or kind not in KIND_NAMES:
+                break
+            entries.append((offset, t, kind))
+            offset += EVENT_HEADER.size + length
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Le tableau de l'index référence le mmap : il est libéré d'abord
+        self.index = None
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # vues encore utilisées (`event`) : le mmap sera fermé avec elles
+        self._file.close()
+
+    @property
+    def duration(self) -> float:
+        return float(self.index["t"][-1]) if len(self.index) else 0.0
+
+    def event(self, position: int) -> tuple:
+        """(type, secondes, données) du `position`-ième événement ; les données sont une vue sur le fichier."""
+        offset = int(self.index["offset"][position])
+        kind, t, length = EVENT_HEADER.unpack_from(self._mm, offset)
+        start = offset + EVENT_HEADER.size
+        return kind, t, memoryview(self._mm)[start:start + length]
+
+    def events(self, kinds=None, start: float = None, end: float = None):
+        """Événements (type, secondes, données) entre `start` et `end`, des types demandés."""
+        times = self.index["t"]
+        first = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        last = len(times) if end is None else int(np.searchsorted(times, end, side="right"))
+        positions = np.arange(first, last)
+        if kinds is not None:
+            positions = positions[np.isin(self.index["kind"][first:last], list(kinds))]
+        for position in positions:
+            yield self.event(int(position))
+
+    def counts(self) -> dict:
+        kinds, counts = np.unique(self.index["kind"], return_counts=True)
+        return {KIND_NAMES[int(kind)]: int(count) for kind, count in zip(kinds, counts)}
+
+    def start_message(self) -> dict:
+        for _, _, data in self.events((START,)):
+            return json.loads(bytes(data))
+        return {}
+
+    def stt_results(self) -> list:
+        """[(secondes, final, texte)] : résultats STT reçus pendant la connexion."""
+        return [(t, kind == STT_FINAL, bytes(data).decode("utf-8"))
+                for kind, t, data in self.events((STT_PARTIAL, STT_FINAL))]
+
+    def turns(self) -> list:
+        return [json.loads(bytes(data)) for _, _, data in self.events((TURN,))]
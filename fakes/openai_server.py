@@ -0,0 +1,208 @@
+"""
+Faux serveur compatible OpenAI (DeepInfra) pour les tests et benchmarks hors
+ligne : délai avant le premier token (TTFT) et débit (tokens/s) réglables,
+éventuellement par modèle, et blocages aléatoires avant le premier token.
+
+    python -m fakes.openai_server --port 8911 --ttft 0.35 --tokens-per-second 60
+    python -m fakes.openai_server --profile 8B=0.25:90 --profile 70B=0.6:35 --stall-rate 0.1
+
+L'application s'y branche avec `deepinfra_base_url=http://127.0.0.1:8911/v1`.
+"""
+import argparse
+import asyncio
+import difflib
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+REPLY = ("Très bien <PATIENT_NAME>, merci pour votre réponse. Avez-vous bien dormi cette nuit ? "
+         "Je note tout cela pour votre médecin.")
+SUMMARY = {
+    "patient_name": "<PATIENT_NAME>",
+    "age": "<AGE>",
+    "conditions": "Mange bien, a bien dormi cette nuit, pas de douleur signalée.",
+    "next_appointment_datetime": "None",
+    "conversation_summary": "Appel de suivi sans difficulté. Le patient va bien, il a parlé de son jardin et de "
+                            "ses petits-enfants, et un prochain rendez-vous a été convenu.",
+    "additional_notes": "Aucune",
+}
+# Extraction incrémentale (cf. DeepInfraLLM._summary_update_messages)
+SUMMARY_UPDATE = {
+    "sleep": "A bien dormi",
+    "interests": ["jardinage"],
+    "key_points": ["Le patient va bien et a bien dormi."],
+}
+
+PLAN = {
+    "steps": [
+        "Saluer <PATIENT_NAME> et vérifier son identité",
+        "Fixer la date et l'heure du prochain rendez-vous",
+        "Demander des nouvelles de son appétit",
+        "Parler de son jardin",
+        "Au revoir",
+    ]
+}
+
+
+def parse_profile(value: str) -> tuple:
+    """"8B=0.25:90" -> ("8B", 0.25, 90.0) : modèles contenant "8B", TTFT 0,25 s, 90 tokens/s."""
+    name, _, latency = value.partition("=")
+    ttft, _, tokens_per_second = latency.partition(":")
+    return name, float(ttft), float(tokens_per_second)
+
+
+def _normalize(text: str) -> str:
+    return " ".join("".join(c if c.isalnum() else " " for c in text.lower()).split())
+
+
+def create_app(ttft: float = 0.3, tokens_per_second: float = 50.0, jitter: float = 0.1,
+               malformed: float = 0.0, profiles: dict = None, stall_rate: float = 0.0,
+               stall_seconds: float = 3.0, timings: dict = None) -> FastAPI:
+    """
+    `ttft` : délai (s) avant le premier token ; `tokens_per_second` : débit de la
+    génération ; `jitter` : variation relative aléatoire de ces deux valeurs ;
+    `malformed` : part des réponses JSON entourées de texte ou avec une virgule finale ;
+    `profiles` : {fragment du nom de modèle: (ttft, tokens_per_second)}, prioritaire
+    sur les valeurs par défaut ; `stall_rate` : part des requêtes bloquées
+    `stall_seconds` secondes de plus avant le premier token (file d'attente du fournisseur) ;
+    `timings` : {propos du patient: (ttft, tokens_per_second)} mesurés sur des appels
+    enregistrés, appliqués au tour dont la question est la plus proche (rejeu).
+    """
+    app = FastAPI()
+    app.state.stats = {"requests": 0, "streams": 0, "active": 0, "max_active": 0, "stalls": 0, "by_model": {}}
+
+    recorded = {_normalize(question): latency for question, latency in (timings or {}).items()}
+
+    def recorded_latency(body: dict):
+        # Question du tour : fin du dernier message (cf. DeepInfraLLM.turn_prompt_template)
+        messages = body.get("messages") or [{}]
+        question = _normalize(str(messages[-1].get("content", "")).rsplit("Ce que dit l'utilisateur :", 1)[-1])
+        if question in recorded:
+            return recorded[question]
+        # Données anonymisées (<PATIENT_NAME>) ou partiel d'une génération spéculative
+        match = difflib.get_close_matches(question, list(recorded), n=1, cutoff=0.6)
+        return recorded[match[0]] if match else None
+
+    def latency_for(model: str) -> tuple:
+        for fragment, latency in (profiles or {}).items():
+            if fragment in model:
+                return latency
+        return ttft, tokens_per_second
+
+    def first_token_delay(model_ttft: float) -> float:
+        delay = vary(model_ttft)
+        if stall_rate and random.random() < stall_rate:
+            app.state.stats["stalls"] += 1
+            delay += stall_seconds
+        return delay
+
+    def vary(value: float) -> float:
+        return value * random.uniform(1 - jitter, 1 + jitter) if jitter else value
+
+    def json_reply(data: dict) -> str:
+        text = json.dumps(data, ensure_ascii=False)
+        if malformed and random.random() < malformed:
+            if random.random() < 0.5:
+                return f"Voici le JSON demandé :\n```json\n{text}\n```"
+            return text[:-1] + ",}"
+        return text
+
+    def reply_for(body: dict) -> str:
+        # Demandes de plan ou de résumé (cf. DeepInfraLLM._summary_messages) : réponse JSON
+        messages = body.get("messages", [])
+        prompt = str(messages[1].get("content", "")) if len(messages) > 1 else ""
+        if "plan de conversation" in prompt:
+            return json_reply(PLAN)
+        if "Nouveaux échanges" in prompt:
+            update = dict(SUMMARY_UPDATE)
+            if "rendez-vous" in prompt.split("Nouveaux échanges", 1)[1]:
+                tomorrow = (datetime.now() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+                update["next_appointment_datetime"] = tomorrow.isoformat()
+            return json_reply(update)
+        if body.get("response_format") or "JSON" in prompt:
+            return json_reply(SUMMARY)
+        return REPLY
+
+    def chunk(model: str, content: str = None, finish_reason: str = None) -> str:
+        delta = {"content": content} if content is not None else {}
+        data = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake", "object": "model"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        text = reply_for(body)
+        # Un « token » par mot, espace compris
+        tokens = [word + " " for word in text.split(" ")]
+        stats = app.state.stats
+        stats["requests"] += 1
+        stats["by_model"][model] = stats["by_model"].get(model, 0) + 1
+        model_ttft, model_tokens_per_second = (recorded and recorded_latency(body)) or latency_for(model)
+        delay_per_token = 1.0 / vary(model_tokens_per_second)
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token_delay(model_ttft) + delay_per_token * len(tokens))
+            return {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            }
+
+        async def generate():
+            stats["streams"] += 1
+            stats["active"] += 1
+            stats["max_active"] = max(stats["max_active"], stats["active"])
+            try:
+                await asyncio.sleep(first_token_delay(model_ttft))
+                for token in tokens:
+                    yield chunk(model, token)
+                    await asyncio.sleep(delay_per_token)
+                yield chunk(model, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+            finally:
+                stats["active"] -= 1
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Faux serveur OpenAI à latence réglable")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--ttft", type=float, default=0.3, help="délai avant le premier token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--jitter", type=float, default=0.1, help="variation relative aléatoire")
+    parser.add_argument("--malformed", type=float, default=0.0, help="part des réponses JSON mal formées")
+    parser.add_argument("--profile", action="append", default=[], type=parse_profile,
+                        help="latence d'un modèle: FRAGMENT=TTFT:TOKENS_PAR_SECONDE (répétable)")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="part des requêtes bloquées avant le 1er token")
+    parser.add_argument("--stall-seconds", type=float, default=3.0, help="durée d'un blocage (s)")
+    parser.add_argument("--timings", help="JSON {question: [ttft, tokens_par_seconde]} des appels rejoués")
+    args = parser.parse_args()
+    profiles = {name: (ttft, tokens_per_second) for name, ttft, tokens_per_second in args.profile}
+    timings = None
+    if args.timings:
+        with open(args.timings, "r", encoding="utf-8") as f:
+            timings = json.load(f)
+    uvicorn.run(create_app(args.ttft, args.tokens_per_second, args.jitter, args.malformed, profiles,
+                           args.stall_rate, args.stall_seconds, timings),
+                host=args.host, port=args.port, log_level="warning")
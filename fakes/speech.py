@@ -0,0 +1,239 @@
+"""
+Substitut local du recognizer Azure Speech pour les tests et benchmarks hors
+ligne. Il expose le sous-ensemble de `speechsdk.SpeechRecognizer` et de
+`PushAudioInputStream` utilisé par `STT.engine.STTSession` ; `ScriptedSTTEngine`
+en fait un moteur STT de l'application.
+
+Le recognizer « écoute » réellement le PCM écrit dans le push stream : un segment
+de parole est détecté par l'énergie des trames, des partiels sont émis pendant
+la parole, puis le résultat final après `segmentation_silence_ms` de silence et
+un délai de traitement configurable. Les textes viennent d'un script. Comme avec
+le SDK, les callbacks sont appelés depuis un autre thread que celui qui écrit.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from STT.engine import STTEngine, STTSession
+
+SAMPLE_RATE = 8000
+SPEECH_THRESHOLD_DB = -40.0
+DEFAULT_SCRIPT = [
+    "Oui c'est bien moi",
+    "Le prochain rendez-vous mardi à dix heures me convient",
+    "Oui je mange bien merci",
+    "J'ai plutôt bien dormi cette nuit",
+    "J'aime beaucoup le jardinage",
+]
+
+
+class _EventScheduler:
+    """Un seul thread pour les callbacks différés de tous les recognizers simulés."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="fake-speech-events", daemon=True).start()
+
+    def call_later(self, delay: float, callback, *args):
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), callback, args))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error("Erreur dans un callback STT simulé: %s", e)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _get_scheduler() -> _EventScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = _EventScheduler()
+        return _scheduler
+
+
+class _Signal:
+    def __init__(self):
+        self._handlers = []
+
+    def connect(self, handler):
+        self._handlers.append(handler)
+
+    def emit(self, text: str):
+        evt = SimpleNamespace(result=SimpleNamespace(text=text))
+        for handler in self._handlers:
+            handler(evt)
+
+
+class FakePushStream:
+    def __init__(self, recognizer: "FakeSpeechRecognizer"):
+        self._recognizer = recognizer
+        self.bytes_written = 0
+        self.writes = 0
+        self.closed = False
+
+    def write(self, pcm_data: bytes):
+        self.bytes_written += len(pcm_data)
+        self.writes += 1
+        self._recognizer._feed(pcm_data)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSpeechRecognizer:
+    """
+    Recognizer scripté : le i-ème segment de parole détecté est transcrit par
+    `script[i % len(script)]`.
+    """
+
+    def __init__(self, script: list, final_delay: float = 0.3, partial_delay: float = 0.15,
+                 partial_interval_ms: int = 300, segmentation_silence_ms: int = 400, start_delay: float = 0.0):
+        self.script = script
+        self.start_delay = start_delay  # durée de la connexion au service au démarrage, comme le SDK
+        self.final_delay = final_delay
+        self.partial_delay = partial_delay
+        self.partial_interval_ms = partial_interval_ms
+        self.segmentation_silence_ms = segmentation_silence_ms
+        self.recognizing = _Signal()
+        self.recognized = _Signal()
+        self.canceled = _Signal()
+        self.push_stream = FakePushStream(self)
+        self._running = False
+        self._segment = 0
+        self._speech_ms = 0
+        self._silence_ms = 0
+        self._last_partial_ms = 0
+
+    def start_continuous_recognition(self):
+        if self.start_delay:
+            time.sleep(self.start_delay)
+        self._running = True
+
+    def start_continuous_recognition_async(self):
+        _get_scheduler().call_later(self.start_delay, self.__setattr__, "_running", True)
+        return SimpleNamespace(get=lambda: None)
+
+    def stop_continuous_recognition(self):
+        self._running = False
+
+    def _feed(self, pcm_data: bytes):
+        samples = np.frombuffer(pcm_data, dtype=np.int16).astype(np.float32)
+        if not len(samples):
+            return
+        duration_ms = len(samples) * 1000 // SAMPLE_RATE
+        energy_db = 20.0 * np.log10(np.sqrt(np.mean(samples * samples)) / 32768.0 + 1e-9)
+        if energy_db > SPEECH_THRESHOLD_DB:
+            self._speech_ms += duration_ms
+            self._silence_ms = 0
+            if self._speech_ms - self._last_partial_ms >= self.partial_interval_ms:
+                self._last_partial_ms = self._speech_ms
+                self._schedule(self.partial_delay, self.recognizing, self._partial_text())
+        elif self._speech_ms:
+            self._silence_ms += duration_ms
+            if self._silence_ms >= self.segmentation_silence_ms:
+                self._schedule(self.final_delay, self.recognized, self.script[self._segment % len(self.script)])
+                self._segment += 1
+                self._speech_ms = self._silence_ms = self._last_partial_ms = 0
+
+    def _partial_text(self) -> str:
+        # Les partiels grandissent avec la durée de parole, comme ceux d'Azure
+        words = self.script[self._segment % len(self.script)].split()
+        return " ".join(words[:max(1, self._speech_ms // 250)])
+
+    def _schedule(self, delay: float, signal: _Signal, text: str):
+        def emit():
+            if self._running:
+                signal.emit(text)
+        _get_scheduler().call_later(delay, emit)
+
+
+class ReplayedSpeechRecognizer(FakeSpeechRecognizer):
+    """
+    Recognizer qui n'écoute pas l'audio : il émet des résultats enregistrés
+    (partiels et finals) à leurs instants, comptés depuis `play`.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__([""], **kwargs)
+
+    def _feed(self, pcm_data: bytes):
+        pass
+
+    def play(self, results: list, speed: float = 1.0):
+        """`results` : [(secondes, final, texte)] ; `speed` > 1 accélère le rejeu."""
+        for seconds, final, text in results:
+            self._schedule(max(0.0, seconds) / speed, self.recognized if final else self.recognizing, text)
+
+
+class _ReplayedSTTSession(STTSession):
+    def __init__(self, engine: "ReplayedSTTEngine"):
+        recognizer = ReplayedSpeechRecognizer()
+        super().__init__(recognizer, recognizer.push_stream)
+        self.engine = engine
+        self.played = False
+
+    def bind(self, on_recognized=None, on_recognizing=None):
+        super().bind(on_recognized, on_recognizing)
+        # Première connexion de l'appel : les résultats partent de l'attribution de la session
+        results = self.engine.scripts.get(self.call_sid)
+        if on_recognized and results and not self.played:
+            self.played = True
+            self.recognizer.play(results, self.engine.speed)
+
+
+class ReplayedSTTEngine(STTEngine):
+    """
+    Moteur STT du rejeu d'appels enregistrés (call_recording.py) : chaque
+    session rejoue les résultats STT de l'appel auquel le pool l'attribue.
+    `scripts` : {call_sid: [(secondes depuis l'événement start, final, texte)]}.
+    """
+
+    name = "replayed"
+
+    def __init__(self, scripts: dict = None, speed: float = 1.0):
+        self.scripts = scripts if scripts is not None else {}
+        self.speed = speed
+
+    def create_session(self) -> STTSession:
+        return _ReplayedSTTSession(self)
+
+
+class ScriptedSTTEngine(STTEngine):
+    """
+    Moteur STT hors ligne (STT_BACKEND=scripted) : sessions sur des
+    FakeSpeechRecognizer. `create_cost` simule le coût de construction d'un
+    recognizer du SDK (s, bloquant).
+    """
+
+    name = "scripted"
+
+    def __init__(self, script: list = None, create_cost: float = 0.0, **kwargs):
+        self.script = script or DEFAULT_SCRIPT
+        self.create_cost = create_cost
+        self.kwargs = kwargs
+
+    def create_session(self) -> STTSession:
+        if self.create_cost:
+            time.sleep(self.create_cost)
+        recognizer = FakeSpeechRecognizer(self.script, **self.kwargs)
+        return STTSession(recognizer, recognizer.push_stream)
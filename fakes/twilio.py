@@ -0,0 +1,84 @@
+"""
+Substitut local de l'API REST Twilio et de ses webhooks de statut, pour les tests
+et benchmarks hors ligne. Il expose le sous-ensemble du client `twilio.rest.Client`
+utilisé par l'application.
+"""
+import itertools
+import time
+
+import httpx
+
+_sid_counter = itertools.count(1)
+
+
+class FakeCall:
+    def __init__(self, sid: str, to: str, url: str, status_callback: str = None):
+        self.sid = sid
+        self.to = to
+        self.url = url
+        self.status_callback = status_callback
+        self.status = "queued"
+        self.twiml_updates = []
+        self.created_at = time.time()
+
+
+class _CallContext:
+    def __init__(self, client: "FakeTwilioClient", sid: str):
+        self._client = client
+        self._sid = sid
+
+    def update(self, twiml: str = None, **kwargs):
+        self._client.wait()
+        call = self._client.calls_by_sid[self._sid]
+        call.twiml_updates.append(twiml)
+        self._client.requests.append(("update", self._sid))
+        return call
+
+    def fetch(self):
+        self._client.requests.append(("fetch", self._sid))
+        return self._client.calls_by_sid[self._sid]
+
+
+class _CallList:
+    def __init__(self, client: "FakeTwilioClient"):
+        self._client = client
+
+    def __call__(self, sid: str) -> _CallContext:
+        return _CallContext(self._client, sid)
+
+    def create(self, to: str, from_: str = None, url: str = None, status_callback: str = None, **kwargs) -> FakeCall:
+        self._client.wait()
+        sid = f"CAfake{next(_sid_counter):026d}"
+        call = FakeCall(sid, to, url, status_callback)
+        self._client.calls_by_sid[sid] = call
+        self._client.requests.append(("create", sid))
+        return call
+
+
+class FakeTwilioClient:
+    """
+    Enregistre les appels créés et les requêtes REST reçues. `latency` simule
+    la durée (bloquante, comme le client `twilio` synchrone) d'une requête REST.
+    """
+
+    def __init__(self, *args, latency: float = 0.0, **kwargs):
+        self.latency = latency
+        self.calls_by_sid = {}
+        self.requests = []
+        self.calls = _CallList(self)
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+async def post_status_callback(http_client: httpx.AsyncClient, url: str, call_sid: str, status: str = "completed",
+                               duration: int = 60) -> httpx.Response:
+    """Envoie un webhook de statut au format Twilio (formulaire urlencodé)."""
+    data = {
+        "CallSid": call_sid,
+        "CallStatus": status,
+        "CallDuration": str(duration),
+        "Timestamp": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime()),
+    }
+    return await http_client.post(url, data=data)
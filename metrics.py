@@ -0,0 +1,403 @@
+"""
+Instrumentation de l'application : métriques au format texte Prometheus et
+traces de latence par tour et par appel.
+
+Les métriques sont de simples objets en mémoire (compteurs, jauges,
+histogrammes avec labels) rendus par `registry.render()` sur `/metrics`. Chaque
+tour de conversation produit une `TurnTrace` (horodatages monotones de chaque
+étape) ; les tours d'un appel sont regroupés dans une `CallTrace`, écrite en
+JSON Lines à la fin de l'appel.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+# Secondes : du traitement d'une trame à la génération complète d'une réponse
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()  # incrémentés aussi depuis les threads du SDK Azure
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Jauge ; `function` permet de lire la valeur au moment du rendu (profondeur de file...)."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self._values = {} if self.labelnames else {(): 0}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        if self.function is not None:
+            return self.function()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list:
+        lines = self.header()
+        if self.function is not None:
+            lines.append(f"{self.name} {_format_value(self.function())}")
+            return lines
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # labels -> [compteurs par seau, somme, nombre]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrique déjà enregistrée: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = (), function=None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Exposition au format texte Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Métriques de l'application ---
+ACTIVE_CALLS = registry.gauge("presage_active_calls", "Flux média en cours")
+ACTIVE_RECOGNIZERS = registry.gauge("presage_active_recognizers", "Recognizers STT utilisés par une connexion")
+TURNS = registry.counter("presage_turns_total", "Tours de conversation traités", ("mode",))
+TURN_STAGE_SECONDS = registry.histogram(
+    "presage_turn_stage_seconds", "Durée de chaque étape d'un tour (voir TURN_STAGES)", ("stage",)
+)
+LLM_REQUESTS = registry.counter("presage_llm_requests_total", "Requêtes LLM", ("operation",))
+LLM_ERRORS = registry.counter("presage_llm_errors_total", "Requêtes LLM en erreur", ("operation",))
+TWILIO_REQUESTS = registry.counter("presage_twilio_requests_total", "Requêtes REST Twilio", ("operation",))
+TWILIO_ERRORS = registry.counter("presage_twilio_errors_total", "Requêtes REST Twilio en erreur", ("operation",))
+RESPONSE_CACHE_LOOKUPS = registry.counter(
+    "presage_response_cache_lookups_total", "Recherches dans le cache de réponses", ("result",)
+)
+STT_SETUP_SECONDS = registry.histogram(
+    "presage_stt_setup_seconds", "Obtention d'un recognizer par connexion (parked, pool, new)", ("source",)
+)
+TTS_CACHE_LOOKUPS = registry.counter(
+    "presage_tts_cache_lookups_total", "Recherches dans le cache audio TTS (hit, miss, bypass)", ("result",)
+)
+SUMMARY_EXTRACTIONS = registry.counter(
+    "presage_summary_extractions_total", "Extractions incrémentales du résumé (complete, repaired, partial, failed)",
+    ("result",),
+)
+SUMMARY_SECONDS = registry.histogram(
+    "presage_summary_seconds", "Durée du résumé après la fin de l'appel", ("mode",)
+)
+BARGE_INS = registry.counter(
+    "presage_barge_ins_total", "Réponses interrompues par le patient (generating, playing)", ("phase",)
+)
+STALE_ANSWER_TOKENS = registry.counter(
+    "presage_stale_answer_tokens_total", "Tokens LLM générés pour des réponses interrompues"
+)
+STALE_ANSWER_AUDIO_SECONDS = registry.counter(
+    "presage_stale_answer_audio_seconds_total", "Audio synthétisé pour des réponses interrompues (s)"
+)
+SPECULATION_STARTED = registry.counter(
+    "presage_speculation_started_total", "Générations spéculatives lancées sur un transcript partiel"
+)
+SPECULATION_HITS = registry.counter(
+    "presage_speculation_hits_total", "Générations spéculatives validées par le transcript final"
+)
+SPECULATION_MISSES = registry.counter(
+    "presage_speculation_misses_total", "Générations spéculatives rejetées par le transcript final"
+)
+SPECULATION_WASTED_TOKENS = registry.counter(
+    "presage_speculation_wasted_tokens_total", "Tokens LLM générés pour des spéculations abandonnées"
+)
+# Compteurs de SpeculativeResponder.metrics
+SPECULATION_COUNTERS = {"started": SPECULATION_STARTED, "hits": SPECULATION_HITS, "misses": SPECULATION_MISSES,
+                        "wasted_tokens": SPECULATION_WASTED_TOKENS}
+LLM_ROUTED = registry.counter(
+    "presage_llm_routed_total", "Tours envoyés à chaque modèle par le routeur, par motif", ("model", "reason")
+)
+LLM_HEDGES = registry.counter(
+    "presage_llm_hedges_total", "Requêtes doublées vers l'autre modèle, par flux retenu (primary, hedge, failed)",
+    ("result",),
+)
+LLM_TTFT_ESTIMATE = registry.gauge(
+    "presage_llm_ttft_estimate_seconds", "Estimation glissante du délai avant le premier token", ("model",)
+)
+LLM_TOKENS_PER_SECOND_ESTIMATE = registry.gauge(
+    "presage_llm_tokens_per_second_estimate", "Estimation glissante du débit de génération", ("model",)
+)
+ARCHIVE_RECORDS = registry.counter(
+    "presage_archive_records_total", "Tours et appels écrits dans l'archive"
+)
+ARCHIVE_BATCH_SECONDS = registry.histogram(
+    "presage_archive_batch_seconds", "Écriture d'un lot dans l'archive (compression, segment, fsync, index)"
+)
+WARMUP_STEP_SECONDS = registry.gauge(
+    "presage_warmup_step_seconds", "Durée des étapes de préchauffage au démarrage", ("step",)
+)
+EVENT_LOOP_LAG = registry.histogram(
+    "presage_event_loop_lag_seconds", "Retard de la boucle d'événements",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+# --- Traces par tour ---
+# Étapes d'un tour, dans l'ordre du pipeline
+MARKS = ("last_audio", "stt_final", "endpoint", "llm_request", "first_token", "last_token", "tts_dispatch",
+         "playback_start")
+# Étapes mesurées : nom -> (début, fin)
+TURN_STAGES = {
+    "stt_final": ("last_audio", "stt_final"),
+    "endpoint": ("last_audio", "endpoint"),
+    "llm_ttft": ("llm_request", "first_token"),
+    "llm_total": ("llm_request", "last_token"),
+    "tts": ("tts_dispatch", "playback_start"),
+    "response": ("endpoint", "playback_start"),
+    "turn": ("last_audio", "playback_start"),
+}
+# Arbre des spans d'un tour : (nom, début, fin, enfants)
+SPAN_TREE = ("turn", "last_audio", "playback_start", (
+    ("stt", "last_audio", "stt_final", ()),
+    ("endpoint", "last_audio", "endpoint", ()),
+    ("llm", "llm_request", "last_token", (
+        ("first_token", "llm_request", "first_token", ()),
+    )),
+    ("tts", "tts_dispatch", "playback_start", ()),
+))
+
+
+class TurnTrace:
+    """Horodatages (time.monotonic) des étapes d'un tour ; une étape n'est marquée qu'une fois."""
+
+    __slots__ = ("index", "marks", "attributes")
+
+    def __init__(self, index: int = 0):
+        self.index = index
+        self.marks = {}
+        self.attributes = {}
+
+    def mark(self, name: str, timestamp: float = None):
+        if name not in self.marks:
+            self.marks[name] = time.monotonic() if timestamp is None else timestamp
+
+    def duration(self, start: str, end: str):
+        if start in self.marks and end in self.marks:
+            return self.marks[end] - self.marks[start]
+        return None
+
+    async def wrap_stream(self, deltas):
+        """Relaie un flux de deltas LLM en marquant le premier et le dernier token, et les compte."""
+        self.attributes.setdefault("tokens", 0)
+        async for delta in deltas:
+            self.mark("first_token")
+            self.attributes["tokens"] += 1
+            yield delta
+        self.mark("last_token")
+
+    def observe(self):
+        """Alimente les histogrammes d'étapes avec les durées disponibles."""
+        for stage, (start, end) in TURN_STAGES.items():
+            duration = self.duration(start, end)
+            if duration is not None and duration >= 0:
+                TURN_STAGE_SECONDS.observe(duration, stage=stage)
+
+    def _span(self, node, origin: float) -> dict:
+        name, start, end, children = node
+        if start not in self.marks:
+            return None
+        span = {"name": name, "start_ms": round((self.marks[start] - origin) * 1000, 1)}
+        duration = self.duration(start, end)
+        if duration is not None:
+            span["duration_ms"] = round(duration * 1000, 1)
+        child_spans = [span for span in (self._span(child, origin) for child in children) if span]
+        if child_spans:
+            span["children"] = child_spans
+        return span
+
+    def to_dict(self) -> dict:
+        if not self.marks:
+            return {"index": self.index, **self.attributes}
+        origin = min(self.marks.values())
+        ordered = sorted(self.marks.items(), key=lambda item: item[1])
+        record = {
+            "index": self.index,
+            **self.attributes,
+            "marks_ms": {name: round((timestamp - origin) * 1000, 1) for name, timestamp in ordered},
+        }
+        spans = self._span(SPAN_TREE, origin)
+        if spans:
+            record["spans"] = spans
+        return record
+
+
+class CallTrace:
+    """Traces des tours d'un appel ; `to_dict` produit l'enregistrement écrit en fin d'appel."""
+
+    def __init__(self, call_sid: str = None):
+        self.call_sid = call_sid
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.turns = []
+
+    def new_turn(self) -> TurnTrace:
+        turn = TurnTrace(len(self.turns))
+        self.turns.append(turn)
+        return turn
+
+    def to_dict(self) -> dict:
+        return {
+            "call_sid": self.call_sid,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "duration_s": round(time.monotonic() - self._started, 2),
+            "turns": [turn.to_dict() for turn in self.turns],
+        }
+
+
+class CallTraceLog:
+    """
+    Enregistrements de timing par appel : JSON Lines sur disque (si `path`) et
+    les `keep` derniers en mémoire pour l'endpoint de consultation.
+    """
+
+    def __init__(self, path: str = None, keep: int = 100):
+        self.path = path
+        self.recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def write(self, trace: CallTrace):
+        record = trace.to_dict()
+        self.recent.append(record)
+        if not self.path:
+            return
+        line = json.dumps(record, ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logging.error("Écriture de la trace d'appel impossible: %s", e)
+
+
+async def monitor_event_loop_lag(interval: float = 0.25):
+    """Tâche de fond : mesure le dépassement d'un sommeil de `interval` secondes."""
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.monotonic() - start - interval))
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+
+class PostCallQueue:
+    """
+    File bornée des traitements de fin d'appel (résumé, mise à jour du planning).
+
+    Alimentée par le webhook de statut Twilio : un même `call_sid` n'est traité
+    qu'une fois, même si Twilio renvoie l'événement ou si plusieurs statuts
+    terminaux arrivent. Un nombre fixe de workers consomme la file, pour que les
+    résumés ne concurrencent jamais les appels en cours au-delà de cette limite.
+    """
+
+    def __init__(self, handler, maxsize: int = 1000, workers: int = 4, remember: int = 10000):
+        self.handler = handler  # coroutine handler(call_sid, status)
+        self.workers = workers
+        self.remember = remember
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._seen = OrderedDict()
+        self._tasks = []
+        self.stats = {"submitted": 0, "duplicates": 0, "dropped": 0, "processed": 0, "failed": 0}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, call_sid: str, status: str) -> bool:
+        """Ajoute l'appel à la file ; retourne False s'il a déjà été soumis ou si la file est pleine."""
+        if call_sid in self._seen:
+            self.stats["duplicates"] += 1
+            return False
+        try:
+            self._queue.put_nowait((call_sid, status))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logging.error("File post-appel pleine, appel %s ignoré", call_sid)
+            return False
+        self._seen[call_sid] = status
+        if len(self._seen) > self.remember:
+            self._seen.popitem(last=False)
+        self.stats["submitted"] += 1
+        return True
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def join(self):
+        await self._queue.join()
+
+    async def _worker(self):
+        while True:
+            call_sid, status = await self._queue.get()
+            try:
+                await self.handler(call_sid, status)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error("Erreur du traitement post-appel pour %s: %s", call_sid, e)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,218 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule (
+    patient      TEXT PRIMARY KEY,          -- numéro de téléphone du patient
+    next_call_at TEXT NOT NULL,             -- ISO 8601, heure locale
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    updated_at   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_schedule_next_call ON schedule (status, next_call_at);
+
+CREATE TABLE IF NOT EXISTS calls (
+    call_sid   TEXT PRIMARY KEY,
+    patient    TEXT NOT NULL,
+    started_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_calls_patient ON calls (patient);
+"""
+
+
+def normalize_datetime(value) -> str:
+    """Retourne une date ISO 8601 à la seconde, triable lexicographiquement."""
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    else:
+        text = str(value).strip()
+        try:
+            parsed = datetime.datetime.fromisoformat(text)
+        except ValueError:
+            # Formats non zéro-paddés du CSV historique ("2025-03-6T16:25:00")
+            parsed = datetime.datetime.strptime(text, "%Y-%m-%dT%H:%M:%S")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat(timespec="seconds")
+
+
+class ScheduleStore:
+    """
+    Planning des appels dans SQLite (mode WAL) : une ligne par patient, indexée
+    sur l'heure du prochain appel. Les écritures sont des upserts d'une seule
+    ligne dans une transaction, donc en O(1) et sûres en concurrence (plusieurs
+    workers post-appel, processus de numérotation en parallèle).
+    """
+
+    def __init__(self, path: str = "call_schedule.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Une connexion par thread : sqlite3 interdit le partage entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.isolation_level = "DEFERRED"
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, patient: str, next_call_at, status: str = "pending"):
+        """Crée ou remplace le prochain appel d'un patient."""
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO schedule (patient, next_call_at, status, attempts, updated_at)
+                VALUES (?, ?, ?, 0, ?)
+                ON CONFLICT (patient) DO UPDATE SET
+                    next_call_at = excluded.next_call_at,
+                    status = excluded.status,
+                    attempts = 0,
+                    updated_at = excluded.updated_at
+                """,
+                (patient, normalize_datetime(next_call_at), status, now),
+            )
+
+    def set_status(self, patient: str, status: str, increment_attempts: bool = False):
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE schedule SET status = ?, attempts = attempts + ?, updated_at = ? WHERE patient = ?",
+                (status, 1 if increment_attempts else 0, now, patient),
+            )
+
+    def retry_later(self, patient: str, base_delay: float = 300.0, max_attempts: int = 3,
+                    only_status: str = None) -> str:
+        """
+        Reprogramme un appel non abouti (occupé, pas de réponse...) avec un délai
+        exponentiel ; au-delà de `max_attempts` tentatives, l'appel passe en échec.
+        Avec `only_status`, la ligne n'est modifiée que si elle a encore ce statut
+        (le statut de l'appel a pu arriver entre-temps). Retourne le nouveau statut,
+        ou None si la ligne n'a pas été modifiée.
+        """
+        now = datetime.datetime.now()
+        with self._connection() as conn:
+            row = conn.execute("SELECT attempts, status FROM schedule WHERE patient = ?", (patient,)).fetchone()
+            if row is None:
+                return None
+            if only_status is not None and row["status"] != only_status:
+                return None
+            attempts = row["attempts"] + 1
+            status = "failed" if attempts >= max_attempts else "pending"
+            next_call_at = now + datetime.timedelta(seconds=base_delay * 2 ** (attempts - 1))
+            conn.execute(
+                "UPDATE schedule SET status = ?, attempts = ?, next_call_at = ?, updated_at = ? WHERE patient = ?",
+                (status, attempts, next_call_at.isoformat(timespec="seconds"), now.isoformat(timespec="seconds"),
+                 patient),
+            )
+        return status
+
+    def statuses(self, patients: list) -> dict:
+        """Statut courant de plusieurs patients (pour suivre les appels en cours)."""
+        if not patients:
+            return {}
+        placeholders = ",".join("?" * len(patients))
+        rows = self._connection().execute(
+            f"SELECT patient, status FROM schedule WHERE patient IN ({placeholders})", list(patients)
+        ).fetchall()
+        return {row["patient"]: row["status"] for row in rows}
+
+    def with_status(self, status: str) -> dict:
+        """{patient: instant de la dernière mise à jour} des lignes ayant ce statut (ex. appels "dialing")."""
+        rows = self._connection().execute(
+            "SELECT patient, updated_at FROM schedule WHERE status = ?", (status,)
+        ).fetchall()
+        return {row["patient"]: datetime.datetime.fromisoformat(row["updated_at"]) for row in rows}
+
+    def record_call(self, call_sid: str, patient: str):
+        """Associe un call_sid Twilio au patient appelé."""
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO calls (call_sid, patient, started_at) VALUES (?, ?, ?)",
+                (call_sid, patient, now),
+            )
+
+    def patient_for_call(self, call_sid: str):
+        row = self._connection().execute("SELECT patient FROM calls WHERE call_sid = ?", (call_sid,)).fetchone()
+        return row["patient"] if row else None
+
+    def get(self, patient: str):
+        row = self._connection().execute("SELECT * FROM schedule WHERE patient = ?", (patient,)).fetchone()
+        return dict(row) if row else None
+
+    def iter_due(self, start, end, status: str = "pending", batch_size: int = 500, limit: int = -1):
+        """
+        Parcourt, par ordre chronologique, les appels prévus dans [start, end).
+        Les lignes sont lues par lots via l'index, sans tout charger en mémoire.
+        """
+        cursor = self._connection().execute(
+            """
+            SELECT patient, next_call_at, status, attempts FROM schedule
+            WHERE status = ? AND next_call_at >= ? AND next_call_at < ?
+            ORDER BY next_call_at
+            LIMIT ?
+            """,
+            (status, normalize_datetime(start), normalize_datetime(end), limit),
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+
+    def due_calls(self, start, end, status: str = "pending", limit: int = -1) -> list:
+        return list(self.iter_due(start, end, status, limit=limit))
+
+    def import_legacy(self, csv_path: str = None, json_path: str = None) -> int:
+        """
+        Import unique des anciens fichiers : `call_schedule.csv` (time,number) et
+        `call_schedule.json` ({call_sid: prochain rendez-vous}).
+        """
+        imported = 0
+        if csv_path and os.path.exists(csv_path):
+            with open(csv_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    self.upsert(row["number"].strip(), row["time"])
+                    imported += 1
+        if json_path and os.path.exists(json_path):
+            with open(json_path, "r", encoding="utf-8") as f:
+                for call_sid, next_appt in json.load(f).items():
+                    if not next_appt or next_appt == "None":
+                        continue
+                    # L'ancien fichier n'avait que le call_sid : il sert de clé si le patient est inconnu
+                    self.upsert(self.patient_for_call(call_sid) or call_sid, next_appt)
+                    imported += 1
+        logging.info("%s entrées importées dans %s", imported, self.path)
+        return imported
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+if __name__ == "__main__":
+    # python schedule_store.py import [call_schedule.csv] [call_schedule.json]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) >= 2 and sys.argv[1] == "import":
+        csv_file = sys.argv[2] if len(sys.argv) > 2 else "call_schedule.csv"
+        json_file = sys.argv[3] if len(sys.argv) > 3 else "call_schedule.json"
+        ScheduleStore(os.getenv("SCHEDULE_DB_PATH", "call_schedule.db")).import_legacy(csv_file, json_file)
+    else:
+        print("Usage: python schedule_store.py import [call_schedule.csv] [call_schedule.json]")
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS call_state (
+    call_sid   TEXT PRIMARY KEY,
+    version    INTEGER NOT NULL,          -- incrémentée à chaque écriture (concurrence optimiste)
+    state      TEXT NOT NULL,             -- JSON
+    updated_at REAL NOT NULL              -- time.time()
+);
+CREATE INDEX IF NOT EXISTS idx_call_state_updated ON call_state (updated_at);
+"""
+
+
+class SQLiteSessionBackend:
+    """
+    État des appels partagé par les workers d'un conteneur : une ligne SQLite
+    (mode WAL) par call_sid, à placer de préférence en mémoire partagée
+    (/dev/shm). Écriture conditionnelle sur la version lue (`compare_and_set`) :
+    deux workers qui modifient le même appel ne s'écrasent pas, le second
+    relit l'état et réapplique ses changements.
+    """
+
+    def __init__(self, path: str = "call_sessions.db", ttl: float = 3600.0):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Une connexion par thread : sqlite3 interdit le partage entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # État reconstructible (fin d'appel) : pas de fsync à chaque tour
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.isolation_level = "DEFERRED"
+            self._local.conn = conn
+        return conn
+
+    def version(self, call_sid: str) -> int:
+        row = self._connection().execute("SELECT version FROM call_state WHERE call_sid = ?", (call_sid,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, call_sid: str):
+        row = self._connection().execute(
+            "SELECT version, state FROM call_state WHERE call_sid = ?", (call_sid,)
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def compare_and_set(self, call_sid: str, version: int, state: dict) -> bool:
+        data = json.dumps(state, ensure_ascii=False)
+        now = time.time()
+        with self._connection() as conn:
+            if version == 0:
+                cursor = conn.execute(
+                    "INSERT INTO call_state (call_sid, version, state, updated_at) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT (call_sid) DO NOTHING",
+                    (call_sid, data, now),
+                )
+                if cursor.rowcount:
+                    # Nouvel appel : les états abandonnés (appel sans statut final) sont nettoyés
+                    conn.execute("DELETE FROM call_state WHERE updated_at < ?", (now - self.ttl,))
+            else:
+                cursor = conn.execute(
+                    "UPDATE call_state SET version = version + 1, state = ?, updated_at = ? "
+                    "WHERE call_sid = ? AND version = ?",
+                    (data, now, call_sid, version),
+                )
+        return cursor.rowcount == 1
+
+    def delete(self, call_sid: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM call_state WHERE call_sid = ?", (call_sid,))
+
+
+def create_session_backend(name: str, path: str = None, ttl: float = 3600.0):
+    """Backend d'état partagé : "memory" (un worker) ou "sqlite" (plusieurs workers d'un conteneur)."""
+    if name == "memory":
+        return None
+    if name == "sqlite":
+        return SQLiteSessionBackend(path or "call_sessions.db", ttl=ttl)
+    raise ValueError(f"Backend de sessions inconnu: {name}")
+
+
+class SessionStore:
+    """
+    Stockage en mémoire des sessions d'appel, borné en taille et en durée.
+
+    - LRU : au-delà de `max_sessions`, la session la moins récemment utilisée est évincée ;
+    - TTL : une session inactive depuis `ttl` secondes est évincée ;
+    - fin d'appel : `release` retire la session dès que le traitement post-appel est fait.
+
+    Avec un `backend` partagé, ce stockage devient le cache local d'un état
+    commun à tous les workers : chaque connexion /media-stream d'un appel peut
+    arriver sur un worker différent. `open` ne relit l'état partagé que si sa
+    version a changé depuis la dernière lecture ou écriture locale ; les tours
+    suivants de la connexion n'y touchent plus. `save_soon` écrit l'état après
+    chaque tour, en tâche de fond et hors de la boucle d'événements, avec la
+    version connue ; en cas de conflit, l'état partagé est relu et les
+    changements locaux réappliqués (`rebase`).
+
+    Les sessions partagées exposent `call_sid`, `version`, `changes` (nombre de
+    changements locaux pas encore écrits), `snapshot()` (état sérialisable),
+    `restore(état)`, `rebase(état distant)` (état distant + changements locaux)
+    et `mark_synced(n)` (les n premiers changements sont écrits).
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 3600.0, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.backend = backend
+        self._sessions = OrderedDict()  # call_sid -> (session, dernier accès)
+        self._saving = {}  # call_sid -> tâche d'écriture en cours
+        self.evictions = {"ttl": 0, "lru": 0, "released": 0}
+        self.shared = {"hits": 0, "loads": 0, "saves": 0, "conflicts": 0, "errors": 0}
+
+    def get(self, call_sid: str):
+        entry = self._sessions.get(call_sid)
+        if entry is None:
+            return None
+        session, last_access = entry
+        if time.monotonic() - last_access > self.ttl:
+            self._evict(call_sid, "ttl")
+            return None
+        self._sessions[call_sid] = (session, time.monotonic())
+        self._sessions.move_to_end(call_sid)
+        return session
+
+    def get_or_create(self, call_sid: str, factory):
+        session = self.get(call_sid)
+        if session is None:
+            session = factory(call_sid)
+            self.put(call_sid, session)
+        return session
+
+    def put(self, call_sid: str, session):
+        self._sessions[call_sid] = (session, time.monotonic())
+        self._sessions.move_to_end(call_sid)
+        self.sweep()
+        while len(self._sessions) > self.max_sessions:
+            oldest = next(iter(self._sessions))
+            self._evict(oldest, "lru")
+
+    def release(self, call_sid: str):
+        """Retire la session d'un appel terminé (et son état partagé)."""
+        if call_sid in self._sessions:
+            self._evict(call_sid, "released")
+        if self.backend is not None:
+            saving = self._saving.pop(call_sid, None)
+            if saving is not None:
+                saving.cancel()
+            asyncio.get_running_loop().run_in_executor(None, self.backend.delete, call_sid)
+
+    # --- État partagé entre workers ---
+    async def open(self, call_sid: str, factory, create: bool = True):
+        """
+        Session d'un appel au début d'une connexion : cache local s'il est à
+        jour, sinon construite par `factory(call_sid)` (coroutine) et alimentée
+        par l'état partagé. Retourne None si l'appel est inconnu et `create` est faux.
+        """
+        session = self.get(call_sid)
+        if self.backend is None:
+            if session is None and create:
+                session = await factory(call_sid)
+                # Une autre connexion a pu créer la session pendant la construction
+                session = self.get(call_sid) or session
+                self.put(call_sid, session)
+            return session
+        try:
+            if session is not None:
+                version = await asyncio.to_thread(self.backend.version, call_sid)
+                if version == session.version:
+                    self.shared["hits"] += 1
+                    return session
+            loaded = await asyncio.to_thread(self.backend.load, call_sid)
+        except Exception as e:
+            # État partagé indisponible : la connexion continue avec l'état local
+            self.shared["errors"] += 1
+            logging.error("Lecture de l'état partagé de l'appel %s impossible: %s", call_sid, e)
+            loaded = None
+        if loaded is None:
+            if session is None and create:
+                session = await factory(call_sid)
+                session = self.get(call_sid) or session
+                self.put(call_sid, session)
+            return session
+        version, state = loaded
+        if session is None:
+            session = self.get(call_sid) or await factory(call_sid)
+            self.put(call_sid, session)
+        if version > session.version:
+            self.shared["loads"] += 1
+            # Changements locaux pas encore écrits : conservés par-dessus l'état relu
+            session.restore(session.rebase(state) if session.changes else state)
+            session.version = version
+        return session
+
+    def save_soon(self, session):
+        """Écrit l'état de la session en tâche de fond (une écriture à la fois par appel)."""
+        if self.backend is None:
+            return
+        saving = self._saving.get(session.call_sid)
+        if saving is None or saving.done():
+            self._saving[session.call_sid] = asyncio.create_task(self._save_loop(session))
+
+    async def _save_loop(self, session):
+        call_sid = session.call_sid
+        while session.changes:
+            try:
+                await self.save(session)
+            except Exception as e:
+                self.shared["errors"] += 1
+                logging.error("Écriture de l'état partagé de l'appel %s impossible: %s", call_sid, e)
+                return
+
+    async def save(self, session, max_attempts: int = 5):
+        """Écriture conditionnelle (version connue) ; en cas de conflit, relecture et réapplication."""
+        call_sid = session.call_sid
+        changes, state = session.changes, session.snapshot()
+        for _ in range(max_attempts):
+            if await asyncio.to_thread(self.backend.compare_and_set, call_sid, session.version, state):
+                session.version += 1
+                session.mark_synced(changes)
+                self.shared["saves"] += 1
+                return
+            self.shared["conflicts"] += 1
+            loaded = await asyncio.to_thread(self.backend.load, call_sid)
+            if loaded is None:
+                # État supprimé entre-temps (fin d'appel traitée par un autre worker)
+                session.version = 0
+                continue
+            version, remote = loaded
+            changes, state = session.changes, session.rebase(remote)
+            session.restore(state)
+            session.version = version
+        raise RuntimeError(f"conflits répétés sur l'appel {call_sid}")
+
+    async def flush(self, call_sid: str):
+        """Attend l'écriture en cours de l'état d'un appel."""
+        saving = self._saving.get(call_sid)
+        if saving is not None:
+            await asyncio.gather(saving, return_exceptions=True)
+
+    def sweep(self):
+        """Évince les sessions expirées (les plus anciennes sont en tête)."""
+        now = time.monotonic()
+        while self._sessions:
+            call_sid, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl:
+                break
+            self._evict(call_sid, "ttl")
+
+    def _evict(self, call_sid: str, reason: str):
+        self._sessions.pop(call_sid, None)
+        self.evictions[reason] += 1
+        if reason != "released":
+            logging.info("Session %s évincée (%s)", call_sid, reason)
+
+    def __contains__(self, call_sid: str) -> bool:
+        return call_sid in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def memory_usage(self) -> int:
+        """Estimation en octets de la mémoire occupée par les sessions."""
+        total = sys.getsizeof(self._sessions)
+        for session, _ in self._sessions.values():
+            usage = getattr(session, "memory_usage", None)
+            total += usage() if usage else sys.getsizeof(session)
+        return total
+
+    def stats(self) -> dict:
+        stats = {
+            "sessions": len(self._sessions),
+            "memory_bytes": self.memory_usage(),
+            "evictions": dict(self.evictions),
+        }
+        if self.backend is not None:
+            stats["shared"] = dict(self.shared)
+        return stats
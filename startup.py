@@ -0,0 +1,141 @@
+"""
+Démarrage d'un worker : les clients coûteux à construire (SDK lourds,
+connexions) sont créés au premier usage (`Lazy`), et le préchauffage qui les
+prépare avant le premier appel s'exécute en parallèle au démarrage (`Warmup`).
+
+Le préchauffage tourne en tâche de fond : le worker accepte les requêtes
+aussitôt, mais /ready répond 503 tant qu'il n'est pas terminé, pour que la
+répartition de charge ne lui envoie pas d'appel à froid.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+
+class Lazy:
+    """
+    Ressource construite au premier `get()`, une seule fois même depuis
+    plusieurs threads. `set()` la remplace (substituts des tests et benchmarks).
+    """
+
+    def __init__(self, factory, name: str = None):
+        self.factory = factory
+        self.name = name or getattr(factory, "__name__", "ressource")
+        self.seconds = None  # durée de construction
+        self._value = None
+        self._created = False
+        self._lock = threading.Lock()
+
+    @property
+    def created(self) -> bool:
+        return self._created
+
+    def get(self):
+        if not self._created:
+            with self._lock:
+                if not self._created:
+                    start = time.monotonic()
+                    self._value = self.factory()
+                    self.seconds = time.monotonic() - start
+                    self._created = True
+                    logging.info("%s créé en %.0f ms", self.name, self.seconds * 1000)
+        return self._value
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+            self._created = True
+
+
+class Warmup:
+    """
+    Étapes de préchauffage (coroutines sans argument) lancées en parallèle ;
+    celles de `skip` sont ignorées. Une étape en échec est retentée `retries`
+    fois, `retry_delay` secondes plus tard. Le worker est prêt quand toutes les
+    étapes sont terminées, ou au bout de `timeout` secondes : il sert alors en
+    mode dégradé (étapes en échec ou encore en cours listées par `status`)
+    plutôt que de rester hors service.
+    """
+
+    def __init__(self, timeout: float = 30.0, retries: int = 2, retry_delay: float = 2.0, skip=(), on_step=None):
+        self.timeout = timeout
+        self.skip = set(skip)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_step = on_step  # appelé avec (étape, secondes, réussite)
+        self.steps = {}
+        self.results = {}  # étape -> {"status": "pending" | "ok" | "failed", "seconds", "error"}
+        self.started_at = None
+        self.ready_seconds = None  # du lancement du préchauffage à l'état prêt
+        self.ready = False
+        self._task = None
+        self._step_tasks = []
+
+    def add(self, name: str, step):
+        if name not in self.skip:
+            self.steps[name] = step
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.results = {name: {"status": "pending"} for name in self.steps}
+        self._task = asyncio.create_task(self._run())
+
+    async def _run_step(self, name: str, step):
+        start = time.monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                detail = await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Préchauffage %s échoué (tentative %d): %s", name, attempt + 1, e)
+                self.results[name] = {"status": "failed", "error": str(e) or type(e).__name__}
+                if attempt < self.retries:
+                    await asyncio.sleep(self.retry_delay)
+                continue
+            self.results[name] = {"status": "ok"}
+            if detail is not None:
+                self.results[name]["detail"] = detail
+            break
+        seconds = time.monotonic() - start
+        self.results[name]["seconds"] = round(seconds, 3)
+        if self.on_step:
+            self.on_step(name, seconds, self.results[name]["status"] == "ok")
+
+    async def _run(self):
+        self._step_tasks = [asyncio.create_task(self._run_step(name, step)) for name, step in self.steps.items()]
+        if self._step_tasks:
+            # Les étapes non terminées au délai continuent en fond
+            await asyncio.wait(self._step_tasks, timeout=self.timeout)
+        self.ready_seconds = time.monotonic() - self.started_at
+        self.ready = True
+        degraded = self.degraded()
+        if degraded:
+            logging.warning("Worker prêt en %.2f s, préchauffage incomplet: %s", self.ready_seconds, degraded)
+        else:
+            logging.info("Worker prêt en %.2f s", self.ready_seconds)
+
+    def degraded(self) -> list:
+        return [name for name, result in self.results.items() if result["status"] != "ok"]
+
+    async def wait(self, timeout: float = None) -> bool:
+        """Attend l'état prêt (au plus `timeout` secondes) ; retourne `ready`."""
+        if self._task is not None:
+            await asyncio.wait({self._task}, timeout=timeout)
+        return self.ready
+
+    def status(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else None
+        return {
+            "ready": self.ready,
+            "seconds": round(self.ready_seconds if self.ready else elapsed or 0.0, 3),
+            "degraded": self.degraded() if self.ready else [],
+            "steps": self.results,
+        }
+
+    async def stop(self):
+        for task in self._step_tasks + ([self._task] if self._task else []):
+            task.cancel()
+        await asyncio.gather(*self._step_tasks, *([self._task] if self._task else []), return_exceptions=True)
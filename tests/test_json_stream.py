@@ -0,0 +1,23 @@
+from LLM.json_stream import JSONStreamParser, parse_json_object
+
+
+def test_truncated_string_member_is_dropped():
+    assert parse_json_object('{"food": "bien", "next_appointment_datetime": "2026-10-2') == {"food": "bien"}
+
+
+def test_truncated_number_member_is_dropped():
+    assert parse_json_object('{"a": 1, "b": 12') == {"a": 1}
+
+
+def test_complete_members_of_open_containers_are_kept():
+    assert parse_json_object('{"food": "bien"') == {"food": "bien"}
+    assert parse_json_object('{"interests": ["jardin", "cuis') == {"interests": ["jardin"]}
+
+
+def test_value_grows_with_deltas():
+    parser = JSONStreamParser()
+    parser.feed('Voici : {"sleep": "ma')
+    assert parser.value() == {}
+    parser.feed('l dormi"}')
+    assert parser.complete
+    assert parser.value() == {"sleep": "mal dormi"}
@@ -0,0 +1,18 @@
+from LLM.response_cache import ResponseCache
+
+STEP = "Sommeil et alimentation"
+
+
+def test_similar_lookup_ignores_negated_utterance():
+    cache = ResponseCache(similarity=0.92, templates={})
+    assert cache.put(STEP, "oui j ai bien dormi cette nuit merci beaucoup",
+                     "Parfait, je suis ravie que vous ayez bien dormi.")
+    assert cache.lookup(STEP, "oui j ai pas bien dormi cette nuit merci beaucoup") == (None, "miss")
+    assert cache.lookup(STEP, "j ai pas dormi comme un bébé toute la nuit") == (None, "miss")
+
+
+def test_similar_lookup_allows_filler_variants():
+    cache = ResponseCache(similarity=0.92, templates={})
+    reply = "Parfait, je suis ravie que vous ayez bien dormi."
+    cache.put(STEP, "oui j ai bien dormi cette nuit merci beaucoup", reply)
+    assert cache.lookup(STEP, "euh oui j ai bien dormi cette nuit merci beaucoup") == (reply, "similar")
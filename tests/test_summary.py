@@ -0,0 +1,19 @@
+from LLM.json_stream import parse_json_object
+from LLM.summary import RollingSummary, parse_appointment
+
+
+def test_appointment_without_time_is_rejected():
+    assert parse_appointment("2026-10-20") is None
+
+
+def test_appointment_with_time_is_normalized():
+    assert parse_appointment("2026-10-20 14:30") == "2026-10-20T14:30:00"
+    assert parse_appointment("2026-10-20T14:30:00Z") == "2026-10-20T14:30:00"
+
+
+def test_truncated_extraction_keeps_previous_appointment():
+    summary = RollingSummary()
+    summary.merge({"next_appointment_datetime": "2026-10-20T14:30:00"})
+    summary.merge(parse_json_object('{"sleep": "bien", "next_appointment_datetime": "2026-10-2'))
+    assert summary.fields["next_appointment_datetime"] == "2026-10-20T14:30:00"
+    assert summary.fields["sleep"] == "bien"
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+
+# États de la détection de fin de tour
+LISTENING = "listening"            # patient silencieux ou en train de parler
+AWAITING_FINAL = "awaiting_final"  # fin de tour détectée, résultat final STT attendu
+CLOSED = "closed"
+
+# Tour du patient prêt à recevoir une réponse ; instants en time.monotonic. `resumed` : le tour
+# reprend une réponse interrompue par le patient
+UserTurn = namedtuple("UserTurn", "text last_audio stt_final endpoint resumed", defaults=(False,))
+
+
+class TurnPipeline:
+    """
+    Tours de parole d'une connexion /media-stream, sans verrou partagé avec les
+    threads du SDK STT.
+
+    Les callbacks du recognizer (`on_recognizing`, `on_recognized`) ne font que
+    déposer l'événement dans une file asyncio via `call_soon_threadsafe` ; la
+    fin de tour de la VAD (`EndpointDetector`) y est branchée directement. Une
+    tâche consomme cette file et applique la machine à états :
+
+    - LISTENING : les résultats finaux s'accumulent ; une fin de tour VAD clôt
+      le tour, de même qu'un silence de `silence_timeout` secondes après le
+      dernier résultat final si la VAD ne s'est pas déclenchée (filet de sécurité) ;
+    - AWAITING_FINAL : fin de tour VAD sans résultat final, attendu au plus
+      `final_wait` secondes avant de retenir le dernier partiel (le résultat
+      final correspondant sera ignoré).
+
+    Les tours clos passent dans une seconde file, consommée par une autre tâche
+    qui appelle `respond(tour)` : la reconnaissance n'est jamais bloquée par la
+    génération et la lecture d'une réponse.
+
+    `respond` retourne une fonction d'enregistrement du tour (historique), ou
+    None. Avec `barge_in`, elle n'est appelée qu'une fois la réponse entièrement
+    jouée (marks Twilio déclarés par `track_mark`, acquittés par `on_mark`) : si
+    le patient parle pendant la génération ou la lecture (partiel STT, ou parole
+    détectée par la VAD pendant `barge_in_ms`), la réponse est annulée, jamais
+    enregistrée, `on_barge_in(tour, phase)` est appelée (vidage de l'audio en
+    file) et le texte du tour interrompu précède celui de la nouvelle prise de
+    parole dans le tour suivant.
+    """
+
+    def __init__(self, respond, endpointer, speculator=None, final_wait: float = 0.8, silence_timeout: float = 1.0,
+                 barge_in: bool = False, barge_in_ms: int = 300, on_barge_in=None):
+        self.respond = respond  # coroutine respond(UserTurn) -> fonction d'enregistrement ou None
+        self.endpointer = endpointer
+        self.speculator = speculator
+        self.final_wait = final_wait
+        self.silence_timeout = silence_timeout
+        self.barge_in = barge_in
+        self.barge_in_ms = barge_in_ms
+        self.on_barge_in = on_barge_in  # coroutine on_barge_in(UserTurn, "generating" | "playing")
+        self._loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.turns = asyncio.Queue()
+        self.state = LISTENING
+        self.responding = False
+        self._segments = []  # résultats finaux du tour en cours
+        self._carry = ""  # texte d'un tour dont la réponse a été interrompue
+        self._partial = ""  # hypothèse STT en cours, pas encore finalisée
+        self._discard_next_final = False
+        self._last_final_at = None
+        self._deadline = None
+        self._tasks = set()
+        # Réponse en cours : tour, tâche de génération, enregistrement en attente, marks non joués
+        self._answer_turn = None
+        self._answer_task = None
+        self._commit = None
+        self._marks = set()
+        self._speech_check = None
+        self.stats = {"turns": 0, "partial_fallbacks": 0, "silence_timeouts": 0, "barge_ins": 0}
+        endpointer.on_endpoint = self.on_endpoint
+        if barge_in:
+            endpointer.on_speech_start = self._on_speech_start
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        self._spawn(self._process_events())
+        self._spawn(self._process_turns())
+
+    def close(self):
+        """Fin de la connexion : une réponse en cours de génération est abandonnée, une réponse jouée est enregistrée."""
+        self.state = CLOSED
+        for task in list(self._tasks):
+            task.cancel()
+        if self._answer_task and not self._answer_task.done():
+            self._answer_task.cancel()
+        if self._speech_check:
+            self._speech_check.cancel()
+        self._flush_commit()
+
+    # --- Threads du SDK STT ---
+    def on_recognizing(self, text: str):
+        self._post("partial", text)
+
+    def on_recognized(self, text: str):
+        self._post("final", text)
+
+    def _post(self, kind: str, text: str):
+        if self.state != CLOSED:
+            self._loop.call_soon_threadsafe(self.events.put_nowait, (kind, text, time.monotonic()))
+
+    # --- Boucle d'événements ---
+    def on_endpoint(self, latency_ms: float = None):
+        """Fin de tour détectée par la VAD (appelée sur la boucle d'événements)."""
+        self.events.put_nowait(("endpoint", None, time.monotonic()))
+
+    def track_mark(self, name: str):
+        """Mark envoyé après un morceau de la réponse en cours."""
+        self._marks.add(name)
+
+    def on_mark(self, name: str):
+        """Mark renvoyé par Twilio : l'audio qui le précède a été joué."""
+        self._marks.discard(name)
+        if not self._marks and not self.responding:
+            self._flush_commit()
+
+    @property
+    def transcript(self) -> str:
+        return " ".join([self._carry] + self._segments).strip()
+
+    @property
+    def interruptible(self) -> bool:
+        """Une réponse est en cours de génération ou de lecture."""
+        return self._answer_turn is not None and (self.responding or bool(self._marks))
+
+    def _timeout(self):
+        now = time.monotonic()
+        if self.state == AWAITING_FINAL:
+            return max(0.0, self._deadline - now)
+        if self._segments or self._carry:
+            remaining = self._last_final_at + self.silence_timeout - now
+            if remaining <= 0 and self.endpointer.speaking:
+                return self.silence_timeout  # le patient parle encore : nouvelle vérification plus tard
+            return max(0.0, remaining)
+        return None
+
+    async def _process_events(self):
+        while True:
+            try:
+                kind, text, at = await asyncio.wait_for(self.events.get(), self._timeout())
+            except asyncio.TimeoutError:
+                self._on_timeout()
+                continue
+            if kind == "partial":
+                self._on_partial(text)
+            elif kind == "final":
+                self._on_final(text, at)
+            elif kind == "endpoint":
+                self._on_endpoint()
+
+    def _on_partial(self, text: str):
+        if self._discard_next_final:
+            # Suite du segment déjà retenu pour le tour précédent
+            return
+        self._partial = text
+        if self.barge_in and self.interruptible:
+            self._interrupt("stt")
+        self.endpointer.on_partial(text)
+        if self.speculator:
+            self.speculator.on_partial(f"{self.transcript} {text}".strip())
+
+    def _on_final(self, text: str, at: float):
+        self._partial = ""
+        if self._discard_next_final:
+            # Le partiel de ce segment a déjà été retenu pour le tour précédent
+            self._discard_next_final = False
+            return
+        self._segments.append(text)
+        self._last_final_at = at
+        logging.info("Texte reconnu: %s", text)
+        if self.state == AWAITING_FINAL:
+            self._end_turn()
+            return
+        self.endpointer.on_final(text)
+        if self.speculator:
+            self.speculator.on_partial(self.transcript)
+
+    def _on_endpoint(self):
+        if self._segments:
+            self._end_turn()
+        else:
+            # Fin de tour détectée avant le résultat final : on l'attend brièvement
+            self.state = AWAITING_FINAL
+            self._deadline = time.monotonic() + self.final_wait
+
+    def _on_timeout(self):
+        if self.state == AWAITING_FINAL:
+            self.state = LISTENING
+            if self._partial:
+                # Toujours pas de résultat final : on utilise le dernier partiel
+                self._segments = [self._partial]
+                self._partial = ""
+                self._discard_next_final = True
+                self.stats["partial_fallbacks"] += 1
+                self._end_turn()
+        elif (self._segments or self._carry) and not self.endpointer.speaking:
+            self.stats["silence_timeouts"] += 1
+            self._end_turn()
+
+    def _end_turn(self):
+        turn = UserTurn(self.transcript, self.endpointer.last_voice_time, self._last_final_at, time.monotonic(),
+                        resumed=bool(self._carry))
+        self._segments = []
+        self._carry = ""
+        self._last_final_at = None
+        self._deadline = None
+        self.state = LISTENING
+        self.endpointer.reset_turn()
+        self.stats["turns"] += 1
+        logging.info("Fin de tour. Texte brut: %s", turn.text)
+        self.turns.put_nowait(turn)
+
+    # --- Interruptions ---
+    def _on_speech_start(self):
+        # Parole détectée par la VAD : interruption si elle dure `barge_in_ms` (pas un bruit bref)
+        if self.interruptible and self._speech_check is None:
+            self._speech_check = self._loop.call_later(self.barge_in_ms / 1000, self._confirm_speech)
+
+    def _confirm_speech(self):
+        self._speech_check = None
+        if self.state != CLOSED and self.endpointer.speaking and self.interruptible:
+            self._interrupt("vad")
+
+    def _interrupt(self, source: str):
+        turn = self._answer_turn
+        phase = "generating" if self.responding else "playing"
+        self._answer_turn = None
+        self._commit = None
+        self._marks.clear()
+        if self._answer_task and not self._answer_task.done():
+            self._answer_task.cancel()
+        self.stats["barge_ins"] += 1
+        logging.info("Réponse interrompue par le patient (%s, %s): %s", source, phase, turn.text)
+        # Le tour est repris avec la nouvelle prise de parole
+        self._carry = f"{self._carry} {turn.text}".strip()
+        if self._last_final_at is None:
+            self._last_final_at = time.monotonic()
+        if self.on_barge_in:
+            self._spawn(self.on_barge_in(turn, phase))
+
+    # --- Réponses ---
+    def _flush_commit(self):
+        commit, self._commit = self._commit, None
+        self._answer_turn = None
+        if commit:
+            try:
+                commit()
+            except Exception as e:
+                logging.error("Erreur lors de l'enregistrement du tour: %s", e)
+
+    async def _process_turns(self):
+        while True:
+            turn = await self.turns.get()
+            # Réponse précédente encore en lecture : elle fait partie de l'historique du nouveau tour
+            self._flush_commit()
+            self._answer_turn = turn
+            self._answer_task = task = asyncio.create_task(self.respond(turn))
+            self.responding = True
+            try:
+                await asyncio.wait((task,))
+            finally:
+                self.responding = False
+            if task.cancelled():
+                continue
+            if task.exception():
+                logging.error("Erreur pendant le traitement du tour: %s", task.exception())
+                self._answer_turn = None
+                continue
+            if self._answer_turn is turn:
+                self._commit = task.result()
+                if not self.barge_in or not self._marks:
+                    self._flush_commit()